@@ -0,0 +1,136 @@
+"""
+Admission control - Giới hạn số request inference được nhận cùng lúc
+Mỗi loại công việc (detect interactive, video frame, batch) có số slot xử lý và
+hàng đợi riêng có giới hạn; khi hàng đợi đầy request bị từ chối ngay (429) với
+Retry-After ước tính từ tốc độ xử lý hiện tại, thay vì dồn vào thread pool rồi timeout
+"""
+
+import asyncio
+import math
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+
+class AdmissionRejected(Exception):
+    """Hàng đợi đã đầy, request bị từ chối"""
+
+    def __init__(self, name, retry_after):
+        super().__init__(f"Admission queue {name} is full")
+        self.name = name
+        self.retry_after = retry_after
+
+
+class AdmissionQueue:
+    """
+    Hàng đợi admission cho 1 loại công việc (dùng trên 1 event loop)
+    """
+
+    # Hệ số EWMA cho thời gian xử lý mỗi request
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, name, max_concurrent, max_queue):
+        """
+        Parameters:
+        - name: tên loại công việc (detect / video / batch)
+        - max_concurrent: số request được xử lý đồng thời
+        - max_queue: số request tối đa chờ slot, vượt quá thì bị từ chối
+        """
+        self.name = name
+        self.max_concurrent = max(1, int(max_concurrent))
+        self.max_queue = max(0, int(max_queue))
+
+        self.active = 0
+        self._waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.completed = 0
+        self.service_time = None  # EWMA thời gian giữ slot (giây)
+
+    @property
+    def queue_depth(self):
+        return len(self._waiters)
+
+    def retry_after(self):
+        """Số giây ước tính tới khi hàng đợi có chỗ (theo tốc độ xử lý hiện tại)"""
+        service_time = self.service_time if self.service_time is not None else 1.0
+        backlog = self.active + len(self._waiters)
+        return max(1, math.ceil(backlog * service_time / self.max_concurrent))
+
+    async def acquire(self):
+        """
+        Chờ slot xử lý
+
+        Raises:
+        - AdmissionRejected: hàng đợi đã đầy
+        """
+        if self.active < self.max_concurrent and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return
+        if len(self._waiters) >= self.max_queue:
+            self.rejected += 1
+            raise AdmissionRejected(self.name, self.retry_after())
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Slot đã được chuyển cho request này nhưng client đã hủy -> trả lại
+                self._handoff()
+            else:
+                self._waiters.remove(waiter)
+            raise
+        self.admitted += 1
+
+    def release(self, service_time=None):
+        """
+        Trả slot sau khi xử lý xong
+
+        Parameters:
+        - service_time: thời gian đã giữ slot (giây) để cập nhật tốc độ xử lý
+        """
+        if service_time is not None:
+            if self.service_time is None:
+                self.service_time = service_time
+            else:
+                self.service_time += self.EWMA_ALPHA * (service_time - self.service_time)
+        self.completed += 1
+        self._handoff()
+
+    def _handoff(self):
+        """Chuyển slot cho request đang chờ lâu nhất (nếu có)"""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.active -= 1
+
+    @asynccontextmanager
+    async def slot(self):
+        """async with queue.slot(): ... - giữ 1 slot trong suốt khối lệnh"""
+        await self.acquire()
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - started)
+
+    def stats(self):
+        return {
+            "max_concurrent": self.max_concurrent,
+            "max_queue": self.max_queue,
+            "active": self.active,
+            "queue_depth": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "completed": self.completed,
+            "service_time_ms": round(self.service_time * 1000, 3) if self.service_time is not None else None,
+            "service_rate_per_s": (
+                round(self.max_concurrent / self.service_time, 3) if self.service_time else None
+            ),
+            "retry_after_s": self.retry_after()
+        }
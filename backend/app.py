@@ -2,24 +2,40 @@
 FastAPI Backend cho Object Detection System
 """
 
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, WebSocket, WebSocketDisconnect, Depends, Request, Header
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from starlette.background import BackgroundTask
 import uvicorn
 import os
 import base64
-import tempfile
 import uuid
 import socket
 import asyncio
+import json
+import struct
 from pathlib import Path
 from io import BytesIO
 from PIL import Image
 import numpy as np
+import cv2
 from typing import List, Optional
 
-from inference import ObjectDetector
+from inference import ObjectDetector, decode_image_bytes, decode_image_reduced
+from detections import Detections
+from model_registry import model_registry
+from scheduler import InferenceScheduler, DeadlineExceeded, check_deadline, time_left
+from admission import AdmissionQueue, AdmissionRejected
+from batch_engine import BatchEngine, RunningSummary
+from jobs import JobManager
+from result_cache import ResultCache
 from tracker import VideoTracker
+from sessions import SessionManager
+from frame_sequencer import FrameSequencer, FrameDropped
+from session_store import create_session_store
+from video_pipeline import VideoPipeline, OUTPUT_FORMATS
+import shutil
+import tempfile
 import time
 from collections import defaultdict
 
@@ -56,7 +72,7 @@ app.add_middleware(
     CORSMiddleware,
     allow_origins=allowed_origins,
     allow_credentials=True,
-    allow_methods=["GET", "POST", "OPTIONS"],
+    allow_methods=["GET", "POST", "DELETE", "OPTIONS"],
     allow_headers=["*"],
     expose_headers=["*"],
 )
@@ -81,99 +97,383 @@ if MODEL_PATH is None:
         "nằm trong thư mục gốc của dự án hoặc chỉnh MODEL_PATH trong app.py"
     )
 
+# Backend inference: torch (mặc định) | onnx | torchscript | onnx-int8 - model được export 1 lần, cache cạnh best.pt
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "torch").strip().lower()
+INFERENCE_IMGSZ = int(os.getenv("INFERENCE_IMGSZ", "640"))
+
 try:
-    detector = ObjectDetector(
-        model_path=MODEL_PATH,
+    # Model được load 1 lần và dùng chung cho mọi endpoint và tracking session
+    detector = model_registry.get(
+        MODEL_PATH,
         conf_threshold=0.25,
-        iou_threshold=0.45
+        iou_threshold=0.45,
+        backend=INFERENCE_BACKEND,
+        imgsz=INFERENCE_IMGSZ
     )
-    print(f"✅ Model loaded successfully from: {MODEL_PATH}")
+    print(f"✅ Model loaded successfully from: {MODEL_PATH} (backend: {INFERENCE_BACKEND})")
 except Exception as e:
     print(f"❌ Error loading model: {e}")
     detector = None
 
+# Micro-batching scheduler: gom các frame đồng thời từ /api/detect và /api/detect-video
+# thành 1 lần predict. Tune window theo p99 latency qua /api/metrics
+INFERENCE_BATCH_WINDOW_MS = float(os.getenv("INFERENCE_BATCH_WINDOW_MS", "8"))
+INFERENCE_MAX_BATCH_SIZE = int(os.getenv("INFERENCE_MAX_BATCH_SIZE", "8"))
+scheduler = InferenceScheduler(
+    detector,
+    window_ms=INFERENCE_BATCH_WINDOW_MS,
+    max_batch_size=INFERENCE_MAX_BATCH_SIZE
+) if detector is not None else None
+
+# Kích thước input theo request: /api/detect nhận imgsz hoặc latency_budget_ms (chọn imgsz
+# lớn nhất trong ADAPTIVE_IMGSZ_CHOICES vừa budget). REDUCED_JPEG_DECODE: JPEG lớn được
+# decode ở 1/2, 1/4, 1/8 kích thước (vẫn >= imgsz), boxes được đổi về tọa độ ảnh gốc
+REDUCED_JPEG_DECODE = os.getenv("REDUCED_JPEG_DECODE", "1").strip().lower() in ("1", "true", "yes")
+ADAPTIVE_IMGSZ_CHOICES = [int(size) for size in os.getenv("ADAPTIVE_IMGSZ_CHOICES", "320,416,512,640").split(",")]
+MIN_IMGSZ = 32
+MAX_IMGSZ = 1280
+
+# Admission control: mỗi loại công việc có số slot xử lý + hàng đợi giới hạn riêng,
+# hàng đợi đầy -> 429 với Retry-After (theo dạng "slots:queue", vd. ADMISSION_DETECT=8:32)
+def parse_admission_limits(name, default):
+    slots, queue = os.getenv(f"ADMISSION_{name.upper()}", default).split(":")
+    return AdmissionQueue(name, int(slots), int(queue))
+
+
+admission_queues = {
+    "detect": parse_admission_limits("detect", "8:32"),
+    "video": parse_admission_limits("video", "8:32"),
+    "batch": parse_admission_limits("batch", "2:4")
+}
+
+
+def admission_slot(name):
+    """Dependency giữ 1 slot admission của loại công việc name trong suốt request"""
+    queue = admission_queues[name]
+    
+    async def dependency():
+        async with queue.slot():
+            yield
+    
+    return dependency
+
+
+# Deadline của request: REQUEST_TIMEOUT_S, hoặc ngắn hơn nếu client gửi header
+# X-Request-Deadline-Ms. Công việc quá deadline bị bỏ trước khi predict và giữa các bước xử lý
+REQUEST_TIMEOUT_S = float(os.getenv("REQUEST_TIMEOUT_S", "30"))
+
+
+def request_deadline(x_request_deadline_ms: Optional[float] = Header(None)) -> float:
+    """Dependency tính deadline (time.monotonic()) của request lúc nhận request"""
+    budget = REQUEST_TIMEOUT_S
+    if x_request_deadline_ms is not None and x_request_deadline_ms > 0:
+        budget = min(budget, x_request_deadline_ms / 1000.0)
+    return time.monotonic() + budget
+
+
+@app.exception_handler(AdmissionRejected)
+async def admission_rejected_handler(request: Request, exc: AdmissionRejected):
+    return JSONResponse(
+        status_code=429,
+        content={"detail": f"Server đang quá tải. Vui lòng thử lại sau {exc.retry_after} giây."},
+        headers={"Retry-After": str(exc.retry_after)}
+    )
+
+# Cache kết quả /api/detect theo nội dung ảnh (RESULT_CACHE_MAX_ENTRIES=0 để tắt)
+# RESULT_CACHE_RENDERED=0: chỉ cache request render=none (không giữ ảnh đã vẽ trong memory)
+RESULT_CACHE_MAX_ENTRIES = int(os.getenv("RESULT_CACHE_MAX_ENTRIES", "1024"))
+RESULT_CACHE_MAX_MB = float(os.getenv("RESULT_CACHE_MAX_MB", "256"))
+RESULT_CACHE_RENDERED = os.getenv("RESULT_CACHE_RENDERED", "1").strip().lower() in ("1", "true", "yes")
+result_cache = ResultCache(
+    max_entries=RESULT_CACHE_MAX_ENTRIES,
+    max_bytes=int(RESULT_CACHE_MAX_MB * 1024 * 1024)
+)
+
+# Batch engine cho /api/detect-batch: decode song song, predict theo batch
+BATCH_ENGINE_SIZE = int(os.getenv("BATCH_ENGINE_SIZE", "16"))
+BATCH_ENGINE_WORKERS = int(os.getenv("BATCH_ENGINE_WORKERS", "0")) or None
+batch_engine = BatchEngine(
+    detector,
+    batch_size=BATCH_ENGINE_SIZE,
+    workers=BATCH_ENGINE_WORKERS,
+    decode_size=detector.imgsz if REDUCED_JPEG_DECODE else None
+) if detector is not None else None
+
+# Job detection offline: chạy trên worker pool riêng, kết quả ghi dần ra disk
+# JOB_FOLDER_ROOT: chỉ cho phép job theo folder trong thư mục này (không đặt = tắt)
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_WORKERS = int(os.getenv("JOB_WORKERS", "1"))
+JOB_FOLDER_ROOT = os.getenv("JOB_FOLDER_ROOT") or None
+
+# JOB_SEPARATE_MODEL: job dùng model instance riêng (predict_lock riêng, không chờ predict của request;
+# tốn thêm 1 bản model trong RAM/VRAM). Mặc định job dùng chung detector với API -> model.predict
+# của job và của request chạy lần lượt qua predict_lock, job chỉ tách khỏi request về thread
+JOB_SEPARATE_MODEL = os.getenv("JOB_SEPARATE_MODEL", "0").strip().lower() in ("1", "true", "yes")
+job_detector = detector
+if detector is not None and JOB_SEPARATE_MODEL:
+    try:
+        # Không qua model_registry (registry trả về đúng detector dùng chung)
+        job_detector = ObjectDetector(
+            model_path=MODEL_PATH,
+            conf_threshold=0.25,
+            iou_threshold=0.45,
+            backend=INFERENCE_BACKEND,
+            imgsz=INFERENCE_IMGSZ
+        )
+        print("✅ Loaded separate model instance for detection jobs")
+    except Exception as e:
+        print(f"❌ Error loading job model, jobs share the API detector: {e}")
+
+job_manager = JobManager(
+    job_detector,
+    jobs_dir=JOBS_DIR,
+    max_workers=JOB_WORKERS,
+    batch_size=BATCH_ENGINE_SIZE,
+    folder_root=JOB_FOLDER_ROOT
+) if detector is not None else None
+
+
+@app.on_event("startup")
+async def resume_jobs():
+    """Tiếp tục các job chưa xong từ lần chạy trước"""
+    if job_manager is not None:
+        resumed = job_manager.resume()
+        if resumed:
+            print(f"✅ Resumed {resumed} detection job(s)")
+
+
+@app.on_event("shutdown")
+async def stop_jobs():
+    if job_manager is not None:
+        job_manager.shutdown()
+
+
+# Detection stride cho video tracking: chạy YOLO mỗi N frame, các frame giữa
+# chỉ Kalman-propagate tracks. TRACK_DETECT_STRIDE=auto = stride thích ứng theo chuyển động
+TRACK_DETECT_STRIDE = os.getenv("TRACK_DETECT_STRIDE", "1").strip().lower()
+TRACK_MAX_DETECT_STRIDE = int(os.getenv("TRACK_MAX_DETECT_STRIDE", "5"))
+TRACK_OPTICAL_FLOW = os.getenv("TRACK_OPTICAL_FLOW", "0").strip().lower() in ("1", "true", "yes")
+
 # Session management cho video tracking
-# Lưu trữ tracker instances theo session_id
-tracker_sessions = {}
-SESSION_TIMEOUT = 300  # 5 phút timeout
-session_last_activity = {}
+# Giới hạn số session + tổng memory ước tính (LRU eviction), session hết hạn được
+# dọn bởi background sweeper
+SESSION_TIMEOUT = int(os.getenv("SESSION_TIMEOUT", "300"))  # 5 phút timeout
+MAX_TRACKER_SESSIONS = int(os.getenv("MAX_TRACKER_SESSIONS", "200"))
+MAX_SESSION_MEMORY_MB = float(os.getenv("MAX_SESSION_MEMORY_MB", "512"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "30"))
+# Session store dùng chung giữa các worker process (không cần sticky routing):
+# "memory" (mặc định, state chỉ nằm trong process), "sqlite:///path/sessions.db",
+# "kv://local" hoặc "redis://host:port/db"
+SESSION_STORE = os.getenv("SESSION_STORE", "memory")
+
+
+def create_tracker(conf_threshold, iou_threshold):
+    """Tạo VideoTracker cho session mới (dùng chung detector đã load, chỉ tạo state DeepSORT mới)"""
+    adaptive = TRACK_DETECT_STRIDE == "auto"
+    return VideoTracker(
+        detector=detector,
+        conf_threshold=conf_threshold,
+        iou_threshold=iou_threshold,
+        detect_stride=1 if adaptive else int(TRACK_DETECT_STRIDE),
+        adaptive_stride=adaptive,
+        max_detect_stride=TRACK_MAX_DETECT_STRIDE,
+        optical_flow=TRACK_OPTICAL_FLOW
+    )
+
+
+session_manager = SessionManager(
+    create_tracker,
+    max_sessions=MAX_TRACKER_SESSIONS,
+    max_memory_bytes=int(MAX_SESSION_MEMORY_MB * 1024 * 1024),
+    timeout=SESSION_TIMEOUT,
+    sweep_interval=SESSION_SWEEP_INTERVAL,
+    store=create_session_store(SESSION_STORE)
+)
+
+
+# Mỗi session xử lý 1 frame tại một thời điểm, theo frame_seq; chỉ frame mới nhất được giữ chờ
+frame_sequencer = FrameSequencer(max_sessions=MAX_TRACKER_SESSIONS * 2)
+
+
+@app.on_event("startup")
+async def start_session_sweeper():
+    session_manager.start()
 
-def cleanup_old_sessions():
-    """Cleanup sessions không hoạt động quá lâu"""
-    current_time = time.time()
-    sessions_to_remove = []
+
+@app.on_event("shutdown")
+async def stop_session_sweeper():
+    await session_manager.stop()
+
+
+async def run_tracking_step(tracker, img_bgr, conf_threshold, iou_threshold, render: bool, deadline=None):
+    """
+    Xử lý 1 frame tracking: detect qua scheduler nếu tới lượt, ngược lại chỉ propagate tracks
+    Frame quá deadline bị bỏ giữa các bước (raise DeadlineExceeded), state tracker không đổi
     
-    for session_id, last_time in session_last_activity.items():
-        if current_time - last_time > SESSION_TIMEOUT:
-            sessions_to_remove.append(session_id)
+    Returns:
+    - detected: frame có chạy YOLO hay không
+    - result, img_rgb, tracks: giống VideoTracker.track_result (result None khi không detect)
+    """
+    check_deadline(deadline)
+    if not tracker.should_detect():
+        result, img_rgb, tracks = await asyncio.to_thread(tracker.propagate_frame, img_bgr, render)
+        return False, result, img_rgb, tracks
+    
+    result = await asyncio.wait_for(
+        scheduler.submit(img_bgr, conf_threshold, iou_threshold, deadline),
+        timeout=time_left(deadline) if deadline is not None else REQUEST_TIMEOUT_S
+    )
+    check_deadline(deadline)
+    result, img_rgb, tracks = await asyncio.to_thread(tracker.track_result, result, img_bgr, render)
+    return True, result, img_rgb, tracks
+
+
+async def reset_tracker_session(session_id):
+    """
+    Reset tracker của session qua frame sequencer: chạy sau frame đang xử lý, frame đang chờ bị drop
+    -> frame gửi trước reset không ghi state cũ đè lên session đã reset
     
-    for session_id in sessions_to_remove:
-        if session_id in tracker_sessions:
-            del tracker_sessions[session_id]
-        if session_id in session_last_activity:
-            del session_last_activity[session_id]
+    Returns:
+    - True nếu session tồn tại
+    """
+    async def reset_session():
+        tracker = await asyncio.to_thread(session_manager.get, session_id)
+        if tracker is None:
+            return False
+        tracker.reset()
+        await asyncio.to_thread(session_manager.record_usage, session_id)
+        return True
     
-    return len(sessions_to_remove)
+    try:
+        return await frame_sequencer.reset(session_id, reset_session)
+    except FrameDropped:
+        # Reset khác của session tới sau và thay thế reset này
+        return True
+
+
+def sanitize_filename(filename, default_prefix="image"):
+    """Sanitize filename từ upload (chỉ dùng để hiển thị trong response)"""
+    safe_filename = Path(filename).name if filename else ""
+    safe_filename = "".join(c for c in safe_filename if c.isalnum() or c in "._-")
+    if not safe_filename or not safe_filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')):
+        safe_filename = f"{default_prefix}_{uuid.uuid4().hex[:8]}.jpg"
+    return safe_filename
+
+
+def decode_upload(file_content):
+    """
+    Decode nội dung file upload trực tiếp trong memory thành numpy array BGR
+    Raise HTTPException 400 nếu không phải ảnh hợp lệ
+    """
+    img_bgr = decode_image_bytes(file_content)
+    if img_bgr is None:
+        raise HTTPException(status_code=400, detail="Không thể đọc file ảnh. Vui lòng kiểm tra định dạng file.")
+    return img_bgr
 
 
-def numpy_to_base64(img_rgb: np.ndarray) -> str:
+def decode_upload_scaled(file_content, min_side):
+    """
+    Giống decode_upload nhưng JPEG lớn được decode ở kích thước giảm (cạnh dài >= min_side)
+
+    Returns:
+    - img_bgr, scale: scale = (sx, sy) đổi tọa độ ảnh decode về ảnh gốc
+    """
+    img_bgr, scale = decode_image_reduced(file_content, min_side if REDUCED_JPEG_DECODE else None)
+    if img_bgr is None:
+        raise HTTPException(status_code=400, detail="Không thể đọc file ảnh. Vui lòng kiểm tra định dạng file.")
+    return img_bgr, scale
+
+
+def resolve_imgsz(imgsz: Optional[int], latency_budget_ms: Optional[float]) -> int:
+    """
+    Kích thước input của model cho 1 request
+
+    - imgsz: giá trị client yêu cầu (bội số của 32, MIN_IMGSZ..MAX_IMGSZ)
+    - latency_budget_ms: chọn imgsz lớn nhất trong ADAPTIVE_IMGSZ_CHOICES (<= imgsz của detector)
+      vừa budget theo thời gian inference đo được; chưa có số liệu -> imgsz của detector
+    """
+    if imgsz is not None:
+        if imgsz % 32 != 0 or not (MIN_IMGSZ <= imgsz <= MAX_IMGSZ):
+            raise HTTPException(status_code=400, detail=f"imgsz phải là bội số của 32 trong khoảng {MIN_IMGSZ} đến {MAX_IMGSZ}.")
+        if imgsz != detector.imgsz and not detector.dynamic_imgsz:
+            raise HTTPException(status_code=400, detail=f"Backend {detector.backend} chỉ hỗ trợ imgsz={detector.imgsz}.")
+        return imgsz
+    if latency_budget_ms is not None and detector.dynamic_imgsz:
+        if latency_budget_ms <= 0:
+            raise HTTPException(status_code=400, detail="latency_budget_ms phải lớn hơn 0.")
+        choices = [size for size in ADAPTIVE_IMGSZ_CHOICES if size <= detector.imgsz] or [detector.imgsz]
+        selected = scheduler.select_imgsz(latency_budget_ms, choices)
+        if selected is not None:
+            return selected
+    return detector.imgsz
+
+
+def plot_to_rgb(result, img_bgr):
+    """Vẽ bounding boxes từ YOLO result và chuyển sang RGB cho web"""
+    img_with_boxes = detector.plot_result(result, img_bgr)
+    return cv2.cvtColor(img_with_boxes, cv2.COLOR_BGR2RGB)
+
+
+def numpy_to_base64(img_rgb: np.ndarray, quality: int = 95) -> str:
     """Convert numpy array (RGB) to base64 string"""
     img_pil = Image.fromarray(img_rgb)
     buffered = BytesIO()
-    img_pil.save(buffered, format="JPEG", quality=95)
+    img_pil.save(buffered, format="JPEG", quality=quality)
     img_base64 = base64.b64encode(buffered.getvalue()).decode()
     return f"data:image/jpeg;base64,{img_base64}"
 
 
-def extract_detections(result, classes):
-    """Extract detection data from YOLO result"""
-    detections = []
-    
-    if result is None or not hasattr(result, 'boxes'):
-        return detections
-    
-    boxes = result.boxes
-    
-    # Kiểm tra nếu không có boxes
-    if boxes is None or len(boxes) == 0:
-        return detections
-    
+# Render modes cho ảnh kết quả trong response
+# - none: chỉ trả boxes/tracks (bỏ qua vẽ, convert màu, JPEG encode và base64)
+# - thumbnail: ảnh đã vẽ boxes thu nhỏ (cạnh dài tối đa THUMBNAIL_MAX_SIZE)
+# - full: ảnh đã vẽ boxes kích thước gốc
+RENDER_MODES = ("none", "thumbnail", "full")
+THUMBNAIL_MAX_SIZE = 320
+THUMBNAIL_QUALITY = 75
+
+
+def validate_render_mode(render: str) -> str:
+    """Validate render mode từ request"""
+    render = (render or "full").lower()
+    if render not in RENDER_MODES:
+        raise HTTPException(status_code=400, detail=f"render phải là một trong: {', '.join(RENDER_MODES)}.")
+    return render
+
+
+def encode_rendered_image(img_rgb, render: str):
+    """Encode ảnh đã vẽ theo render mode, None nếu render=none"""
+    if render == "none" or img_rgb is None:
+        return None
+    if render == "thumbnail":
+        h, w = img_rgb.shape[:2]
+        scale = THUMBNAIL_MAX_SIZE / max(h, w)
+        if scale < 1:
+            img_rgb = cv2.resize(
+                img_rgb,
+                (max(1, int(w * scale)), max(1, int(h * scale))),
+                interpolation=cv2.INTER_AREA
+            )
+        return numpy_to_base64(img_rgb, quality=THUMBNAIL_QUALITY)
+    return numpy_to_base64(img_rgb)
+
+
+def render_result_base64(result, img_bgr, render: str):
+    """Vẽ + encode ảnh kết quả từ YOLO result (bỏ qua hoàn toàn khi render=none)"""
+    if render == "none":
+        return None
+    return encode_rendered_image(plot_to_rgb(result, img_bgr), render)
+
+
+def extract_detections(result, classes, scale=None):
+    """
+    Extract detection data from YOLO result (list dict cho JSON response)
+    scale: (sx, sy) đổi tọa độ về ảnh gốc khi ảnh được decode ở kích thước giảm
+    """
     try:
-        for i, box in enumerate(boxes, 1):
-            try:
-                cls_id = int(box.cls[0])
-                conf = float(box.conf[0])
-                
-                # Kiểm tra class_id hợp lệ
-                if cls_id not in classes:
-                    continue
-                
-                class_name = classes[cls_id]
-                x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                
-                # Validate bbox coordinates
-                if x2 <= x1 or y2 <= y1:
-                    continue
-                
-                detections.append({
-                    "id": i,
-                    "class": class_name,
-                    "class_id": cls_id,
-                    "confidence": round(conf, 4),
-                    "bbox": [float(x1), float(y1), float(x2), float(y2)],
-                    "width": float(x2 - x1),
-                    "height": float(y2 - y1)
-                })
-            except (IndexError, ValueError, AttributeError) as e:
-                # Skip invalid boxes
-                print(f"Warning: Skipping invalid box {i}: {e}")
-                continue
-    
+        return Detections.from_result(result, classes).rescale(scale).to_list()
     except Exception as e:
         print(f"Error extracting detections: {e}")
-        return detections
-    
-    return detections
+        return []
 
 
 @app.get("/")
@@ -185,6 +485,19 @@ async def root():
     }
 
 
+@app.get("/api/metrics")
+async def get_metrics():
+    """Thống kê micro-batching của inference scheduler, admission control và result cache"""
+    if scheduler is None:
+        raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
+    
+    return {
+        "scheduler": scheduler.get_metrics(),
+        "admission": {name: queue.stats() for name, queue in admission_queues.items()},
+        "result_cache": result_cache.stats()
+    }
+
+
 @app.get("/api/model-info")
 async def get_model_info():
     """Lấy thông tin model"""
@@ -195,6 +508,8 @@ async def get_model_info():
     
     return {
         "model_path": MODEL_PATH,
+        "backend": detector.backend,
+        "imgsz": detector.imgsz,
         "num_classes": len(detector.classes),
         "classes": classes_dict,
         "default_conf_threshold": detector.conf_threshold,
@@ -206,7 +521,12 @@ async def get_model_info():
 async def detect_objects(
     file: UploadFile = File(...),
     conf_threshold: float = Form(0.25),
-    iou_threshold: float = Form(0.45)
+    iou_threshold: float = Form(0.45),
+    render: str = Form("full"),
+    imgsz: Optional[int] = Form(None),
+    latency_budget_ms: Optional[float] = Form(None),
+    deadline: float = Depends(request_deadline),
+    _slot: None = Depends(admission_slot("detect"))
 ):
     """
     Nhận diện đối tượng trong 1 ảnh
@@ -215,6 +535,12 @@ async def detect_objects(
     - file: File ảnh upload
     - conf_threshold: Confidence threshold (0-1)
     - iou_threshold: IoU threshold (0-1)
+    - render: none | thumbnail | full - ảnh kết quả trả về trong image_base64
+      (ảnh được vẽ ở kích thước decode, có thể nhỏ hơn ảnh gốc với JPEG lớn)
+    - imgsz: kích thước input của model cho request này (mặc định: INFERENCE_IMGSZ)
+    - latency_budget_ms: thay cho imgsz - server chọn imgsz theo thời gian inference hiện tại
+    - bbox trong detections luôn theo tọa độ ảnh gốc
+    - header X-Request-Deadline-Ms: thời gian tối đa client chờ (ms), quá hạn -> 408 và ảnh không được xử lý
     """
     if detector is None:
         raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
@@ -228,6 +554,8 @@ async def detect_objects(
         raise HTTPException(status_code=400, detail="Ngưỡng confidence phải trong khoảng 0 đến 1.")
     if not (0 <= iou_threshold <= 1):
         raise HTTPException(status_code=400, detail="Ngưỡng IoU phải trong khoảng 0 đến 1.")
+    render = validate_render_mode(render)
+    imgsz = resolve_imgsz(imgsz, latency_budget_ms)
     
     # Validate file size (max 10MB)
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
@@ -245,56 +573,40 @@ async def detect_objects(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Lỗi đọc file: {str(e)}")
     
-    # Lưu file tạm - Sử dụng tempfile để an toàn hơn
-    # Sanitize filename để tránh path traversal
-    safe_filename = Path(file.filename).name if file.filename else "image.jpg"
-    # Loại bỏ các ký tự không hợp lệ
-    safe_filename = "".join(c for c in safe_filename if c.isalnum() or c in "._-")
-    if not safe_filename or not safe_filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')):
-        safe_filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
-    
-    # Sử dụng tempfile để đảm bảo an toàn
-    temp_dir = Path(tempfile.gettempdir()) / "object_detection_uploads"
-    temp_dir.mkdir(exist_ok=True, mode=0o700)  # Chỉ owner có quyền
-    
-    temp_path = temp_dir / safe_filename
+    # Cache hit: trả kết quả ngay, bỏ qua decode, inference và encode
+    cache_key = None
+    if result_cache.enabled and (render == "none" or RESULT_CACHE_RENDERED):
+        cache_key = result_cache.make_key(file_content, conf_threshold, iou_threshold, detector.model_version, render, imgsz)
+        cached = result_cache.get(cache_key)
+        if cached is not None:
+            return {"success": True, **cached, "cached": True}
     
     try:
-        # Lưu file (đã đọc file_content ở trên)
-        with open(temp_path, "wb") as buffer:
-            buffer.write(file_content)
+        # Request đã quá deadline (vd. chờ lâu ở admission queue) -> bỏ trước khi decode
+        check_deadline(deadline)
         
-        # Detect với thresholds (không thay đổi global state)
-        # Tạo temporary detector config hoặc pass thresholds vào detect_image
-        # Tạm thời: lưu old thresholds và restore sau
-        old_conf = detector.conf_threshold
-        old_iou = detector.iou_threshold
+        # Decode ảnh trực tiếp trong memory (không ghi file tạm), JPEG lớn decode ở kích thước giảm
+        img_bgr, scale = await asyncio.to_thread(decode_upload_scaled, file_content, imgsz)
         
+        # Detect qua scheduler (gom batch với các request đồng thời) tới deadline của request
         try:
-            detector.conf_threshold = conf_threshold
-            detector.iou_threshold = iou_threshold
-            
-            # Detect với timeout
-            try:
-                result, img_rgb = await asyncio.wait_for(
-                    asyncio.to_thread(detector.detect_image, str(temp_path), None, False),
-                    timeout=30.0  # 30 seconds timeout
-                )
-            except asyncio.TimeoutError:
-                raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Ảnh xử lý quá lâu. Vui lòng thử với ảnh nhỏ hơn.")
-        finally:
-            # Restore old thresholds để tránh race condition
-            detector.conf_threshold = old_conf
-            detector.iou_threshold = old_iou
+            result = await asyncio.wait_for(
+                scheduler.submit(img_bgr, conf_threshold, iou_threshold, deadline, imgsz),
+                timeout=time_left(deadline)
+            )
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Ảnh xử lý quá lâu. Vui lòng thử với ảnh nhỏ hơn.")
         
         if result is None:
             raise HTTPException(status_code=400, detail="Không thể xử lý ảnh. Vui lòng kiểm tra file ảnh có hợp lệ không.")
         
-        # Extract detections
-        detections = extract_detections(result, detector.classes)
+        # Vẽ bounding boxes + encode base64 theo render mode (ngoài event loop)
+        if render != "none":
+            check_deadline(deadline)
+        image_base64 = await asyncio.to_thread(render_result_base64, result, img_bgr, render)
         
-        # Convert image to base64
-        image_base64 = numpy_to_base64(img_rgb)
+        # Extract detections (tọa độ ảnh gốc)
+        detections = extract_detections(result, detector.classes, scale)
         
         # Calculate statistics
         if detections:
@@ -315,16 +627,25 @@ async def detect_objects(
                 "max_confidence": 0
             }
         
-        return {
-            "success": True,
+        statistics["imgsz"] = imgsz
+        statistics["decode_scale"] = round(max(scale), 4)
+        
+        response = {
             "detections": detections,
             "image_base64": image_base64,
             "statistics": statistics
         }
+        if cache_key is not None:
+            # Ước tính dung lượng: ảnh base64 + ~200 bytes mỗi detection
+            result_cache.put(cache_key, response, len(image_base64 or "") + 200 * len(detections) + 512)
+        
+        return {"success": True, **response, "cached": False}
     
     except HTTPException:
         # Re-raise HTTP exceptions (đã có detail message)
         raise
+    except DeadlineExceeded:
+        raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Request đã quá deadline.")
     except Exception as e:
         # Log error để debug
         import traceback
@@ -341,22 +662,72 @@ async def detect_objects(
         else:
             error_msg = f"Lỗi xử lý ảnh: {error_msg}"
         raise HTTPException(status_code=500, detail=error_msg)
+
+
+# Số file tối đa mỗi request /api/detect-batch (stream=true không giữ kết quả trong memory)
+MAX_BATCH_FILES = 20
+MAX_STREAM_BATCH_FILES = 500
+
+
+def iter_upload_sources(files, max_file_size):
+    """
+    Đọc lần lượt các file upload (chạy trong thread của batch engine, không đọc trước tất cả)
     
-    finally:
-        # Xóa file tạm
-        if temp_path.exists():
-            temp_path.unlink()
+    Yields:
+    - (safe_filename, file_content) cho các file ảnh hợp lệ
+    """
+    for file in files:
+        if not file.content_type or not file.content_type.startswith('image/'):
+            continue
+        
+        # Validate file size (chỉ đọc tối đa max_file_size + 1 bytes)
+        file.file.seek(0)
+        file_content = file.file.read(max_file_size + 1)
+        if len(file_content) > max_file_size:
+            print(f"Skipping {file.filename}: file too large")
+            continue
+        
+        # Sanitize filename (chỉ dùng để trả về trong response)
+        yield sanitize_filename(file.filename), file_content
+
+
+async def iter_batch_items(batches, deadline=None):
+    """
+    Lấy từng batch từ batch engine (trong thread), timeout cho từng batch
+    Batch engine chạy lazy nên khi quá deadline các batch còn lại không được decode/predict
+    """
+    while True:
+        try:
+            timeout = 30.0 if deadline is None else min(30.0, time_left(deadline))
+            items = await asyncio.wait_for(asyncio.to_thread(next, batches, None), timeout=timeout)
+        except asyncio.TimeoutError:
+            raise HTTPException(status_code=408, detail="Hết thời gian xử lý batch. Vui lòng thử với ít ảnh hơn.")
+        if items is None:
+            return
+        for item in items:
+            yield item
+
+
+def ndjson_line(data) -> bytes:
+    return (json.dumps(data, ensure_ascii=False) + "\n").encode("utf-8")
 
 
 @app.post("/api/detect-batch")
 async def detect_batch(
     files: List[UploadFile] = File(...),
     conf_threshold: float = Form(0.25),
-    iou_threshold: float = Form(0.45)
+    iou_threshold: float = Form(0.45),
+    render: str = Form("full"),
+    stream: bool = Form(False),
+    deadline: float = Depends(request_deadline),
+    _slot: None = Depends(admission_slot("batch"))
 ):
     """
     Nhận diện nhiều ảnh cùng lúc
     NOTE: Endpoint này vẫn được giữ lại để tương thích, nhưng frontend hiện tại không sử dụng
+    
+    Parameters:
+    - stream: True = trả NDJSON, mỗi dòng 1 ảnh ngay khi xử lý xong, dòng cuối là summary
     """
     if detector is None:
         raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
@@ -366,119 +737,79 @@ async def detect_batch(
         raise HTTPException(status_code=400, detail="Ngưỡng confidence phải trong khoảng 0 đến 1.")
     if not (0 <= iou_threshold <= 1):
         raise HTTPException(status_code=400, detail="Ngưỡng IoU phải trong khoảng 0 đến 1.")
+    render = validate_render_mode(render)
     
-    if len(files) > 20:
-        raise HTTPException(status_code=400, detail="Tối đa 20 ảnh mỗi batch.")
+    max_files = MAX_STREAM_BATCH_FILES if stream else MAX_BATCH_FILES
+    if len(files) > max_files:
+        raise HTTPException(status_code=400, detail=f"Tối đa {max_files} ảnh mỗi batch.")
     
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
     
-    # Lưu old thresholds và restore sau để tránh race condition
-    old_conf = detector.conf_threshold
-    old_iou = detector.iou_threshold
+    def build_result(item):
+        # Chạy song song trong thread pool của batch engine
+        detections = extract_detections(item.result, detector.classes, item.scale)
+        return {
+            "filename": item.name,
+            "detections": detections,
+            "num_detections": len(detections),
+            "image_base64": render_result_base64(item.result, item.image, render)
+        }
     
-    try:
-        detector.conf_threshold = conf_threshold
-        detector.iou_threshold = iou_threshold
-        
-        # Sử dụng tempfile cho batch processing
-        temp_dir = Path(tempfile.gettempdir()) / "object_detection_uploads"
-        temp_dir.mkdir(exist_ok=True, mode=0o700)
-        
-        results = []
-        all_classes = []
-        all_confidences = []
-        
-        for file in files:
-            if not file.content_type or not file.content_type.startswith('image/'):
-                continue
-            
-            # Validate file size
-            file_content = await file.read()
-            if len(file_content) > MAX_FILE_SIZE:
-                print(f"Skipping {file.filename}: file too large")
-                continue
-            
-            # Reset file pointer
-            await file.seek(0)
-            
-            # Sanitize filename
-            safe_filename = Path(file.filename).name if file.filename else f"image_{uuid.uuid4().hex[:8]}.jpg"
-            safe_filename = "".join(c for c in safe_filename if c.isalnum() or c in "._-")
-            if not safe_filename or not safe_filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')):
-                safe_filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
-            
-            temp_path = temp_dir / safe_filename
-            
+    # Thresholds được truyền theo từng lần gọi (không sửa state của detector dùng chung)
+    batches = batch_engine.iter_batches(
+        iter_upload_sources(files, MAX_FILE_SIZE), conf_threshold, iou_threshold,
+        postprocess=build_result
+    )
+    
+    if stream:
+        async def stream_results():
+            # Summary cộng dồn, mỗi kết quả được gửi đi rồi bỏ khỏi memory
+            summary = RunningSummary()
             try:
-                # Lưu file
-                with open(temp_path, "wb") as buffer:
-                    buffer.write(file_content)
-                
-                # Detect với timeout
-                try:
-                    result, img_rgb = await asyncio.wait_for(
-                        asyncio.to_thread(detector.detect_image, str(temp_path), None, False),
-                        timeout=30.0
-                    )
-                except asyncio.TimeoutError:
-                    print(f"Timeout processing {safe_filename}")
-                    continue
-                
-                if result is not None:
-                    detections = extract_detections(result, detector.classes)
-                    image_base64 = numpy_to_base64(img_rgb)
-                    
-                    # Collect statistics
-                    for det in detections:
-                        all_classes.append(det["class"])
-                        all_confidences.append(det["confidence"])
-                    
-                    results.append({
-                        "filename": safe_filename,
-                        "detections": detections,
-                        "num_detections": len(detections),
-                        "image_base64": image_base64
-                    })
-                
-                # Xóa file tạm
-                if temp_path.exists():
-                    temp_path.unlink()
-            
+                async for item in iter_batch_items(batches, deadline):
+                    if item.output is None:
+                        yield ndjson_line({"type": "error", "filename": item.name, "detail": item.error})
+                        continue
+                    summary.add(item.output["detections"])
+                    yield ndjson_line({"type": "result", **item.output})
+            except HTTPException as e:
+                yield ndjson_line({"type": "error", "detail": e.detail})
             except Exception as e:
-                print(f"Error processing {safe_filename}: {e}")
-                # Xóa file tạm nếu có lỗi
-                if temp_path.exists():
-                    temp_path.unlink()
-                continue
+                print(f"Error streaming batch: {e}")
+                yield ndjson_line({"type": "error", "detail": f"Lỗi xử lý batch: {str(e)}"})
+            yield ndjson_line({"type": "summary", "success": True, "summary": summary.to_dict()})
         
-            # Summary statistics
-        from collections import Counter
-        class_distribution = dict(Counter(all_classes))
+        return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+    
+    try:
+        results = []
+        summary = RunningSummary()
         
-        summary = {
-            "total_images": len(results),
-            "images_with_detections": sum(1 for r in results if r["num_detections"] > 0),
-            "total_detections": sum(r["num_detections"] for r in results),
-            "class_distribution": class_distribution,
-            "avg_confidence": round(np.mean(all_confidences), 4) if all_confidences else 0
-        }
+        async for item in iter_batch_items(batches, deadline):
+            if item.output is None:
+                print(f"Skipping {item.name}: {item.error}")
+                continue
+            summary.add(item.output["detections"])
+            results.append(item.output)
         
         return {
             "success": True,
             "results": results,
-            "summary": summary
+            "summary": summary.to_dict()
         }
     
-    finally:
-        # Restore thresholds
-        detector.conf_threshold = old_conf
-        detector.iou_threshold = old_iou
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Lỗi xử lý batch: {str(e)}")
 
 
 @app.post("/api/compare-thresholds")
 async def compare_thresholds(
     file: UploadFile = File(...),
-    thresholds: str = Form("[0.1, 0.25, 0.5, 0.75]")
+    thresholds: str = Form("[0.1, 0.25, 0.5, 0.75]"),
+    deadline: float = Depends(request_deadline),
+    _slot: None = Depends(admission_slot("detect"))
 ):
     """
     So sánh kết quả với các confidence threshold khác nhau
@@ -507,30 +838,24 @@ async def compare_thresholds(
     except Exception:
         threshold_list = [0.1, 0.25, 0.5, 0.75]  # Fallback
     
-    # Sử dụng tempfile và sanitize filename
-    safe_filename = Path(file.filename).name if file.filename else f"image_{uuid.uuid4().hex[:8]}.jpg"
-    safe_filename = "".join(c for c in safe_filename if c.isalnum() or c in "._-")
-    if not safe_filename or not safe_filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')):
-        safe_filename = f"image_{uuid.uuid4().hex[:8]}.jpg"
-    
-    temp_dir = Path(tempfile.gettempdir()) / "object_detection_uploads"
-    temp_dir.mkdir(exist_ok=True, mode=0o700)
-    temp_path = temp_dir / safe_filename
-    
     try:
-        # Lưu file
-        with open(temp_path, "wb") as buffer:
-            content = await file.read()
-            buffer.write(content)
+        # Decode ảnh trực tiếp trong memory (bỏ nếu request đã quá deadline)
+        content = await file.read()
+        check_deadline(deadline)
+        img_bgr, _ = await asyncio.to_thread(decode_upload_scaled, content, detector.imgsz)
         
-        # Compare thresholds với timeout
-        try:
-            comparisons = await asyncio.wait_for(
-                asyncio.to_thread(detector.compare_thresholds, str(temp_path), threshold_list),
-                timeout=60.0  # 60s cho multiple thresholds
-            )
-        except asyncio.TimeoutError:
-            raise HTTPException(status_code=408, detail="Hết thời gian xử lý. So sánh thresholds quá lâu. Vui lòng thử với ít thresholds hơn.")
+        # 1 lần predict qua scheduler ở threshold thấp nhất (request quá deadline bị bỏ trước khi
+        # predict, không chiếm model), sau đó lọc boxes theo từng threshold
+        comparisons = {}
+        if threshold_list:
+            try:
+                result = await asyncio.wait_for(
+                    scheduler.submit(img_bgr, min(threshold_list), detector.iou_threshold, deadline),
+                    timeout=time_left(deadline)
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=408, detail="Hết thời gian xử lý. So sánh thresholds quá lâu. Vui lòng thử với ít thresholds hơn.")
+            comparisons = detector.summarize_thresholds(result, threshold_list)
         
         # Format output
         result = {}
@@ -547,6 +872,8 @@ async def compare_thresholds(
     
     except HTTPException:
         raise
+    except DeadlineExceeded:
+        raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Request đã quá deadline.")
     except Exception as e:
         error_msg = str(e)
         if "timeout" in error_msg.lower():
@@ -556,10 +883,6 @@ async def compare_thresholds(
         else:
             error_msg = f"Lỗi xử lý: {error_msg}"
         raise HTTPException(status_code=500, detail=error_msg)
-    
-    finally:
-        if temp_path.exists():
-            temp_path.unlink()
 
 
 @app.post("/api/detect-video")
@@ -567,7 +890,11 @@ async def detect_video(
     file: UploadFile = File(...),
     conf_threshold: float = Form(0.25),
     iou_threshold: float = Form(0.45),
-    session_id: Optional[str] = Form(None)
+    session_id: Optional[str] = Form(None),
+    render: str = Form("full"),
+    frame_seq: Optional[int] = Form(None),
+    deadline: float = Depends(request_deadline),
+    _slot: None = Depends(admission_slot("video"))
 ):
     """
     Nhận diện và tracking đối tượng trong video frame
@@ -577,11 +904,17 @@ async def detect_video(
     - conf_threshold: Confidence threshold (0-1)
     - iou_threshold: IoU threshold (0-1)
     - session_id: Session ID để maintain tracking state (optional)
+    - render: none | thumbnail | full (none = chỉ trả tracks, client tự vẽ)
+    - frame_seq: sequence number của frame trong session (optional, mặc định theo thứ tự đến)
+    
+    Các frame của cùng session được xử lý lần lượt theo frame_seq. Khi server chưa xử lý xong
+    frame trước, chỉ frame mới nhất được giữ chờ; frame cũ hơn trả về ngay với dropped = true
     
     Returns:
     - tracks: List of tracks với ID cố định
-    - image_base64: Image với bounding boxes và track IDs
-    - statistics: Thống kê về tracks
+    - image_base64: Image với bounding boxes và track IDs (None nếu render=none)
+    - statistics: Thống kê về tracks và frame bị drop của session
+    - dropped: frame có bị bỏ qua không (kèm reason: stale | superseded)
     """
     if detector is None:
         raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
@@ -595,6 +928,7 @@ async def detect_video(
         raise HTTPException(status_code=400, detail="Ngưỡng confidence phải trong khoảng 0 đến 1.")
     if not (0 <= iou_threshold <= 1):
         raise HTTPException(status_code=400, detail="Ngưỡng IoU phải trong khoảng 0 đến 1.")
+    render = validate_render_mode(render)
     
     # Validate file size (max 10MB)
     MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
@@ -611,66 +945,58 @@ async def detect_video(
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Lỗi đọc file: {str(e)}")
     
-    # Cleanup old sessions
-    cleanup_old_sessions()
-    
     # Get or create session
     if not session_id:
         session_id = f"session_{uuid.uuid4().hex[:8]}"
     
-    # Update session activity
-    session_last_activity[session_id] = time.time()
-    
-    # Get or create tracker for this session
-    if session_id not in tracker_sessions:
+    async def process_frame():
+        # Chạy khi tới lượt frame này trong session (không có frame khác của session đang xử lý)
+        # Pin session trong lúc xử lý để LRU/memory eviction không xóa tracker giữa request
         try:
-            tracker_sessions[session_id] = VideoTracker(
-                model_path=MODEL_PATH,
-                conf_threshold=conf_threshold,
-                iou_threshold=iou_threshold
-            )
-            print(f"✅ Created new tracker session: {session_id}")
+            tracker = await asyncio.to_thread(session_manager.acquire, session_id, conf_threshold, iou_threshold)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Lỗi khởi tạo tracker: {str(e)}")
-    
-    tracker = tracker_sessions[session_id]
-    
-    # Update tracker thresholds nếu thay đổi
-    if tracker.detector.conf_threshold != conf_threshold:
-        tracker.detector.conf_threshold = conf_threshold
-    if tracker.detector.iou_threshold != iou_threshold:
-        tracker.detector.iou_threshold = iou_threshold
-    
-    # Sanitize filename
-    safe_filename = Path(file.filename).name if file.filename else "image.jpg"
-    safe_filename = "".join(c for c in safe_filename if c.isalnum() or c in "._-")
-    if not safe_filename or not safe_filename.endswith(('.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff')):
-        safe_filename = f"frame_{uuid.uuid4().hex[:8]}.jpg"
-    
-    # Sử dụng tempfile
-    temp_dir = Path(tempfile.gettempdir()) / "object_detection_uploads"
-    temp_dir.mkdir(exist_ok=True, mode=0o700)
-    temp_path = temp_dir / safe_filename
+        
+        try:
+            # Decode frame trực tiếp trong memory (không ghi file tạm), trong thread để không chặn event loop
+            img_bgr = await asyncio.to_thread(decode_upload, file_content)
+            
+            # Process frame với timeout: detect qua scheduler (hoặc chỉ propagate theo stride), tracking trong thread
+            try:
+                outputs = await run_tracking_step(
+                    tracker, img_bgr, conf_threshold, iou_threshold, render != "none", deadline
+                )
+            except asyncio.TimeoutError:
+                raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Frame xử lý quá lâu. Vui lòng thử với frame nhỏ hơn.")
+        finally:
+            await asyncio.to_thread(session_manager.release, session_id, tracker)
+        return (tracker, *outputs)
     
     try:
-        # Lưu file
-        with open(temp_path, "wb") as buffer:
-            buffer.write(file_content)
-        
-        # Process frame với timeout
         try:
-            result, img_rgb, tracks = await asyncio.wait_for(
-                asyncio.to_thread(tracker.process_frame, str(temp_path)),
-                timeout=30.0  # 30 seconds timeout
+            frame_seq, (tracker, detected, result, img_rgb, tracks) = await frame_sequencer.run(
+                session_id, frame_seq, process_frame
             )
-        except asyncio.TimeoutError:
-            raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Frame xử lý quá lâu. Vui lòng thử với frame nhỏ hơn.")
+        except FrameDropped as e:
+            return {
+                "success": True,
+                "dropped": True,
+                "reason": e.reason,
+                "frame_seq": e.seq,
+                "tracks": [],
+                "image_base64": None,
+                "statistics": frame_sequencer.stats(session_id),
+                "session_id": session_id
+            }
         
-        if result is None:
+        if detected and result is None:
             raise HTTPException(status_code=400, detail="Không thể xử lý frame. Vui lòng kiểm tra file ảnh có hợp lệ không.")
         
-        # Convert image to base64
-        image_base64 = numpy_to_base64(img_rgb)
+        # Convert image to base64 theo render mode (bỏ bước encode nếu frame đã quá deadline),
+        # encode JPEG + base64 trong thread để không chặn event loop
+        if render != "none":
+            check_deadline(deadline)
+        image_base64 = await asyncio.to_thread(encode_rendered_image, img_rgb, render)
         
         # Calculate statistics
         if tracks:
@@ -699,9 +1025,14 @@ async def detect_video(
                 "min_confidence": 0,
                 "max_confidence": 0
             }
+        statistics["detected"] = detected
+        statistics["detect_stride"] = tracker.current_stride
+        statistics.update(frame_sequencer.stats(session_id))
         
         return {
             "success": True,
+            "dropped": False,
+            "frame_seq": frame_seq,
             "tracks": tracks,
             "image_base64": image_base64,
             "statistics": statistics,
@@ -710,6 +1041,8 @@ async def detect_video(
     
     except HTTPException:
         raise
+    except DeadlineExceeded:
+        raise HTTPException(status_code=408, detail="Hết thời gian xử lý. Frame đã quá deadline.")
     except Exception as e:
         import traceback
         print(f"Error processing video frame: {e}")
@@ -724,11 +1057,203 @@ async def detect_video(
         else:
             error_msg = f"Lỗi xử lý frame: {error_msg}"
         raise HTTPException(status_code=500, detail=error_msg)
+
+
+# WebSocket tracking: mỗi binary message = 4 byte sequence number (uint32 big-endian) + JPEG bytes
+WS_FRAME_HEADER = struct.Struct(">I")
+WS_TRACK_FIELDS = ["track_id", "class_id", "class", "confidence", "x1", "y1", "x2", "y2", "is_new"]
+
+
+def compact_tracks(tracks):
+    """Chuyển tracks thành list các mảng ngắn theo thứ tự WS_TRACK_FIELDS"""
+    return [
+        [
+            t["track_id"],
+            t["class_id"],
+            t["class"],
+            round(t["confidence"], 4),
+            *[round(v, 1) for v in t["bbox"]],
+            1 if t.get("is_new") else 0
+        ]
+        for t in tracks
+    ]
+
+
+@app.websocket("/ws/track")
+async def track_websocket(
+    websocket: WebSocket,
+    session_id: Optional[str] = None,
+    conf_threshold: float = 0.25,
+    iou_threshold: float = 0.45
+):
+    """
+    WebSocket streaming cho live camera tracking
     
+    Client gửi:
+    - binary: 4 byte sequence number (uint32 big-endian) + JPEG bytes của frame
+    - text JSON: {"type": "config", "conf_threshold": .., "iou_threshold": ..} hoặc {"type": "reset"}
+    
+    Server trả (text JSON):
+    - {"type": "ready", "session_id", "fields", "classes"} khi kết nối
+    - {"type": "tracks", "seq", "tracks", "detected", "dropped", "processing_ms"} cho mỗi frame được xử lý
+    - {"type": "dropped", "seq", "reason"} nếu frame bị frame sequencer bỏ (superseded / stale / reset)
+    - {"type": "reset", "session_id"} sau khi reset xong
+    - {"type": "error", "seq", "detail"} nếu frame lỗi
+    
+    Frame đi qua frame sequencer của session như /api/detect-video (cùng hàng đợi với HTTP và reset):
+    khi server xử lý không kịp, chỉ frame mới nhất được giữ lại, các frame cũ bị drop phía server
+    """
+    await websocket.accept()
+    
+    if detector is None:
+        await websocket.send_json({"type": "error", "detail": "Model chưa được tải. Vui lòng kiểm tra lại server."})
+        await websocket.close(code=1011)
+        return
+    
+    if not (0 <= conf_threshold <= 1) or not (0 <= iou_threshold <= 1):
+        await websocket.send_json({"type": "error", "detail": "Ngưỡng confidence/IoU phải trong khoảng 0 đến 1."})
+        await websocket.close(code=1008)
+        return
+    
+    if not session_id:
+        session_id = f"session_{uuid.uuid4().hex[:8]}"
+    
+    try:
+        # Tạo session ngay khi kết nối để báo lỗi khởi tạo sớm; tracker được lấy lại ở mỗi frame
+        await asyncio.to_thread(session_manager.get_or_create, session_id, conf_threshold, iou_threshold)
+    except Exception as e:
+        await websocket.send_json({"type": "error", "detail": f"Lỗi khởi tạo tracker: {str(e)}"})
+        await websocket.close(code=1011)
+        return
+    
+    await websocket.send_json({
+        "type": "ready",
+        "session_id": session_id,
+        "fields": WS_TRACK_FIELDS,
+        "classes": {str(k): v for k, v in detector.classes.items()}
+    })
+    
+    MAX_FILE_SIZE = 10 * 1024 * 1024  # 10MB
+    config = {"conf": conf_threshold, "iou": iou_threshold}
+    state = {"dropped": 0}
+    tasks = set()
+    
+    async def process_frame(payload, deadline):
+        # Chạy khi tới lượt frame này trong session (không có frame/reset khác của session đang xử lý)
+        check_deadline(deadline)
+        async with admission_queues["video"].slot():
+            img_bgr = await asyncio.to_thread(decode_image_bytes, payload)
+            if img_bgr is None:
+                return None
+            
+            # Lấy lại tracker mỗi frame (session có thể đã bị evict hoặc worker khác vừa xử lý), pin trong lúc xử lý
+            tracker = await asyncio.to_thread(session_manager.acquire, session_id, config["conf"], config["iou"])
+            try:
+                detected, _, _, tracks = await run_tracking_step(
+                    tracker, img_bgr, config["conf"], config["iou"], False, deadline
+                )
+            finally:
+                await asyncio.to_thread(session_manager.release, session_id, tracker)
+        return detected, tracks
+    
+    async def handle_frame(seq, payload):
+        started = time.perf_counter()
+        deadline = time.monotonic() + REQUEST_TIMEOUT_S
+        try:
+            # Message trên 1 WebSocket đến theo thứ tự -> sequencer đánh seq theo thứ tự đến
+            _, outcome = await frame_sequencer.run(session_id, None, lambda: process_frame(payload, deadline))
+        except FrameDropped as e:
+            # Đã có frame mới hơn (vd. từ client khác / HTTP cùng session) hoặc reset -> bỏ frame này,
+            # báo client để gửi frame tiếp theo ngay
+            state["dropped"] += 1
+            await websocket.send_json({"type": "dropped", "seq": seq, "reason": e.reason})
+            return
+        except AdmissionRejected as e:
+            # Server quá tải: bỏ frame này, client gửi frame tiếp theo
+            state["dropped"] += 1
+            await websocket.send_json({"type": "error", "seq": seq, "detail": "Server đang quá tải.", "retry_after": e.retry_after})
+            return
+        except asyncio.TimeoutError:
+            await websocket.send_json({"type": "error", "seq": seq, "detail": "Hết thời gian xử lý frame."})
+            return
+        except Exception as e:
+            print(f"Error processing websocket frame: {e}")
+            await websocket.send_json({"type": "error", "seq": seq, "detail": f"Lỗi xử lý frame: {str(e)}"})
+            return
+        
+        if outcome is None:
+            await websocket.send_json({"type": "error", "seq": seq, "detail": "Không thể đọc frame."})
+            return
+        detected, tracks = outcome
+        await websocket.send_json({
+            "type": "tracks",
+            "seq": seq,
+            "tracks": compact_tracks(tracks),
+            "detected": detected,
+            "dropped": state["dropped"],
+            "processing_ms": round((time.perf_counter() - started) * 1000, 2)
+        })
+    
+    async def handle_reset():
+        await reset_tracker_session(session_id)
+        await websocket.send_json({"type": "reset", "session_id": session_id})
+    
+    def finished(task):
+        tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"WebSocket tracking error ({session_id}): {task.exception()}")
+    
+    def spawn(coro):
+        # Nhận message tiếp trong lúc frame chờ/xử lý (frame cũ bị sequencer drop khi có frame mới hơn)
+        task = asyncio.create_task(coro)
+        tasks.add(task)
+        task.add_done_callback(finished)
+    
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            
+            data = message.get("bytes")
+            if data is not None:
+                if len(data) <= WS_FRAME_HEADER.size or len(data) > MAX_FILE_SIZE + WS_FRAME_HEADER.size:
+                    await websocket.send_json({"type": "error", "seq": None, "detail": "Frame không hợp lệ."})
+                    continue
+                seq = WS_FRAME_HEADER.unpack_from(data)[0]
+                spawn(handle_frame(seq, data[WS_FRAME_HEADER.size:]))
+                continue
+            
+            text = message.get("text")
+            if text:
+                try:
+                    command = json.loads(text)
+                except ValueError:
+                    await websocket.send_json({"type": "error", "seq": None, "detail": "Message JSON không hợp lệ."})
+                    continue
+                if command.get("type") == "reset":
+                    spawn(handle_reset())
+                elif command.get("type") == "config":
+                    conf = command.get("conf_threshold", config["conf"])
+                    iou = command.get("iou_threshold", config["iou"])
+                    if isinstance(conf, (int, float)) and isinstance(iou, (int, float)) and 0 <= conf <= 1 and 0 <= iou <= 1:
+                        config["conf"], config["iou"] = float(conf), float(iou)
+    except WebSocketDisconnect:
+        pass
     finally:
-        # Xóa file tạm
-        if temp_path.exists():
-            temp_path.unlink()
+        for task in list(tasks):
+            task.cancel()
+
+
+@app.get("/api/sessions")
+async def list_sessions():
+    """
+    Thống kê tracker sessions: số session, số tracks, memory ước tính và số frame bị drop của từng session
+    """
+    stats = session_manager.stats()
+    for session in stats["sessions"]:
+        session.update(frame_sequencer.stats(session["session_id"]))
+    return {"success": True, **stats}
 
 
 @app.post("/api/reset-tracking-session")
@@ -736,13 +1261,271 @@ async def reset_tracking_session(session_id: str = Form(...)):
     """
     Reset tracking session (xóa tất cả tracks)
     """
-    if session_id in tracker_sessions:
-        tracker_sessions[session_id].reset()
+    if await reset_tracker_session(session_id):
         return {"success": True, "message": f"Session {session_id} đã được reset"}
     else:
+        frame_sequencer.forget(session_id)
         return {"success": False, "message": f"Session {session_id} không tồn tại"}
 
 
+@app.post("/api/jobs")
+async def create_job(
+    files: List[UploadFile] = File([]),
+    folder_path: Optional[str] = Form(None),
+    conf_threshold: float = Form(0.25),
+    iou_threshold: float = Form(0.45)
+):
+    """
+    Tạo job detection offline từ các file upload hoặc 1 folder trên server
+    
+    Parameters:
+    - files: các file ảnh upload (không giới hạn số lượng, tối đa 50MB mỗi file)
+    - folder_path: folder tương đối trong JOB_FOLDER_ROOT (thay cho files)
+    - conf_threshold, iou_threshold: thresholds
+    
+    Returns:
+    - job: manifest của job (job_id, status, tiến độ)
+    """
+    if job_manager is None:
+        raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
+    
+    # Validate thresholds
+    if not (0 <= conf_threshold <= 1):
+        raise HTTPException(status_code=400, detail="Ngưỡng confidence phải trong khoảng 0 đến 1.")
+    if not (0 <= iou_threshold <= 1):
+        raise HTTPException(status_code=400, detail="Ngưỡng IoU phải trong khoảng 0 đến 1.")
+    if bool(files) == bool(folder_path):
+        raise HTTPException(status_code=400, detail="Cần truyền files hoặc folder_path (chỉ 1 trong 2).")
+    
+    if folder_path:
+        try:
+            job = job_manager.create_folder_job(folder_path, conf_threshold, iou_threshold)
+        except PermissionError as e:
+            raise HTTPException(status_code=403, detail=str(e))
+        except FileNotFoundError as e:
+            raise HTTPException(status_code=404, detail=str(e))
+        return {"success": True, "job": job}
+    
+    MAX_FILE_SIZE = 50 * 1024 * 1024  # 50MB
+    uploads = []
+    for i, file in enumerate(files):
+        if not file.content_type or not file.content_type.startswith('image/'):
+            continue
+        if file.size is not None and file.size > MAX_FILE_SIZE:
+            print(f"Skipping {file.filename}: file too large")
+            continue
+        # Prefix theo thứ tự để tên file không trùng nhau trong thư mục inputs
+        uploads.append((f"{i:06d}_{sanitize_filename(file.filename)}", file.file))
+    
+    if not uploads:
+        raise HTTPException(status_code=400, detail="Không có file ảnh hợp lệ.")
+    
+    # Copy file upload vào thư mục job trong thread (không block event loop)
+    job = await asyncio.to_thread(job_manager.create_upload_job, uploads, conf_threshold, iou_threshold)
+    return {"success": True, "job": job}
+
+
+@app.get("/api/jobs")
+async def list_jobs():
+    """Danh sách jobs và tiến độ"""
+    if job_manager is None:
+        raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
+    return {"success": True, "jobs": job_manager.list()}
+
+
+def get_job_or_404(job_id: str):
+    job = job_manager.get(job_id) if job_manager is not None else None
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} không tồn tại.")
+    return job
+
+
+@app.get("/api/jobs/{job_id}")
+async def get_job(job_id: str):
+    """Trạng thái và tiến độ của job"""
+    return {"success": True, "job": get_job_or_404(job_id)}
+
+
+@app.get("/api/jobs/{job_id}/results")
+async def get_job_results(job_id: str):
+    """Kết quả của job dạng NDJSON (1 dòng / ảnh, có thể tải khi job đang chạy)"""
+    get_job_or_404(job_id)
+    path = job_manager.results_path(job_id)
+    if not path.exists():
+        return StreamingResponse(iter(()), media_type="application/x-ndjson")
+    return FileResponse(path, media_type="application/x-ndjson", filename=f"{job_id}.ndjson")
+
+
+@app.delete("/api/jobs/{job_id}")
+async def cancel_job(job_id: str):
+    """Hủy job (job đang chạy dừng sau ảnh hiện tại, kết quả đã ghi được giữ lại)"""
+    get_job_or_404(job_id)
+    return {"success": True, "job": job_manager.cancel(job_id)}
+
+
+
+# Xử lý file video trên server (decode → inference → tracking → encode chạy song song)
+# VIDEO_OUTPUT_DIR: thư mục chứa video đã vẽ tracks (annotate=true)
+MAX_VIDEO_SIZE_MB = float(os.getenv("MAX_VIDEO_SIZE_MB", "500"))
+VIDEO_PIPELINE_BATCH_SIZE = int(os.getenv("VIDEO_PIPELINE_BATCH_SIZE", "4"))
+VIDEO_PIPELINE_QUEUE_SIZE = int(os.getenv("VIDEO_PIPELINE_QUEUE_SIZE", "8"))
+VIDEO_OUTPUT_DIR = Path(os.getenv("VIDEO_OUTPUT_DIR", "video_outputs"))
+VIDEO_PROGRESS_INTERVAL = 1.0  # giây giữa 2 dòng progress (NDJSON)
+
+
+def create_temp_video_path(filename):
+    """Tạo file tạm rỗng cho video upload (giữ đuôi file gốc để OpenCV nhận đúng container)"""
+    suffix = "".join(c for c in Path(filename or "").suffix if c.isalnum() or c == ".") or ".mp4"
+    fd, path = tempfile.mkstemp(suffix=suffix, prefix="video_")
+    os.close(fd)
+    return path
+
+
+def save_upload_to_temp(file, path, max_size):
+    """
+    Copy file upload ra file tạm path (chạy trong thread)
+    
+    Returns:
+    - True nếu kích thước file <= max_size
+    """
+    file.file.seek(0)
+    with open(path, "wb") as out:
+        shutil.copyfileobj(file.file, out, 1024 * 1024)
+        return out.tell() <= max_size
+
+
+def remove_temp_file(path):
+    """Xóa file tạm (bỏ qua nếu đã bị xóa)"""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+@app.post("/api/detect-video-file")
+async def detect_video_file(
+    file: UploadFile = File(...),
+    conf_threshold: float = Form(0.25),
+    iou_threshold: float = Form(0.45),
+    output_format: str = Form("ndjson"),
+    annotate: bool = Form(False),
+    _slot: None = Depends(admission_slot("batch"))
+):
+    """
+    Detection + tracking cho cả 1 file video, output được stream theo từng frame
+    
+    Parameters:
+    - file: file video (mp4, avi, ...)
+    - output_format: ndjson (1 dòng / frame, kèm dòng progress và summary) | mot (text MOTChallenge)
+    - annotate: ghi thêm video đã vẽ tracks, tải về qua URL trong header X-Annotated-Video
+    """
+    if detector is None:
+        raise HTTPException(status_code=500, detail="Model chưa được tải. Vui lòng kiểm tra lại server.")
+    
+    # Validate thresholds
+    if not (0 <= conf_threshold <= 1):
+        raise HTTPException(status_code=400, detail="Ngưỡng confidence phải trong khoảng 0 đến 1.")
+    if not (0 <= iou_threshold <= 1):
+        raise HTTPException(status_code=400, detail="Ngưỡng IoU phải trong khoảng 0 đến 1.")
+    if output_format not in OUTPUT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"output_format phải là một trong: {', '.join(OUTPUT_FORMATS)}.")
+    if file.content_type and not file.content_type.startswith(('video/', 'application/octet-stream')):
+        raise HTTPException(status_code=400, detail="File phải là video.")
+    
+    # File tạm được xóa ở finally cho tới khi response bắt đầu stream (lỗi, file quá lớn,
+    # client ngắt kết nối lúc upload); sau đó do stream_video_output / close_video_stream xóa
+    video_path = create_temp_video_path(file.filename)
+    streaming = False
+    try:
+        if not await asyncio.to_thread(save_upload_to_temp, file, video_path, int(MAX_VIDEO_SIZE_MB * 1024 * 1024)):
+            raise HTTPException(status_code=400, detail=f"File video quá lớn. Tối đa {MAX_VIDEO_SIZE_MB:g}MB.")
+        
+        annotated_path = None
+        headers = {}
+        if annotate:
+            VIDEO_OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+            annotated_path = VIDEO_OUTPUT_DIR / f"{uuid.uuid4().hex}.mp4"
+            headers["X-Annotated-Video"] = f"/api/video-outputs/{annotated_path.name}"
+        
+        pipeline = VideoPipeline(
+            detector, conf_threshold, iou_threshold,
+            batch_size=VIDEO_PIPELINE_BATCH_SIZE,
+            queue_size=VIDEO_PIPELINE_QUEUE_SIZE
+        )
+        outputs = pipeline.iter_output(video_path, output_format, annotated_path)
+        
+        # Kiểm tra mở được video trước khi trả status 200
+        try:
+            first = await asyncio.to_thread(next, outputs, None)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=500, detail=f"Lỗi xử lý video: {str(e)}")
+        
+        stream = stream_video_output(pipeline, outputs, first, output_format, headers.get("X-Annotated-Video"), video_path)
+        response = StreamingResponse(
+            stream,
+            media_type="application/x-ndjson" if output_format == "ndjson" else "text/plain",
+            headers=headers,
+            # Chạy sau khi stream kết thúc hoặc client ngắt kết nối (kể cả trước khi generator chạy)
+            background=BackgroundTask(close_video_stream, stream, video_path)
+        )
+        streaming = True
+        return response
+    finally:
+        if not streaming:
+            remove_temp_file(video_path)
+
+
+def stream_video_output(pipeline, outputs, first, output_format, annotated_video, video_path):
+    """
+    Output của /api/detect-video-file: generator sync, StreamingResponse chạy trong thread pool
+    (không block event loop)
+    """
+    last_report = time.perf_counter()
+    try:
+        if first is not None:
+            yield first
+        for text in outputs:
+            yield text
+            if output_format == "ndjson" and time.perf_counter() - last_report >= VIDEO_PROGRESS_INTERVAL:
+                yield json.dumps({"type": "progress", **pipeline.stats.to_dict()}) + "\n"
+                last_report = time.perf_counter()
+        if output_format == "ndjson":
+            yield json.dumps({
+                "type": "summary",
+                "success": True,
+                "annotated_video": annotated_video,
+                "statistics": pipeline.stats.to_dict()
+            }) + "\n"
+    except Exception as e:
+        print(f"Error processing video file: {e}")
+        if output_format == "ndjson":
+            yield json.dumps({"type": "error", "detail": str(e)}, ensure_ascii=False) + "\n"
+    finally:
+        # Client ngắt kết nối -> dừng các stage
+        outputs.close()
+        remove_temp_file(video_path)
+
+
+def close_video_stream(stream, video_path):
+    """Dừng pipeline (nếu generator còn dang dở) và xóa video tạm sau khi response kết thúc"""
+    try:
+        stream.close()
+    except ValueError:
+        # Generator đang chạy trong thread pool: tự dọn ở finally khi được giải phóng
+        pass
+    remove_temp_file(video_path)
+
+
+@app.get("/api/video-outputs/{name}")
+async def get_video_output(name: str):
+    """Tải video đã vẽ tracks của /api/detect-video-file"""
+    path = VIDEO_OUTPUT_DIR / Path(name).name
+    if path.name != name or not name.endswith(".mp4") or not path.is_file():
+        raise HTTPException(status_code=404, detail="Video không tồn tại.")
+    return FileResponse(path, media_type="video/mp4", filename=name)
+
 if __name__ == "__main__":
     uvicorn.run(app, host="0.0.0.0", port=8000)
 
@@ -0,0 +1,164 @@
+"""
+BatchEngine - Batch inference cho nhiều ảnh (folder hoặc nhiều file upload)
+Decode song song trên thread pool, chạy model.predict theo từng batch,
+post-process song song và trả kết quả ngay khi mỗi batch xong
+"""
+
+import os
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+
+from inference import load_image_scaled
+
+
+class RunningSummary:
+    """
+    Thống kê tổng hợp cập nhật dần theo từng ảnh (bộ nhớ không tăng theo số ảnh)
+    """
+
+    def __init__(self):
+        self.total_images = 0
+        self.images_with_detections = 0
+        self.total_detections = 0
+        self.class_counts = Counter()
+        self.confidence_sum = 0.0
+
+    def add(self, detections):
+        """
+        Cộng dồn kết quả của 1 ảnh
+
+        Parameters:
+        - detections: list of dicts với keys class, confidence
+        """
+        self.total_images += 1
+        self.total_detections += len(detections)
+        if detections:
+            self.images_with_detections += 1
+        for det in detections:
+            self.class_counts[det["class"]] += 1
+            self.confidence_sum += det["confidence"]
+
+    def to_dict(self):
+        avg_confidence = self.confidence_sum / self.total_detections if self.total_detections else 0
+        return {
+            "total_images": self.total_images,
+            "images_with_detections": self.images_with_detections,
+            "total_detections": self.total_detections,
+            "class_distribution": dict(self.class_counts),
+            "avg_confidence": round(avg_confidence, 4)
+        }
+
+
+class BatchItem:
+    """Một ảnh trong batch: input, YOLO result và output sau post-process"""
+
+    __slots__ = ("index", "name", "image", "scale", "result", "output", "error")
+
+    def __init__(self, index, name):
+        self.index = index
+        self.name = name
+        self.image = None
+        self.scale = (1.0, 1.0)  # tọa độ ảnh decode -> ảnh gốc
+        self.result = None
+        self.output = None
+        self.error = None
+
+
+class BatchEngine:
+    """
+    Engine batch inference dùng chung detector
+    """
+
+    def __init__(self, detector, batch_size=16, workers=None, decode_size=None):
+        """
+        Parameters:
+        - detector: ObjectDetector dùng chung
+        - batch_size: số ảnh mỗi lần model.predict
+        - workers: số thread decode/post-process (None = theo số CPU, tối đa 8)
+        - decode_size: decode JPEG lớn ở kích thước giảm với cạnh dài >= decode_size
+          (item.scale đổi tọa độ về ảnh gốc), None = decode full
+        """
+        self.detector = detector
+        self.batch_size = max(1, int(batch_size))
+        self.workers = max(1, int(workers)) if workers else min(8, os.cpu_count() or 1)
+        self.decode_size = decode_size
+
+    def _decode(self, item, source):
+        """Decode 1 ảnh (chạy trong thread pool)"""
+        try:
+            item.image, item.scale = load_image_scaled(source, self.decode_size)
+        except Exception as e:
+            print(f"Error decoding {item.name}: {e}")
+        if item.image is None:
+            item.error = "Không thể đọc file ảnh."
+        return item
+
+    @staticmethod
+    def _postprocess(item, postprocess):
+        """Post-process 1 ảnh đã có result (chạy trong thread pool)"""
+        try:
+            item.output = postprocess(item)
+        except Exception as e:
+            print(f"Error post-processing {item.name}: {e}")
+            item.error = f"Lỗi xử lý ảnh: {str(e)}"
+        return item
+
+    def _submit_decode(self, pool, chunk):
+        return [pool.submit(self._decode, BatchItem(index, name), source) for index, name, source in chunk]
+
+    def iter_batches(self, sources, conf=None, iou=None, postprocess=None):
+        """
+        Chạy inference cho nhiều ảnh, yield kết quả theo từng batch
+
+        Batch tiếp theo được decode trong lúc batch hiện tại đang predict,
+        nên bộ nhớ chỉ giữ tối đa 2 batch ảnh đã decode
+
+        Parameters:
+        - sources: iterable (name, source), source là đường dẫn, bytes hoặc numpy array BGR
+        - conf, iou: thresholds (None = dùng mặc định của detector)
+        - postprocess: hàm(item) -> output, chạy song song cho các ảnh có result
+
+        Yields:
+        - items: list BatchItem của 1 batch, theo thứ tự input
+        """
+        conf = self.detector.conf_threshold if conf is None else conf
+        iou = self.detector.iou_threshold if iou is None else iou
+        indexed = ((index, name, source) for index, (name, source) in enumerate(sources))
+
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            chunk = list(islice(indexed, self.batch_size))
+            pending = self._submit_decode(pool, chunk)
+
+            while pending:
+                items = [future.result() for future in pending]
+
+                # Prefetch: decode batch tiếp theo song song với predict
+                chunk = list(islice(indexed, self.batch_size))
+                pending = self._submit_decode(pool, chunk)
+
+                decoded = [item for item in items if item.image is not None]
+                if decoded:
+                    # Chạy trên thread của request/job (ngoài scheduler): predict_batch giữ
+                    # predict_lock của detector nên không chạy chồng với scheduler/job khác
+                    try:
+                        results = self.detector.predict_batch([item.image for item in decoded], conf, iou)
+                        for item, result in zip(decoded, results):
+                            item.result = result
+                    except Exception as e:
+                        print(f"Error in batch inference: {e}")
+                        for item in decoded:
+                            item.error = f"Lỗi xử lý ảnh: {str(e)}"
+
+                if postprocess is not None:
+                    ready = [item for item in decoded if item.result is not None]
+                    list(pool.map(lambda item: self._postprocess(item, postprocess), ready))
+
+                yield items
+
+    def run(self, sources, conf=None, iou=None, postprocess=None):
+        """
+        Giống iter_batches nhưng yield từng BatchItem
+        """
+        for items in self.iter_batches(sources, conf, iou, postprocess):
+            yield from items
@@ -0,0 +1,238 @@
+"""
+Micro-benchmark cho các thành phần backend
+Chạy: python benchmark.py association | kalman | features | backends
+"""
+
+import argparse
+import time
+
+import cv2
+import numpy as np
+
+from deepsort import BatchKalmanFilter, DeepSortTracker, FeatureExtractor, KalmanBoxTracker, Track, iou_batch
+
+
+def _time_call(fn, repeat):
+    """Thời gian trung bình (ms) của fn qua repeat lần gọi"""
+    fn()  # warm-up
+    started = time.perf_counter()
+    for _ in range(repeat):
+        fn()
+    return (time.perf_counter() - started) * 1000 / repeat
+
+
+def _random_detections(rng, n, width=1920, height=1080):
+    x1 = rng.uniform(0, width - 100, n)
+    y1 = rng.uniform(0, height - 100, n)
+    w = rng.uniform(20, 100, n)
+    h = rng.uniform(40, 100, n)
+    return [
+        {'bbox': [float(x1[i]), float(y1[i]), float(x1[i] + w[i]), float(y1[i] + h[i])],
+         'class': 'person', 'class_id': 0, 'confidence': 0.9}
+        for i in range(n)
+    ]
+
+
+def _random_features(rng, n, dim=128):
+    features = rng.random((n, dim)).astype(np.float32)
+    return features / np.linalg.norm(features, axis=1, keepdims=True)
+
+
+def _loop_cost_matrix(tracker, detections, features):
+    """Cách tính cost matrix cũ (nested Python loops) để so sánh"""
+    iou_matrix = np.zeros((len(detections), len(tracker.tracks)), dtype=np.float32)
+    for i, det in enumerate(detections):
+        for j, track in enumerate(tracker.tracks):
+            iou_matrix[i, j] = tracker._compute_iou(det['bbox'], track.get_state())
+    feature_matrix = np.zeros((len(detections), len(tracker.tracks)), dtype=np.float32)
+    for i, feat in enumerate(features):
+        for j, track in enumerate(tracker.tracks):
+            feature_matrix[i, j] = 1 - np.dot(feat, track.feature)
+    return 0.5 * (1 - iou_matrix) + 0.5 * feature_matrix
+
+
+def bench_association(sizes, repeat):
+    """So sánh cost matrix vectorized với nested loops"""
+    rng = np.random.default_rng(0)
+    print(f"{'objects':>8} {'loop (ms)':>12} {'vectorized (ms)':>16} {'speedup':>9}")
+    for n in sizes:
+        tracker = DeepSortTracker()
+        detections = _random_detections(rng, n)
+        features = _random_features(rng, n)
+        tracker.tracks = [Track(det, features[i], i + 1, kalman=tracker.kalman) for i, det in enumerate(detections)]
+
+        loop_repeat = max(1, repeat // max(1, n // 10))
+        loop_ms = _time_call(lambda: _loop_cost_matrix(tracker, detections, features), loop_repeat)
+        vec_ms = _time_call(lambda: tracker._compute_cost_matrix(detections, features), repeat)
+
+        assert np.allclose(
+            _loop_cost_matrix(tracker, detections, features),
+            tracker._compute_cost_matrix(detections, features),
+            atol=1e-5
+        )
+        print(f"{n:>8} {loop_ms:>12.3f} {vec_ms:>16.3f} {loop_ms / vec_ms:>8.1f}x")
+
+
+def bench_kalman(sizes, repeat):
+    """So sánh 1 frame predict + update: KalmanBoxTracker từng track vs BatchKalmanFilter"""
+    rng = np.random.default_rng(0)
+    print(f"{'tracks':>8} {'per-track (ms)':>15} {'batched (ms)':>13} {'speedup':>9}")
+    for n in sizes:
+        boxes = np.array([det['bbox'] for det in _random_detections(rng, n)])
+        measured = boxes + rng.normal(0, 2, boxes.shape)
+
+        singles = [KalmanBoxTracker(b) for b in boxes]
+        batch = BatchKalmanFilter()
+        batch.add(boxes)
+        indices = np.arange(n)
+
+        def per_track_step():
+            for kf, z in zip(singles, measured):
+                kf.predict()
+                kf.update(z)
+
+        def batched_step():
+            batch.predict()
+            batch.update(indices, measured)
+
+        single_ms = _time_call(per_track_step, repeat)
+        batch_ms = _time_call(batched_step, repeat)
+        print(f"{n:>8} {single_ms:>15.3f} {batch_ms:>13.3f} {single_ms / batch_ms:>8.1f}x")
+
+
+def _loop_extract(detections, frame_rgb, feature_dim=128):
+    """Cách extract features cũ (convert cả frame + loop từng box) để so sánh"""
+    frame_bgr = cv2.cvtColor(frame_rgb, cv2.COLOR_RGB2BGR)
+    h, w = frame_rgb.shape[:2]
+    features = []
+    for det in detections:
+        x1, y1, x2, y2 = map(int, det['bbox'])
+        x1 = max(0, min(x1, w - 1))
+        y1 = max(0, min(y1, h - 1))
+        x2 = max(x1 + 1, min(x2, w))
+        y2 = max(y1 + 1, min(y2, h))
+        crop = cv2.resize(frame_bgr[y1:y2, x1:x2], (64, 128))
+        hists = [cv2.calcHist([crop], [c], None, [32], [0, 256]).flatten() for c in range(3)]
+        feature = np.concatenate([hist / (hist.sum() + 1e-6) for hist in hists])
+        feature = np.pad(feature, (0, feature_dim - len(feature)))
+        features.append(feature / (np.linalg.norm(feature) + 1e-6))
+    return np.array(features, dtype=np.float32)
+
+
+def bench_features(sizes, repeat):
+    """So sánh feature extraction batched với loop từng box"""
+    rng = np.random.default_rng(0)
+    frame = rng.integers(0, 256, (1080, 1920, 3), dtype=np.uint8)
+    extractor = FeatureExtractor()
+    print(f"{'boxes':>8} {'loop (ms)':>12} {'batched (ms)':>13} {'speedup':>9}")
+    for n in sizes:
+        detections = _random_detections(rng, n)
+        loop_ms = _time_call(lambda: _loop_extract(detections, frame), repeat)
+        batch_ms = _time_call(lambda: extractor.extract(detections, frame), repeat)
+        assert np.allclose(_loop_extract(detections, frame), extractor.extract(detections, frame), atol=1e-5)
+        print(f"{n:>8} {loop_ms:>12.3f} {batch_ms:>13.3f} {loop_ms / batch_ms:>8.1f}x")
+
+
+def _load_images(folder, count, rng):
+    """Ảnh benchmark từ folder (BGR), ảnh ngẫu nhiên 1280x720 nếu không có folder"""
+    if folder:
+        from inference import list_images, load_image
+        images = [load_image(path) for path in list_images(folder)[:count]]
+        images = [img for img in images if img is not None]
+        if images:
+            return images
+    return [rng.integers(0, 256, (720, 1280, 3), dtype=np.uint8) for _ in range(count)]
+
+
+def _box_agreement(reference, other, iou_threshold=0.9):
+    """
+    So sánh boxes của 2 backend trên cùng ảnh
+
+    Returns:
+    - (tỉ lệ box của reference có box cùng class với IoU >= iou_threshold trong other,
+       độ lệch tọa độ lớn nhất (px) của các box khớp)
+    """
+    if len(reference) == 0:
+        return (1.0 if len(other) == 0 else 0.0), 0.0
+    if len(other) == 0:
+        return 0.0, 0.0
+    ious = iou_batch(reference.xyxy, other.xyxy)
+    ious[reference.class_id[:, None] != other.class_id[None, :]] = 0
+    best = ious.argmax(axis=1)
+    matched = ious[np.arange(len(reference)), best] >= iou_threshold
+    if not matched.any():
+        return 0.0, 0.0
+    max_diff = float(np.abs(reference.xyxy[matched] - other.xyxy[best[matched]]).max())
+    return float(matched.mean()), max_diff
+
+
+def bench_backends(model_path, backends, imgsz, images_folder, count, batch_size, repeat):
+    """Latency (1 ảnh) và throughput (theo batch) của từng backend, so sánh boxes với backend đầu tiên"""
+    from detections import Detections
+    from inference import ObjectDetector
+
+    rng = np.random.default_rng(0)
+    images = _load_images(images_folder, count, rng)
+    batch = images[:batch_size]
+    print(f"{len(images)} images, batch {len(batch)}, imgsz {imgsz}")
+    print(f"{'backend':>12} {'latency (ms)':>13} {'batch (ms)':>11} {'img/s':>8} {'speedup':>8} "
+          f"{'box match':>10} {'max diff (px)':>14}")
+
+    reference = None
+    baseline_ms = None
+    for backend in backends:
+        detector = ObjectDetector(model_path, backend=backend, imgsz=imgsz)
+        latency_ms = _time_call(lambda: detector.predict_batch(images[:1], 0.25, 0.45), repeat)
+        batch_ms = _time_call(lambda: detector.predict_batch(batch, 0.25, 0.45), max(1, repeat // 2))
+
+        outputs = [Detections.from_result(result, detector.classes)
+                   for result in detector.predict_batch(images, 0.25, 0.45)]
+        if reference is None:
+            reference, baseline_ms = outputs, latency_ms
+            match, max_diff = 1.0, 0.0
+        else:
+            pairs = [_box_agreement(ref, out) for ref, out in zip(reference, outputs)]
+            match = float(np.mean([m for m, _ in pairs]))
+            max_diff = max(d for _, d in pairs)
+        print(f"{backend:>12} {latency_ms:>13.2f} {batch_ms:>11.2f} {len(batch) * 1000 / batch_ms:>8.1f} "
+              f"{baseline_ms / latency_ms:>7.2f}x {match:>10.1%} {max_diff:>14.2f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backend micro-benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    association = subparsers.add_parser("association", help="IoU + cosine cost matrix của DeepSORT")
+    association.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    association.add_argument("--repeat", type=int, default=20)
+
+    kalman = subparsers.add_parser("kalman", help="Kalman predict + update cho tất cả tracks")
+    kalman.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    kalman.add_argument("--repeat", type=int, default=20)
+
+    features = subparsers.add_parser("features", help="Appearance feature extraction (color histograms)")
+    features.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 500])
+    features.add_argument("--repeat", type=int, default=10)
+
+    backends = subparsers.add_parser("backends", help="YOLO inference trên CPU theo từng backend")
+    backends.add_argument("--model", default="../best.pt")
+    backends.add_argument("--backends", nargs="+", default=["torch", "onnx", "torchscript"])
+    backends.add_argument("--imgsz", type=int, default=640)
+    backends.add_argument("--images", default=None, help="Folder ảnh (mặc định: ảnh ngẫu nhiên)")
+    backends.add_argument("--count", type=int, default=16)
+    backends.add_argument("--batch-size", type=int, default=8)
+    backends.add_argument("--repeat", type=int, default=10)
+
+    args = parser.parse_args()
+    if args.command == "association":
+        bench_association(args.sizes, args.repeat)
+    elif args.command == "kalman":
+        bench_kalman(args.sizes, args.repeat)
+    elif args.command == "features":
+        bench_features(args.sizes, args.repeat)
+    elif args.command == "backends":
+        bench_backends(args.model, args.backends, args.imgsz, args.images, args.count, args.batch_size, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
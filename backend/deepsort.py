@@ -3,12 +3,48 @@ DeepSORT Implementation cho Multi-Object Tracking
 Dựa trên paper: "Simple Online and Realtime Tracking with a Deep Association Metric"
 """
 
+import json
+import struct
+import zlib
+
 import numpy as np
 from collections import deque
 from scipy.optimize import linear_sum_assignment
 from filterpy.kalman import KalmanFilter
 import cv2
 
+from detections import Detections
+
+
+def iou_batch(boxes_a, boxes_b):
+    """
+    Compute IoU giữa 2 tập bounding boxes bằng broadcasting
+    
+    Parameters:
+    - boxes_a: numpy array (N, 4) [x1, y1, x2, y2]
+    - boxes_b: numpy array (M, 4) [x1, y1, x2, y2]
+    
+    Returns:
+    - iou_matrix: numpy array (N, M)
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    
+    a = boxes_a[:, None, :]
+    b = boxes_b[None, :, :]
+    
+    # Intersection
+    inter_w = np.clip(np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]), 0, None)
+    inter_h = np.clip(np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]), 0, None)
+    intersection = inter_w * inter_h
+    
+    # Union
+    area_a = (boxes_a[:, 2] - boxes_a[:, 0]) * (boxes_a[:, 3] - boxes_a[:, 1])
+    area_b = (boxes_b[:, 2] - boxes_b[:, 0]) * (boxes_b[:, 3] - boxes_b[:, 1])
+    union = area_a[:, None] + area_b[None, :] - intersection
+    
+    return np.where(union != 0, intersection / np.where(union != 0, union, 1), 0).astype(np.float32)
+
 
 class KalmanBoxTracker:
     """
@@ -130,12 +166,200 @@ class KalmanBoxTracker:
         return np.array([x1, y1, x2, y2], dtype=np.float32)
 
 
+def _bbox_to_z(bboxes):
+    """
+    Convert bboxes [x1, y1, x2, y2] (N, 4) sang measurement [x, y, s, r] (N, 4)
+    """
+    bboxes = np.asarray(bboxes, dtype=np.float64).reshape(-1, 4)
+    w = bboxes[:, 2] - bboxes[:, 0]
+    h = bboxes[:, 3] - bboxes[:, 1]
+    x = bboxes[:, 0] + w / 2
+    y = bboxes[:, 1] + h / 2
+    s = w * h
+    r = np.divide(w, h, out=np.ones_like(w), where=h > 0)
+    return np.stack([x, y, s, r], axis=1)
+
+
+class BatchKalmanFilter:
+    """
+    Kalman Filter dạng struct-of-arrays cho tất cả tracks
+    Cùng mô hình với KalmanBoxTracker nhưng state (N, 7) và covariance (N, 7, 7)
+    được lưu trong mảng chung, predict/update mọi track bằng 1 lần gọi vectorized
+    """
+    
+    # Cùng các ma trận với KalmanBoxTracker
+    F = np.array([
+        [1, 0, 0, 0, 1, 0, 0],
+        [0, 1, 0, 0, 0, 1, 0],
+        [0, 0, 1, 0, 0, 0, 1],
+        [0, 0, 0, 1, 0, 0, 0],
+        [0, 0, 0, 0, 1, 0, 0],
+        [0, 0, 0, 0, 0, 1, 0],
+        [0, 0, 0, 0, 0, 0, 1]
+    ], dtype=np.float64)
+    
+    H = np.array([
+        [1, 0, 0, 0, 0, 0, 0],
+        [0, 1, 0, 0, 0, 0, 0],
+        [0, 0, 1, 0, 0, 0, 0],
+        [0, 0, 0, 1, 0, 0, 0]
+    ], dtype=np.float64)
+    
+    P0 = np.diag([10., 10., 10., 10., 10000., 10000., 10000.])
+    R = np.diag([1., 1., 10., 10.])
+    Q = np.diag([1., 1., 1., 1., 0.01, 0.01, 0.0001])
+    
+    def __init__(self, capacity=64):
+        """
+        capacity: số track cấp phát ban đầu (tự tăng khi cần)
+        """
+        self._x = np.zeros((capacity, 7), dtype=np.float64)
+        self._P = np.zeros((capacity, 7, 7), dtype=np.float64)
+        self.count = 0
+    
+    def __len__(self):
+        return self.count
+    
+    @property
+    def x(self):
+        """State của các track đang dùng (N, 7)"""
+        return self._x[:self.count]
+    
+    @property
+    def P(self):
+        """Covariance của các track đang dùng (N, 7, 7)"""
+        return self._P[:self.count]
+    
+    @property
+    def nbytes(self):
+        """Memory đã cấp phát cho state + covariance (theo capacity)"""
+        return self._x.nbytes + self._P.nbytes
+    
+    @classmethod
+    def from_arrays(cls, x, P):
+        """
+        Tạo filter từ state (N, 7) và covariance (N, 7, 7) có sẵn (khi load tracker đã serialize)
+        """
+        kalman = cls(capacity=max(1, len(x)))
+        kalman.count = len(x)
+        kalman._x[:kalman.count] = x
+        kalman._P[:kalman.count] = P
+        return kalman
+    
+    def _grow(self, needed):
+        capacity = len(self._x)
+        if needed <= capacity:
+            return
+        new_capacity = max(needed, capacity * 2)
+        x = np.zeros((new_capacity, 7), dtype=np.float64)
+        P = np.zeros((new_capacity, 7, 7), dtype=np.float64)
+        x[:self.count] = self.x
+        P[:self.count] = self.P
+        self._x, self._P = x, P
+    
+    def add(self, bboxes):
+        """
+        Thêm track mới từ bboxes [x1, y1, x2, y2]
+        
+        Returns:
+        - indices: numpy array index của các row mới
+        """
+        z = _bbox_to_z(bboxes)
+        n = len(z)
+        self._grow(self.count + n)
+        indices = np.arange(self.count, self.count + n)
+        self._x[indices] = 0.
+        self._x[indices, :4] = z
+        self._P[indices] = self.P0
+        self.count += n
+        return indices
+    
+    def predict(self, indices=None):
+        """
+        Predict next state cho các track (None = tất cả)
+        """
+        if indices is None:
+            indices = slice(0, self.count)
+        x = self._x[indices]
+        P = self._P[indices]
+        
+        # Giữ scale không âm (giống KalmanBoxTracker.predict)
+        x[(x[:, 6] + x[:, 2]) <= 0, 6] = 0.
+        
+        self._x[indices] = x @ self.F.T
+        self._P[indices] = self.F @ P @ self.F.T + self.Q
+    
+    def update(self, indices, bboxes):
+        """
+        Update các track indices với bboxes đo được (Joseph form giống filterpy)
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(indices) == 0:
+            return
+        z = _bbox_to_z(bboxes)
+        x = self._x[indices]
+        P = self._P[indices]
+        
+        y = z - x @ self.H.T
+        PHT = P @ self.H.T
+        S = self.H @ PHT + self.R
+        K = PHT @ np.linalg.inv(S)
+        
+        self._x[indices] = x + np.einsum('nij,nj->ni', K, y)
+        I_KH = np.eye(7) - K @ self.H
+        self._P[indices] = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+    
+    def translate(self, indices, offsets):
+        """
+        Dịch tâm box (x, y) của các track, không đổi velocity/covariance
+        (dùng để hiệu chỉnh prediction bằng optical flow)
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        if len(indices) == 0:
+            return
+        self._x[indices, :2] += np.asarray(offsets, dtype=np.float64).reshape(-1, 2)
+    
+    def get_states(self, indices=None):
+        """
+        Get bounding box estimate [x1, y1, x2, y2] cho các track
+        
+        Returns:
+        - states: numpy array (N, 4) float32
+        """
+        if indices is None:
+            indices = slice(0, self.count)
+        x, y, s, r = self._x[indices, :4].T
+        
+        with np.errstate(invalid='ignore'):
+            w = np.sqrt(s * r)
+            h = np.divide(s, w, out=np.zeros_like(s), where=w > 0)
+        
+        return np.stack([x - w / 2, y - h / 2, x + w / 2, y + h / 2], axis=1).astype(np.float32)
+    
+    def keep(self, indices):
+        """
+        Giữ lại các row indices (theo thứ tự truyền vào) và bỏ các row còn lại
+        """
+        indices = np.asarray(indices, dtype=np.intp)
+        n = len(indices)
+        self._x[:n] = self._x[indices]
+        self._P[:n] = self._P[indices]
+        self.count = n
+
+
 class FeatureExtractor:
     """
     Feature Extractor để extract appearance features từ bounding boxes
     Sử dụng lightweight CNN hoặc simple feature extraction
     """
     
+    # Kích thước crop chuẩn hóa và số bins histogram mỗi kênh màu
+    CROP_WIDTH = 64
+    CROP_HEIGHT = 128
+    HIST_BINS = 32
+    # Số box xử lý mỗi lượt (box index trong joint histogram lưu bằng uint8)
+    CHUNK_SIZE = 128
+    
     def __init__(self, feature_dim=128):
         """
         feature_dim: dimension của feature vector
@@ -144,71 +368,88 @@ class FeatureExtractor:
         # Sử dụng simple histogram-based features cho bước đầu
         # Có thể nâng cấp lên CNN sau
     
-    def extract(self, detections, frame):
+    def extract(self, detections, frame, channel_order='RGB'):
         """
         Extract features từ detections
         
+        Histogram của tất cả crops được tính trong 1 lượt vectorized,
+        làm việc trực tiếp trên thứ tự kênh gốc của frame (không convert màu)
+        
         Parameters:
-        - detections: list of detections, mỗi detection có 'bbox'
-        - frame: numpy array (H, W, 3) RGB image
+        - detections: Detections (hoặc list dict có 'bbox')
+        - frame: numpy array (H, W, 3) image
+        - channel_order: thứ tự kênh của frame ('RGB' hoặc 'BGR')
         
         Returns:
         - features: numpy array (N, feature_dim)
+          Layout: [hist B (32), hist G (32), hist R (32), padding], chuẩn hóa unit vector
         """
         if len(detections) == 0:
             return np.empty((0, self.feature_dim))
         
-        features = []
-        frame_bgr = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
-        
-        for det in detections:
-            bbox = det['bbox']
-            x1, y1, x2, y2 = map(int, bbox)
-            
-            # Clip bbox to frame bounds
-            h, w = frame.shape[:2]
-            x1 = max(0, min(x1, w - 1))
-            y1 = max(0, min(y1, h - 1))
-            x2 = max(x1 + 1, min(x2, w))
-            y2 = max(y1 + 1, min(y2, h))
-            
-            # Crop region
-            crop = frame_bgr[y1:y2, x1:x2]
-            
-            if crop.size == 0:
-                # Empty crop, use zero features
-                features.append(np.zeros(self.feature_dim))
-                continue
-            
-            # Resize to fixed size
-            crop_resized = cv2.resize(crop, (64, 128))
-            
-            # Extract simple features (histogram + HOG-like)
-            # Color histogram
-            hist_b = cv2.calcHist([crop_resized], [0], None, [32], [0, 256])
-            hist_g = cv2.calcHist([crop_resized], [1], None, [32], [0, 256])
-            hist_r = cv2.calcHist([crop_resized], [2], None, [32], [0, 256])
-            
-            # Normalize
-            hist_b = hist_b.flatten() / (hist_b.sum() + 1e-6)
-            hist_g = hist_g.flatten() / (hist_g.sum() + 1e-6)
-            hist_r = hist_r.flatten() / (hist_r.sum() + 1e-6)
-            
-            # Combine features
-            feature = np.concatenate([hist_b, hist_g, hist_r])
-            
-            # Pad or truncate to feature_dim
-            if len(feature) < self.feature_dim:
-                feature = np.pad(feature, (0, self.feature_dim - len(feature)))
-            else:
-                feature = feature[:self.feature_dim]
-            
-            # Normalize to unit vector
-            feature = feature / (np.linalg.norm(feature) + 1e-6)
-            
-            features.append(feature)
-        
-        return np.array(features, dtype=np.float32)
+        if isinstance(detections, Detections):
+            boxes = detections.xyxy.astype(np.float64)
+        else:
+            boxes = np.array([det['bbox'] for det in detections], dtype=np.float64).reshape(-1, 4)
+        
+        # Clip bbox to frame bounds
+        h, w = frame.shape[:2]
+        x1 = np.clip(boxes[:, 0].astype(np.int64), 0, w - 1)
+        y1 = np.clip(boxes[:, 1].astype(np.int64), 0, h - 1)
+        x2 = np.maximum(x1 + 1, np.minimum(boxes[:, 2].astype(np.int64), w))
+        y2 = np.maximum(y1 + 1, np.minimum(boxes[:, 3].astype(np.int64), h))
+        
+        # Histogram luôn theo thứ tự kênh B, G, R
+        channels = [2, 1, 0] if channel_order.upper() == 'RGB' else [0, 1, 2]
+        
+        histograms = np.empty((len(boxes), 3, self.HIST_BINS), dtype=np.float64)
+        for start in range(0, len(boxes), self.CHUNK_SIZE):
+            chunk = slice(start, start + self.CHUNK_SIZE)
+            histograms[chunk] = self._crop_histograms(
+                frame, x1[chunk], y1[chunk], x2[chunk], y2[chunk]
+            )
+        histograms = histograms[:, channels]
+        
+        # Normalize từng kênh
+        histograms /= histograms.sum(axis=2, keepdims=True) + 1e-6
+        combined = histograms.reshape(len(boxes), -1)
+        
+        # Pad or truncate to feature_dim
+        features = np.zeros((len(boxes), self.feature_dim), dtype=np.float64)
+        size = min(combined.shape[1], self.feature_dim)
+        features[:, :size] = combined[:, :size]
+        
+        # Normalize to unit vector
+        features /= np.linalg.norm(features, axis=1, keepdims=True) + 1e-6
+        
+        return features.astype(np.float32)
+    
+    def _crop_histograms(self, frame, x1, y1, x2, y2):
+        """
+        Resize tất cả crops vào 1 buffer chung (N * CROP_HEIGHT, CROP_WIDTH, 3) rồi tính
+        histogram của mọi crop cùng lúc bằng joint histogram (box index, giá trị pixel)
+        
+        Returns:
+        - histograms: numpy array (N, 3, HIST_BINS) theo thứ tự kênh gốc của frame
+        """
+        n = len(x1)
+        crops = np.empty((n, self.CROP_HEIGHT, self.CROP_WIDTH, 3), dtype=np.uint8)
+        for i in range(n):
+            cv2.resize(frame[y1[i]:y2[i], x1[i]:x2[i]], (self.CROP_WIDTH, self.CROP_HEIGHT), dst=crops[i])
+        crops = crops.reshape(n * self.CROP_HEIGHT, self.CROP_WIDTH, 3)
+        
+        # Ảnh box index (uint8, cùng depth với frame) cùng kích thước với crops xếp chồng
+        box_ids = np.repeat(
+            np.arange(n, dtype=np.uint8), self.CROP_HEIGHT * self.CROP_WIDTH
+        ).reshape(crops.shape[:2])
+        
+        histograms = np.empty((n, 3, self.HIST_BINS), dtype=np.float64)
+        for c in range(3):
+            histograms[:, c] = cv2.calcHist(
+                [box_ids, crops], [0, 1 + c], None,
+                [n, self.HIST_BINS], [0, n, 0, 256]
+            )
+        return histograms
 
 
 class Track:
@@ -216,15 +457,17 @@ class Track:
     Track object để quản lý một đối tượng được track
     """
     
-    def __init__(self, detection, feature, track_id):
+    def __init__(self, detection, feature, track_id, kalman=None):
         """
         Parameters:
         - detection: dict với keys: bbox, class, confidence
         - feature: feature vector
         - track_id: unique track ID
+        - kalman: BatchKalmanFilter dùng chung của tracker (None = tạo riêng)
         """
         self.track_id = track_id
-        self.kalman = KalmanBoxTracker(detection['bbox'])
+        self.kalman = kalman if kalman is not None else BatchKalmanFilter(capacity=1)
+        self.kf_index = int(self.kalman.add([detection['bbox']])[0])
         self.feature = feature / (np.linalg.norm(feature) + 1e-6)  # Normalize
         self.class_name = detection['class']
         self.confidence = detection['confidence']
@@ -236,15 +479,45 @@ class Track:
         self.is_confirmed = False
         self.history = deque(maxlen=30)  # Store last 30 states
     
+    @classmethod
+    def restore(cls, kalman, kf_index, track_id, feature, class_name, confidence, class_id,
+                time_since_update, hit_streak, age, is_confirmed, history):
+        """
+        Tạo lại track từ state đã serialize (Kalman state đã nằm sẵn trong kalman ở row kf_index)
+        """
+        track = cls.__new__(cls)
+        track.track_id = track_id
+        track.kalman = kalman
+        track.kf_index = kf_index
+        track.feature = feature
+        track.class_name = class_name
+        track.confidence = confidence
+        track.class_id = class_id
+        track.time_since_update = time_since_update
+        track.hit_streak = hit_streak
+        track.age = age
+        track.is_confirmed = is_confirmed
+        track.history = deque(history, maxlen=30)
+        return track
+    
     def update(self, detection, feature):
         """
         Update track với detection mới
         """
-        self.kalman.update(detection['bbox'])
+        self.kalman.update([self.kf_index], [detection['bbox']])
+        self.mark_updated(
+            feature, self.get_state(), detection['class'], detection['confidence'], detection.get('class_id', 0)
+        )
+    
+    def mark_updated(self, feature, state, class_name, confidence, class_id):
+        """
+        Cập nhật thông tin track sau khi Kalman state đã được update
+        (DeepSortTracker update Kalman cho tất cả tracks matched trong 1 lần gọi)
+        """
         self.feature = feature / (np.linalg.norm(feature) + 1e-6)
-        self.class_name = detection['class']
-        self.confidence = detection['confidence']
-        self.class_id = detection.get('class_id', 0)
+        self.class_name = class_name
+        self.confidence = float(confidence)
+        self.class_id = int(class_id)
         
         self.time_since_update = 0
         self.hit_streak += 1
@@ -255,25 +528,30 @@ class Track:
             self.is_confirmed = True
         
         # Update history
-        state = self.kalman.get_state()
-        self.history.append(state.copy())
+        self.history.append(np.array(state, dtype=np.float32))
     
     def predict(self):
         """
         Predict next state
         """
-        state = self.kalman.predict()
+        self.kalman.predict([self.kf_index])
+        self.mark_predicted()
+        return self.get_state()
+    
+    def mark_predicted(self):
+        """
+        Cập nhật bộ đếm sau khi Kalman state đã được predict
+        """
         self.age += 1
         if self.time_since_update > 0:
             self.hit_streak = 0
         self.time_since_update += 1
-        return state
     
     def get_state(self):
         """
         Get current state
         """
-        return self.kalman.get_state()
+        return self.kalman.get_states([self.kf_index])[0]
     
     def to_dict(self, is_new=False):
         """
@@ -313,26 +591,31 @@ class DeepSortTracker:
         self.next_id = 1
         self.feature_extractor = FeatureExtractor(feature_dim=feature_dim)
         
+        # Kalman state của tất cả tracks trong mảng chung (predict/update vectorized)
+        self.kalman = BatchKalmanFilter()
+        
         # Feature cache để tính cosine similarity
         self.feature_cache = {}
     
-    def update(self, detections, frame):
+    def update(self, detections, frame, channel_order='RGB'):
         """
         Update tracker với detections mới
         
         Parameters:
-        - detections: list of dicts, mỗi dict có keys: bbox, class, confidence, class_id
-        - frame: numpy array (H, W, 3) RGB image
+        - detections: Detections (hoặc list of dicts với keys: bbox, class, confidence, class_id)
+        - frame: numpy array (H, W, 3) image
+        - channel_order: thứ tự kênh của frame ('RGB' hoặc 'BGR')
         
         Returns:
         - tracks: list of Track objects
         """
-        # Extract features từ detections
-        features = self.feature_extractor.extract(detections, frame)
+        detections = Detections.coerce(detections)
         
-        # Predict tracks
-        for track in self.tracks:
-            track.predict()
+        # Extract features từ detections (trên thứ tự kênh gốc của frame)
+        features = self.feature_extractor.extract(detections, frame, channel_order)
+        
+        # Predict tất cả tracks trong 1 lần gọi
+        self._predict_tracks()
         
         # Association
         if len(detections) == 0:
@@ -341,10 +624,7 @@ class DeepSortTracker:
         
         if len(self.tracks) == 0:
             # Không có tracks, tạo mới tất cả detections
-            for i, det in enumerate(detections):
-                track = Track(det, features[i], self.next_id)
-                self.tracks.append(track)
-                self.next_id += 1
+            self._create_tracks(detections, features, range(len(detections)))
             return self.tracks
         
         # Tính cost matrix
@@ -353,25 +633,98 @@ class DeepSortTracker:
         # Hungarian algorithm để match
         matched, unmatched_dets, unmatched_trks = self._associate(cost_matrix)
         
-        # Update matched tracks
-        for m in matched:
-            det_idx, trk_idx = m
-            self.tracks[trk_idx].update(detections[det_idx], features[det_idx])
+        # Update Kalman cho tất cả matched tracks trong 1 lần gọi
+        if matched:
+            det_indices = np.array([det_idx for det_idx, _ in matched], dtype=np.intp)
+            kf_indices = [self.tracks[trk_idx].kf_index for _, trk_idx in matched]
+            self.kalman.update(kf_indices, detections.xyxy[det_indices])
+            states = self.kalman.get_states(kf_indices)
+            confidences = detections.confidence[det_indices].tolist()
+            class_ids = detections.class_id[det_indices].tolist()
+            for (det_idx, trk_idx), state, confidence, class_id in zip(matched, states, confidences, class_ids):
+                self.tracks[trk_idx].mark_updated(
+                    features[det_idx], state, detections.names[class_id], confidence, class_id
+                )
         
         # Create new tracks cho unmatched detections
-        for i in unmatched_dets:
-            track = Track(detections[i], features[i], self.next_id)
-            self.tracks.append(track)
-            self.next_id += 1
+        self._create_tracks(detections, features, unmatched_dets)
         
         # Delete old tracks
         self.tracks = [
             t for t in self.tracks
             if t.time_since_update < self.max_age and (t.is_confirmed or t.time_since_update < 1)
         ]
+        self._compact_kalman()
         
         return self.tracks
     
+    def predict_only(self, center_shifts=None):
+        """
+        Chỉ advance Kalman prediction cho tất cả tracks (frame không chạy detection)
+        
+        Không tính là frame miss: time_since_update/hit_streak/age giữ nguyên,
+        max_age và min_hits vẫn tính theo số frame có detection
+        
+        Parameters:
+        - center_shifts: numpy array (N, 2) độ dịch tâm box đo bằng optical flow
+          theo thứ tự self.tracks (NaN = không đo được, giữ prediction của Kalman)
+        
+        Returns:
+        - tracks: list of Track objects với state đã predict
+        """
+        if not self.tracks:
+            return self.tracks
+        kf_indices = np.array([t.kf_index for t in self.tracks], dtype=np.intp)
+        previous_centers = self.kalman.x[kf_indices, :2]
+        self.kalman.predict(kf_indices)
+        
+        if center_shifts is not None:
+            shifts = np.asarray(center_shifts, dtype=np.float64).reshape(-1, 2)
+            valid = np.isfinite(shifts).all(axis=1)
+            if valid.any():
+                indices = kf_indices[valid]
+                targets = previous_centers[valid] + shifts[valid]
+                self.kalman.translate(indices, targets - self.kalman.x[indices, :2])
+        
+        return self.tracks
+    
+    def _create_tracks(self, detections, features, indices):
+        """
+        Tạo tracks mới cho các detections theo indices (Kalman state thêm vào bank trong 1 lần gọi)
+        """
+        indices = np.asarray(list(indices), dtype=np.intp)
+        if len(indices) == 0:
+            return
+        kf_indices = self.kalman.add(detections.xyxy[indices])
+        confidences = detections.confidence[indices].tolist()
+        class_ids = detections.class_id[indices].tolist()
+        for i, kf_index, confidence, class_id in zip(indices, kf_indices, confidences, class_ids):
+            feature = features[i]
+            self.tracks.append(Track.restore(
+                self.kalman, int(kf_index), self.next_id, feature / (np.linalg.norm(feature) + 1e-6),
+                detections.names[class_id], confidence, class_id,
+                time_since_update=0, hit_streak=0, age=0, is_confirmed=False, history=()
+            ))
+            self.next_id += 1
+    
+    def _predict_tracks(self):
+        """
+        Predict Kalman state của tất cả tracks bằng 1 lần gọi vectorized
+        """
+        if not self.tracks:
+            return
+        self.kalman.predict([t.kf_index for t in self.tracks])
+        for track in self.tracks:
+            track.mark_predicted()
+    
+    def _compact_kalman(self):
+        """
+        Bỏ Kalman state của các tracks đã bị xóa, giữ row theo thứ tự self.tracks
+        """
+        self.kalman.keep([t.kf_index for t in self.tracks])
+        for i, track in enumerate(self.tracks):
+            track.kf_index = i
+    
     def _compute_cost_matrix(self, detections, features):
         """
         Compute cost matrix cho association
@@ -380,20 +733,16 @@ class DeepSortTracker:
         if len(self.tracks) == 0 or len(detections) == 0:
             return np.empty((0, 0))
         
-        # IoU matrix
-        iou_matrix = np.zeros((len(detections), len(self.tracks)), dtype=np.float32)
-        for i, det in enumerate(detections):
-            for j, track in enumerate(self.tracks):
-                iou = self._compute_iou(det['bbox'], track.get_state())
-                iou_matrix[i, j] = iou
-        
-        # Feature distance matrix (cosine distance)
-        feature_matrix = np.zeros((len(detections), len(self.tracks)), dtype=np.float32)
-        for i, feat in enumerate(features):
-            for j, track in enumerate(self.tracks):
-                # Cosine distance = 1 - cosine similarity
-                cosine_sim = np.dot(feat, track.feature)
-                feature_matrix[i, j] = 1 - cosine_sim
+        # Stack boxes/features 1 lần mỗi frame thay vì gọi get_state() cho từng cặp
+        det_boxes = Detections.coerce(detections).xyxy
+        track_boxes = self.kalman.get_states([track.kf_index for track in self.tracks])
+        track_features = np.stack([track.feature for track in self.tracks]).astype(np.float32)
+        
+        # IoU matrix (broadcasting)
+        iou_matrix = iou_batch(det_boxes, track_boxes)
+        
+        # Feature distance matrix (cosine distance = 1 - cosine similarity)
+        feature_matrix = 1 - np.asarray(features, dtype=np.float32) @ track_features.T
         
         # Combine costs (weighted)
         iou_cost = 1 - iou_matrix  # Convert IoU to cost (higher IoU = lower cost)
@@ -480,5 +829,107 @@ class DeepSortTracker:
         """
         self.tracks = []
         self.next_id = 1
+        self.kalman = BatchKalmanFilter()
         self.feature_cache = {}
+    
+    # Binary format: header (magic, version, độ dài meta) + meta JSON + arrays nén zlib
+    SERIAL_MAGIC = b"DSRT"
+    SERIAL_VERSION = 1
+    _SERIAL_HEADER = struct.Struct("<4sHI")
+    # Các cột int64 của mỗi track trong payload
+    _TRACK_INT_FIELDS = ("track_id", "class_id", "time_since_update", "hit_streak", "age", "is_confirmed")
+    
+    def to_bytes(self):
+        """
+        Serialize toàn bộ state (tracks, Kalman state, features, next_id) thành bytes
+        Không dùng pickle: chỉ gồm JSON (tham số + class names) và numpy arrays little-endian
+        
+        Returns:
+        - data: bytes, load lại bằng DeepSortTracker.from_bytes
+        """
+        tracks = self.tracks
+        kf_indices = [t.kf_index for t in tracks]
+        meta = {
+            "max_age": self.max_age,
+            "min_hits": self.min_hits,
+            "iou_threshold": self.iou_threshold,
+            "feature_dim": self.feature_extractor.feature_dim,
+            "next_id": self.next_id,
+            "num_tracks": len(tracks),
+            "class_names": [t.class_name for t in tracks],
+            "history_lengths": [len(t.history) for t in tracks]
+        }
+        
+        ints = np.array(
+            [[int(getattr(t, field)) for field in self._TRACK_INT_FIELDS] for t in tracks],
+            dtype='<i8'
+        ).reshape(len(tracks), len(self._TRACK_INT_FIELDS))
+        confidences = np.array([t.confidence for t in tracks], dtype='<f8')
+        features = np.array([t.feature for t in tracks], dtype='<f4').reshape(len(tracks), meta["feature_dim"])
+        history = np.array([h for t in tracks for h in t.history], dtype='<f4').reshape(-1, 4)
+        x = self.kalman.x[kf_indices].astype('<f8')
+        P = self.kalman.P[kf_indices].astype('<f8')
+        
+        payload = b"".join(a.tobytes() for a in (ints, confidences, features, x, P, history))
+        meta_bytes = json.dumps(meta, ensure_ascii=False).encode("utf-8")
+        header = self._SERIAL_HEADER.pack(self.SERIAL_MAGIC, self.SERIAL_VERSION, len(meta_bytes))
+        return header + meta_bytes + zlib.compress(payload, 1)
+    
+    @classmethod
+    def from_bytes(cls, data):
+        """
+        Load tracker từ bytes tạo bởi to_bytes
+        
+        Raises:
+        - ValueError: dữ liệu không đúng format/version
+        """
+        header_size = cls._SERIAL_HEADER.size
+        if len(data) < header_size:
+            raise ValueError("Tracker state không hợp lệ")
+        magic, version, meta_len = cls._SERIAL_HEADER.unpack_from(data)
+        if magic != cls.SERIAL_MAGIC or version != cls.SERIAL_VERSION:
+            raise ValueError(f"Tracker state không hỗ trợ (magic={magic!r}, version={version})")
+        
+        meta = json.loads(data[header_size:header_size + meta_len].decode("utf-8"))
+        payload = zlib.decompress(data[header_size + meta_len:])
+        
+        n = meta["num_tracks"]
+        feature_dim = meta["feature_dim"]
+        total_history = sum(meta["history_lengths"])
+        shapes = [
+            ('<i8', (n, len(cls._TRACK_INT_FIELDS))),
+            ('<f8', (n,)),
+            ('<f4', (n, feature_dim)),
+            ('<f8', (n, 7)),
+            ('<f8', (n, 7, 7)),
+            ('<f4', (total_history, 4))
+        ]
+        arrays, offset = [], 0
+        for dtype, shape in shapes:
+            count = int(np.prod(shape))
+            arrays.append(np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(shape))
+            offset += count * np.dtype(dtype).itemsize
+        ints, confidences, features, x, P, history = arrays
+        
+        tracker = cls(
+            max_age=meta["max_age"],
+            min_hits=meta["min_hits"],
+            iou_threshold=meta["iou_threshold"],
+            feature_dim=feature_dim
+        )
+        tracker.next_id = meta["next_id"]
+        tracker.kalman = BatchKalmanFilter.from_arrays(x, P)
+        
+        history_start = 0
+        for i in range(n):
+            track_id, class_id, time_since_update, hit_streak, age, is_confirmed = (int(v) for v in ints[i])
+            history_end = history_start + meta["history_lengths"][i]
+            tracker.tracks.append(Track.restore(
+                tracker.kalman, i, track_id, features[i].copy(), meta["class_names"][i],
+                float(confidences[i]), class_id, time_since_update, hit_streak, age,
+                bool(is_confirmed), [h.copy() for h in history[history_start:history_end]]
+            ))
+            history_start = history_end
+        
+        return tracker
 
@@ -0,0 +1,131 @@
+"""
+Detections - Kết quả detection dạng struct-of-arrays dùng chung cho API và tracking
+Boxes được lấy từ YOLO result bằng 1 lần copy tensor -> numpy, lọc hợp lệ
+vectorized và đi nguyên dạng mảng qua DeepSORT; chỉ chuyển sang list dict
+(JSON) ở bước trả response
+"""
+
+import numpy as np
+
+
+class Detections:
+    """
+    Tập detections của 1 ảnh
+
+    Attributes:
+    - xyxy: numpy array (N, 4) float32 [x1, y1, x2, y2]
+    - confidence: numpy array (N,) float32
+    - class_id: numpy array (N,) int32
+    - index: numpy array (N,) int32 - vị trí của box trong output gốc của model (trước khi lọc)
+    - names: dict class_id -> tên class
+    """
+
+    __slots__ = ("xyxy", "confidence", "class_id", "index", "names")
+
+    def __init__(self, xyxy, confidence, class_id, names=None, index=None):
+        self.xyxy = np.asarray(xyxy, dtype=np.float32).reshape(-1, 4)
+        self.confidence = np.asarray(confidence, dtype=np.float32).reshape(-1)
+        self.class_id = np.asarray(class_id, dtype=np.int32).reshape(-1)
+        self.names = names if names is not None else {}
+        if index is None:
+            index = np.arange(len(self.confidence))
+        self.index = np.asarray(index, dtype=np.int32).reshape(-1)
+
+    @classmethod
+    def empty(cls, names=None):
+        return cls(np.empty((0, 4)), np.empty(0), np.empty(0), names)
+
+    @classmethod
+    def from_result(cls, result, names):
+        """
+        Tạo từ YOLO result: 1 lần copy boxes.data (N, 6: x1 y1 x2 y2 conf cls) về host,
+        bỏ box có class không hợp lệ hoặc tọa độ suy biến
+
+        Parameters:
+        - result: YOLO result (None = không có detection)
+        - names: dict class_id -> tên class của model
+        """
+        boxes = getattr(result, 'boxes', None)
+        if boxes is None or len(boxes) == 0:
+            return cls.empty(names)
+
+        data = np.asarray(boxes.data.cpu().numpy(), dtype=np.float32).reshape(len(boxes), -1)
+        # Khi có track id, data có 7 cột (id trước conf) -> conf/cls luôn là 2 cột cuối
+        detections = cls(data[:, :4], data[:, -2], data[:, -1].astype(np.int32), names)
+        return detections[detections.valid_mask()]
+
+    @classmethod
+    def from_dicts(cls, detections):
+        """
+        Tạo từ list dict (bbox, class, confidence, class_id) - format cũ của DeepSortTracker.update
+        """
+        if not detections:
+            return cls.empty()
+        class_ids = [det.get('class_id', 0) for det in detections]
+        names = {class_id: det['class'] for class_id, det in zip(class_ids, detections)}
+        return cls(
+            [det['bbox'] for det in detections],
+            [det['confidence'] for det in detections],
+            class_ids,
+            names
+        )
+
+    @classmethod
+    def coerce(cls, detections):
+        """Detections giữ nguyên, list dict được chuyển đổi"""
+        return detections if isinstance(detections, cls) else cls.from_dicts(detections)
+
+    def __len__(self):
+        return len(self.confidence)
+
+    def __getitem__(self, index):
+        """Lọc theo mask bool hoặc mảng index (giữ dạng Detections)"""
+        return Detections(self.xyxy[index], self.confidence[index], self.class_id[index], self.names, self.index[index])
+
+    def rescale(self, scale):
+        """
+        Đổi tọa độ về ảnh gốc khi ảnh được decode ở kích thước giảm
+
+        Parameters:
+        - scale: (sx, sy) từ decode_image_reduced, None = giữ nguyên
+        """
+        if scale is None or tuple(scale) == (1.0, 1.0):
+            return self
+        sx, sy = scale
+        factors = np.array([sx, sy, sx, sy], dtype=np.float32)
+        return Detections(self.xyxy * factors, self.confidence, self.class_id, self.names, self.index)
+
+    def valid_mask(self):
+        """Box có class hợp lệ, tọa độ hữu hạn và x2 > x1, y2 > y1"""
+        known = np.isin(self.class_id, np.fromiter(self.names, dtype=np.int64, count=len(self.names)))
+        finite = np.isfinite(self.xyxy).all(axis=1) & np.isfinite(self.confidence)
+        return known & finite & (self.xyxy[:, 2] > self.xyxy[:, 0]) & (self.xyxy[:, 3] > self.xyxy[:, 1])
+
+    def class_name(self, i):
+        return self.names[int(self.class_id[i])]
+
+    @property
+    def class_names(self):
+        return [self.names[class_id] for class_id in self.class_id.tolist()]
+
+    def to_list(self):
+        """
+        Chuyển sang list dict cho JSON response
+        (id = vị trí box trong output của model, đánh số từ 1; box bị lọc để lại khoảng trống như trước)
+        """
+        xyxy = self.xyxy.astype(np.float64).tolist()
+        confidences = self.confidence.astype(np.float64).round(4).tolist()
+        return [
+            {
+                "id": i + 1,
+                "class": self.names[class_id],
+                "class_id": class_id,
+                "confidence": confidence,
+                "bbox": box,
+                "width": box[2] - box[0],
+                "height": box[3] - box[1]
+            }
+            for i, box, confidence, class_id in zip(
+                self.index.tolist(), xyxy, confidences, self.class_id.tolist()
+            )
+        ]
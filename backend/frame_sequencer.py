@@ -0,0 +1,183 @@
+"""
+FrameSequencer - Xử lý tuần tự các frame của từng tracking session
+Mỗi session chỉ có 1 frame được xử lý tại một thời điểm (không race trên state
+DeepSORT) và theo thứ tự sequence number; khi frame đang xử lý chưa xong, chỉ
+frame mới nhất được giữ chờ ("latest wins"), các frame cũ hơn bị drop
+
+Reset session cũng đi qua hàng đợi (FrameSequencer.reset): chạy sau frame đang xử lý,
+frame đang chờ bị drop, nên không frame nào ghi đè state đã reset
+"""
+
+import asyncio
+from collections import OrderedDict
+
+_RESET_SEQ = float("inf")  # seq của thao tác reset đang chờ (frame tới trong lúc đó bị drop)
+
+
+class FrameDropped(Exception):
+    """Frame bị bỏ vì đã có frame mới hơn của cùng session"""
+
+    def __init__(self, seq, reason):
+        super().__init__(f"Frame {seq} dropped ({reason})")
+        self.seq = seq
+        self.reason = reason
+
+
+class _SessionFrames:
+    """Trạng thái hàng đợi frame của 1 session"""
+
+    __slots__ = ("busy", "pending", "last_seq", "last_received", "received", "processed", "dropped")
+
+    def __init__(self):
+        self.busy = False
+        self.pending = None  # (seq, future) của frame mới nhất đang chờ
+        self.last_seq = -1  # seq của frame được xử lý gần nhất
+        self.last_received = -1
+        self.received = 0
+        self.processed = 0
+        self.dropped = 0
+
+    def stats(self):
+        return {
+            "frames_received": self.received,
+            "frames_processed": self.processed,
+            "frames_dropped": self.dropped,
+            "drop_rate": round(self.dropped / self.received, 4) if self.received else 0
+        }
+
+
+class FrameSequencer:
+    """
+    Hàng đợi 1 consumer cho mỗi session (dùng trên 1 event loop)
+    """
+
+    def __init__(self, max_sessions=1000):
+        """
+        Parameters:
+        - max_sessions: số session tối đa giữ trạng thái (session rảnh ít dùng nhất bị bỏ trước)
+        """
+        self.max_sessions = max(1, int(max_sessions))
+        self._sessions = OrderedDict()
+
+    def _get(self, session_id):
+        frames = self._sessions.get(session_id)
+        if frames is None:
+            frames = self._sessions[session_id] = _SessionFrames()
+            self._evict_idle()
+        self._sessions.move_to_end(session_id)
+        return frames
+
+    def _evict_idle(self):
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions:
+                break
+            frames = self._sessions[session_id]
+            if not frames.busy and frames.pending is None:
+                del self._sessions[session_id]
+
+    async def run(self, session_id, seq, handler):
+        """
+        Xử lý 1 frame của session khi tới lượt
+
+        Parameters:
+        - session_id: tracking session
+        - seq: sequence number của frame (None = theo thứ tự đến)
+        - handler: coroutine function không tham số xử lý frame
+
+        Returns:
+        - (seq, kết quả của handler)
+
+        Raises:
+        - FrameDropped: frame cũ hơn frame đã/đang chờ xử lý, hoặc bị frame mới hơn thay thế khi đang chờ
+        """
+        frames = self._get(session_id)
+        if seq is None:
+            seq = frames.last_received + 1
+        frames.received += 1
+        frames.last_received = max(frames.last_received, seq)
+
+        if seq <= frames.last_seq or (frames.pending is not None and seq <= frames.pending[0]):
+            frames.dropped += 1
+            raise FrameDropped(seq, "stale")
+
+        if frames.busy:
+            if frames.pending is not None:
+                # Frame đang chờ bị thay bằng frame mới hơn
+                frames.dropped += 1
+                frames.pending[1].set_exception(FrameDropped(frames.pending[0], "superseded"))
+            await self._wait_turn(frames, seq)
+        else:
+            frames.busy = True
+
+        frames.last_seq = seq
+        try:
+            return seq, await handler()
+        finally:
+            frames.processed += 1
+            self._release(frames)
+
+    async def reset(self, session_id, handler):
+        """
+        Reset session như 1 frame trong hàng đợi: chờ frame đang xử lý xong, drop frame
+        đang chờ (và frame tới trong lúc chờ), rồi chạy handler; sequence number và thống kê
+        frame đếm lại từ đầu (client bắt đầu lại từ seq 0 sau reset)
+
+        Parameters:
+        - handler: coroutine function không tham số reset state của session
+
+        Returns:
+        - kết quả của handler
+
+        Raises:
+        - FrameDropped: reset khác của cùng session tới sau và thay thế reset này
+        """
+        frames = self._get(session_id)
+        if frames.busy:
+            if frames.pending is not None:
+                if frames.pending[0] != _RESET_SEQ:
+                    frames.dropped += 1
+                frames.pending[1].set_exception(FrameDropped(frames.pending[0], "reset"))
+            await self._wait_turn(frames, _RESET_SEQ)
+        else:
+            frames.busy = True
+
+        try:
+            return await handler()
+        finally:
+            frames.last_seq = frames.last_received = -1
+            frames.received = frames.processed = frames.dropped = 0
+            self._release(frames)
+
+    async def _wait_turn(self, frames, seq):
+        """Giữ chỗ chờ (pending) tới khi thao tác đang xử lý của session xong"""
+        waiter = asyncio.get_running_loop().create_future()
+        frames.pending = (seq, waiter)
+        try:
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                # Đã tới lượt nhưng client hủy -> nhường cho frame tiếp theo
+                self._release(frames)
+            elif frames.pending is not None and frames.pending[1] is waiter:
+                frames.pending = None
+            raise
+
+    def _release(self, frames):
+        """Chuyển lượt cho frame đang chờ (giữ busy), hoặc đánh dấu session rảnh"""
+        if frames.pending is not None:
+            _, waiter = frames.pending
+            frames.pending = None
+            waiter.set_result(None)
+        else:
+            frames.busy = False
+
+    def stats(self, session_id):
+        """Thống kê frame của session (received/processed/dropped, drop_rate)"""
+        frames = self._sessions.get(session_id)
+        return frames.stats() if frames is not None else _SessionFrames().stats()
+
+    def forget(self, session_id):
+        """Bỏ trạng thái của session (khi session bị reset/xóa) nếu session đang rảnh"""
+        frames = self._sessions.get(session_id)
+        if frames is not None and not frames.busy and frames.pending is None:
+            del self._sessions[session_id]
@@ -9,55 +9,254 @@ import numpy as np
 from pathlib import Path
 from PIL import Image
 from collections import Counter
+import hashlib
 import os
+import threading
+from io import BytesIO
+
+from detections import Detections
+
+
+def decode_image_bytes(data):
+    """
+    Decode bytes ảnh (JPEG/PNG/...) trực tiếp thành numpy array, không qua file tạm
+
+    Parameters:
+    - data: bytes của file ảnh
+
+    Returns:
+    - img_bgr: numpy array (H, W, 3) BGR, None nếu không decode được
+    """
+    if not data:
+        return None
+    buffer = np.frombuffer(data, dtype=np.uint8)
+    img_bgr = cv2.imdecode(buffer, cv2.IMREAD_COLOR)
+    return img_bgr
+
+
+# libjpeg decode được JPEG ở 1/2, 1/4, 1/8 kích thước ngay trong bước IDCT (không decode full rồi resize)
+REDUCED_DECODE_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+)
+
+
+def decode_image_reduced(data, min_side=None):
+    """
+    Decode bytes ảnh; JPEG lớn được decode ở kích thước giảm 2/4/8 lần sao cho cạnh dài
+    vẫn >= min_side (model letterbox về imgsz nên inference không mất thông tin)
+
+    Parameters:
+    - data: bytes của file ảnh
+    - min_side: cạnh dài tối thiểu của ảnh decode (thường là imgsz), None = decode full
+
+    Returns:
+    - img_bgr: numpy array BGR, None nếu không decode được
+    - scale: (sx, sy) đổi tọa độ trên ảnh decode về ảnh gốc ((1.0, 1.0) khi decode full)
+    """
+    width = height = 0
+    factor = 1
+    if data and min_side and data[:2] == b"\xff\xd8":
+        try:
+            # PIL chỉ đọc header để lấy kích thước
+            width, height = Image.open(BytesIO(data)).size
+        except Exception:
+            width = height = 0
+        factor = next((f for f, _ in REDUCED_DECODE_FLAGS if max(width, height) / f >= min_side), 1)
+
+    if factor == 1:
+        return decode_image_bytes(data), (1.0, 1.0)
+
+    img_bgr = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), dict(REDUCED_DECODE_FLAGS)[factor])
+    if img_bgr is None:
+        return None, (1.0, 1.0)
+    h, w = img_bgr.shape[:2]
+    # Ảnh có thể đã được xoay theo EXIF orientation -> so chiều với ảnh đã decode
+    if (w >= h) != (width >= height):
+        width, height = height, width
+    return img_bgr, (width / w, height / h)
+
+
+def load_image_scaled(image, min_side=None):
+    """
+    Giống load_image nhưng JPEG lớn (bytes hoặc file) được decode ở kích thước giảm
+
+    Returns:
+    - img_bgr, scale: xem decode_image_reduced
+    """
+    if isinstance(image, np.ndarray) or not min_side:
+        return load_image(image), (1.0, 1.0)
+    if not isinstance(image, (bytes, bytearray, memoryview)):
+        if not Path(image).exists():
+            return None, (1.0, 1.0)
+        image = Path(image).read_bytes()
+    return decode_image_reduced(bytes(image), min_side)
+
+
+def load_image(image):
+    """
+    Chuẩn hóa input ảnh thành numpy array BGR
+
+    Parameters:
+    - image: đường dẫn ảnh, bytes hoặc numpy array (H, W, 3) BGR
+
+    Returns:
+    - img_bgr: numpy array BGR, None nếu không đọc được
+    """
+    if isinstance(image, np.ndarray):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        return decode_image_bytes(bytes(image))
+    if not Path(image).exists():
+        return None
+    return cv2.imread(str(image))
+
+
+# Backend inference: torch = chạy weights .pt bằng PyTorch eager, các backend khác dùng
+# model export từ ultralytics (cache cạnh file weights). Mọi backend đi qua cùng predictor
+# của ultralytics (letterbox + NMS) nên boxes giống nhau trong sai số số học
+INFERENCE_BACKENDS = {
+    "torch": None,
+    "onnx": {"format": "onnx", "suffix": ".onnx", "args": {"dynamic": True}},
+    "torchscript": {"format": "torchscript", "suffix": ".torchscript", "args": {}},
+    # INT8 (static quantization) - tạo bằng code_train_model/quantize_model.py, không export tự động
+    "onnx-int8": {"format": None, "suffix": "_int8.onnx", "args": {}},
+}
+
+
+def exported_model_path(model_path, backend, imgsz=640):
+    """
+    Đường dẫn file export (cache) của model cho backend, vd. best.pt -> best_640.onnx
+
+    Returns:
+    - path: Path, None với backend torch (dùng trực tiếp file .pt)
+    """
+    if backend not in INFERENCE_BACKENDS:
+        raise ValueError(f"Backend không hỗ trợ: {backend} (chọn: {', '.join(INFERENCE_BACKENDS)})")
+    spec = INFERENCE_BACKENDS[backend]
+    if spec is None:
+        return None
+    path = Path(model_path)
+    return path.with_name(f"{path.stem}_{imgsz}{spec['suffix']}")
+
+
+def export_model(model_path, backend, imgsz=640):
+    """
+    Export model sang format của backend (chỉ 1 lần, dùng lại file cache nếu mới hơn weights)
+
+    Parameters:
+    - model_path: file weights .pt
+    - backend: tên trong INFERENCE_BACKENDS
+    - imgsz: kích thước input cố định của model export
+
+    Returns:
+    - path: file model để load bằng YOLO (file .pt gốc với backend torch)
+    """
+    cached = exported_model_path(model_path, backend, imgsz)
+    if cached is None:
+        return Path(model_path)
+    if cached.exists() and cached.stat().st_mtime >= Path(model_path).stat().st_mtime:
+        return cached
+
+    spec = INFERENCE_BACKENDS[backend]
+    if spec["format"] is None:
+        raise FileNotFoundError(
+            f"Model {backend} chưa có hoặc cũ hơn weights: {cached} "
+            f"(tạo bằng code_train_model/quantize_model.py)"
+        )
+    print(f"Exporting {model_path} -> {cached} ({backend}, imgsz={imgsz})")
+    exported = YOLO(str(model_path)).export(
+        format=spec["format"], imgsz=imgsz, device="cpu", half=False, **spec["args"]
+    )
+    # ultralytics ghi file cạnh weights với tên mặc định (best.onnx) -> đổi sang tên cache
+    os.replace(exported, cached)
+    return cached
+
+
+IMAGE_EXTENSIONS = ['.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff']
+
+
+def list_images(folder_path):
+    """
+    Danh sách file ảnh trong folder (sắp xếp theo tên)
+
+    Returns:
+    - images: list Path, rỗng nếu folder không tồn tại
+    """
+    folder = Path(folder_path)
+    if not folder.is_dir():
+        return []
+    return sorted(f for f in folder.iterdir()
+                  if f.is_file() and f.suffix.lower() in IMAGE_EXTENSIONS)
 
 
 class ObjectDetector:
-    def __init__(self, model_path, conf_threshold=0.25, iou_threshold=0.45):
+    def __init__(self, model_path, conf_threshold=0.25, iou_threshold=0.45, backend="torch", imgsz=640):
         """
         model_path: đường dẫn tới model đã train
         conf_threshold: ngưỡng confidence (0-1)
         iou_threshold: ngưỡng IoU cho NMS (Non-Maximum Suppression)
+        backend: torch | onnx | torchscript | onnx-int8 (xem INFERENCE_BACKENDS)
+        imgsz: kích thước input của model (cố định cho backend export)
         """
         self.model_path = model_path
         self.conf_threshold = conf_threshold
         self.iou_threshold = iou_threshold
+        self.backend = backend
+        self.imgsz = imgsz
 
         # Kiểm tra model tồn tại
         if not Path(model_path).exists():
             raise FileNotFoundError(f"Model không tồn tại: {model_path}")
 
-        # Load model
-        self.model = YOLO(model_path)
+        # Load model (export 1 lần cho backend khác torch)
+        self.weights_path = export_model(model_path, backend, imgsz)
+        self.model = YOLO(str(self.weights_path), task="detect")
+
+        # ultralytics dùng chung 1 predictor và đổi predictor.args (conf/iou/imgsz) ở mỗi lần predict
+        # -> mọi lần gọi model.predict (scheduler, batch engine, jobs, video pipeline) phải đi qua lock này
+        self.predict_lock = threading.Lock()
+
+        # Version của weights (đổi khi best.pt hoặc file đã export/quantize cho backend bị thay,
+        # vd. quantize_model.py publish lại model INT8) - dùng để invalidate cache kết quả
+        artifacts = []
+        for path in dict.fromkeys([Path(model_path).resolve(), Path(self.weights_path).resolve()]):
+            stat = path.stat()
+            artifacts.append(f"{path}:{stat.st_size}:{stat.st_mtime_ns}")
+        self.model_version = hashlib.sha1(
+            f"{':'.join(artifacts)}:{backend}:{imgsz}".encode()
+        ).hexdigest()[:12]
         
         # Lấy thông tin classes
         self.classes = self.model.names
 
-    def detect_image(self, image_path, save_path=None, show=False):
+    def detect_image(self, image, save_path=None, show=False, conf=None, iou=None, render=True):
         """
         Nhận diện đối tượng trong một ảnh
 
         Parameters:
-        - image_path: đường dẫn tới ảnh cần nhận diện
+        - image: đường dẫn ảnh, bytes hoặc numpy array (H, W, 3) BGR đã decode
         - save_path: đường dẫn lưu ảnh kết quả (None = không lưu)
         - show: hiển thị kết quả bằng matplotlib (True/False)
+        - conf, iou: thresholds cho lần gọi này (None = dùng mặc định của detector)
+        - render: vẽ bounding boxes (False = bỏ qua plot/convert, img_rgb là None)
 
         Returns:
         - result: kết quả detection từ YOLO
         - img_rgb: ảnh với bounding boxes (RGB format)
         """
-        # Kiểm tra file tồn tại
-        if not Path(image_path).exists():
+        # Đọc/decode ảnh (array được dùng trực tiếp, không qua disk)
+        img_bgr = load_image(image)
+        if img_bgr is None:
             return None, None
 
         # Chạy inference với error handling
         try:
-            results = self.model.predict(
-                source=image_path,
-                conf=self.conf_threshold,
-                iou=self.iou_threshold,
-                save=False,
-                verbose=False
+            results = self._predict(
+                img_bgr,
+                self.conf_threshold if conf is None else conf,
+                self.iou_threshold if iou is None else iou
             )
 
             # Kiểm tra kết quả
@@ -71,16 +270,12 @@ class ObjectDetector:
             if result is None:
                 return None, None
 
+            # Chỉ cần boxes: bỏ qua vẽ và convert màu
+            if not render and not save_path:
+                return result, None
+
             # Vẽ bounding boxes
-            try:
-                img_with_boxes = result.plot()
-            except Exception as e:
-                print(f"Error plotting result: {e}")
-                # Nếu không vẽ được, đọc ảnh gốc
-                img_bgr = cv2.imread(str(image_path))
-                if img_bgr is None:
-                    return None, None
-                img_with_boxes = img_bgr
+            img_with_boxes = self.plot_result(result, img_bgr)
 
             # Chuyển từ BGR sang RGB cho web
             img_rgb = cv2.cvtColor(img_with_boxes, cv2.COLOR_BGR2RGB)
@@ -96,83 +291,175 @@ class ObjectDetector:
             save_path.parent.mkdir(parents=True, exist_ok=True)
             cv2.imwrite(str(save_path), img_with_boxes)
 
-        return result, img_rgb
+        return result, img_rgb if render else None
+
+    @property
+    def dynamic_imgsz(self):
+        """Backend chạy được với imgsz khác lúc export (TorchScript cố định kích thước input)"""
+        return self.backend != "torchscript"
+
+    def predict_batch(self, images, conf, iou, imgsz=None):
+        """
+        Chạy 1 lần model.predict cho nhiều ảnh (dùng bởi InferenceScheduler)
+
+        Parameters:
+        - images: list numpy array (H, W, 3) BGR
+        - conf, iou: thresholds cho cả batch
+        - imgsz: kích thước input cho batch này (None = imgsz của detector)
+
+        Returns:
+        - results: list YOLO result, cùng thứ tự với images
+        """
+        if not images:
+            return []
+        return self._predict(list(images), conf, iou, imgsz)
+
+    def _predict(self, source, conf, iou, imgsz=None):
+        """model.predict giữ predict_lock (các lần gọi từ nhiều thread chạy lần lượt)"""
+        with self.predict_lock:
+            return self.model.predict(
+                source=source,
+                conf=conf,
+                iou=iou,
+                imgsz=self.imgsz if imgsz is None else imgsz,
+                save=False,
+                verbose=False
+            )
+
+    @staticmethod
+    def plot_result(result, img_bgr=None):
+        """
+        Vẽ bounding boxes lên ảnh (BGR), fallback về ảnh gốc nếu không vẽ được
+        """
+        try:
+            return result.plot()
+        except Exception as e:
+            print(f"Error plotting result: {e}")
+            return img_bgr if img_bgr is not None else result.orig_img
 
-    def detect_folder(self, folder_path, output_folder=None):
+    def detect_folder(self, folder_path, output_folder=None, batch_size=16, workers=None):
         """
         Nhận diện tất cả ảnh trong một folder
 
         Parameters:
         - folder_path: folder chứa ảnh cần nhận diện
         - output_folder: folder lưu kết quả (None = không lưu)
+        - batch_size: số ảnh mỗi lần model.predict
+        - workers: số thread decode/post-process (None = theo số CPU)
 
         Returns:
         - results_summary: danh sách kết quả cho mỗi ảnh
         """
-        folder = Path(folder_path)
-        if not folder.exists():
+        results = self.iter_detect_folder(folder_path, output_folder, batch_size, workers)
+        if results is None:
             return None
+        return list(results)
 
-        # Tạo output folder nếu cần
-        if output_folder:
-            output = Path(output_folder)
-            output.mkdir(parents=True, exist_ok=True)
+    def iter_detect_folder(self, folder_path, output_folder=None, batch_size=16, workers=None,
+                           conf=None, iou=None, skip=None, include_errors=False):
+        """
+        Giống detect_folder nhưng trả về generator, kết quả có ngay khi mỗi batch xong
+
+        Parameters:
+        - conf, iou: thresholds (None = dùng mặc định của detector)
+        - skip: tên các ảnh bỏ qua (vd. đã xử lý trước khi resume job)
+        - include_errors: True = yield cả ảnh lỗi dạng {'image', 'error'}
 
-        # Lấy danh sách ảnh
-        image_extensions = ['.jpg', '.jpeg', '.png', '.bmp', '.webp', '.tiff']
-        images = [f for f in folder.iterdir()
-                 if f.is_file() and f.suffix.lower() in image_extensions]
+        Returns:
+        - generator các dict kết quả cho mỗi ảnh, None nếu folder không tồn tại hoặc không có ảnh
+        """
+        from batch_engine import BatchEngine
 
+        images = list_images(folder_path)
         if not images:
             return None
+        if skip:
+            images = [img_path for img_path in images if img_path.name not in skip]
 
-        results_summary = []
-
-        for img_path in images:
-            # Nhận diện
-            save_path = output / img_path.name if output_folder else None
-            result, _ = self.detect_image(img_path, save_path=save_path, show=False)
-
-            if result is not None:
-                # Lưu thống kê
-                num_detections = len(result.boxes)
-                detected_classes = [self.classes[int(box.cls[0])] for box in result.boxes]
-                confidences = [float(box.conf[0]) for box in result.boxes]
-
-                results_summary.append({
-                    'image': img_path.name,
-                    'num_detections': num_detections,
-                    'classes': detected_classes,
-                    'confidences': confidences
-                })
-
-        return results_summary
+        # Tạo output folder nếu cần
+        output = None
+        if output_folder:
+            output = Path(output_folder)
+            output.mkdir(parents=True, exist_ok=True)
 
-    def detect_with_custom_threshold(self, image_path, conf_threshold):
+        def summarize(item):
+            # Lưu ảnh đã vẽ boxes nếu cần (chạy song song trong thread pool)
+            if output is not None:
+                cv2.imwrite(str(output / item.name), self.plot_result(item.result, item.image))
+
+            detections = Detections.from_result(item.result, self.classes)
+            return {
+                'image': item.name,
+                'num_detections': len(detections),
+                'classes': detections.class_names,
+                'confidences': detections.confidence.astype(np.float64).tolist(),
+                'boxes': detections.xyxy.astype(np.float64).round(2).tolist()
+            }
+
+        engine = BatchEngine(self, batch_size=batch_size, workers=workers)
+        sources = ((img_path.name, img_path) for img_path in images)
+
+        def iter_results():
+            for item in engine.run(sources, conf, iou, postprocess=summarize):
+                if item.output is not None:
+                    yield item.output
+                elif include_errors:
+                    yield {'image': item.name, 'error': item.error}
+
+        return iter_results()
+
+    def detect_with_custom_threshold(self, image, conf_threshold):
         """
         Nhận diện với confidence threshold tùy chỉnh
+        image: đường dẫn ảnh hoặc numpy array BGR
         """
-        old_threshold = self.conf_threshold
-        self.conf_threshold = conf_threshold
-        result, img = self.detect_image(image_path, show=False)
-        self.conf_threshold = old_threshold
-        return result, img
+        return self.detect_image(image, show=False, conf=conf_threshold)
 
-    def compare_thresholds(self, image_path, thresholds=[0.1, 0.25, 0.5, 0.75]):
+    def compare_thresholds(self, image, thresholds=[0.1, 0.25, 0.5, 0.75]):
         """
         So sánh kết quả với các confidence threshold khác nhau
+        image: đường dẫn ảnh hoặc numpy array BGR
+
+        Chỉ chạy 1 lần predict ở threshold thấp nhất rồi lọc boxes theo confidence
+        cho từng threshold cao hơn (không plot). NMS giữ box score cao hơn nên
+        kết quả giống với chạy predict riêng cho từng threshold
         """
+        # Decode 1 lần, dùng lại cho mọi threshold
+        image = load_image(image)
+        if image is None or not thresholds:
+            return {}
+
+        try:
+            results = self._predict(image, min(thresholds), self.iou_threshold)
+        except Exception as e:
+            print(f"Error in compare_thresholds: {e}")
+            return {}
+
+        if not results:
+            return {}
+        return self.summarize_thresholds(results[0], thresholds)
+
+    def summarize_thresholds(self, result, thresholds):
+        """
+        Số boxes và classes theo từng confidence threshold từ 1 result đã predict
+        ở threshold thấp nhất (dùng chung cho compare_thresholds và API qua scheduler)
+
+        Returns:
+        - dict threshold -> {'count', 'classes'}, rỗng nếu result không có boxes
+        """
+        if result is None or result.boxes is None:
+            return {}
+
+        detections = Detections.from_result(result, self.classes)
+
         results = {}
 
         for threshold in thresholds:
-            result, _ = self.detect_with_custom_threshold(image_path, threshold)
-
-            if result is not None:
-                num_detections = len(result.boxes)
-                results[threshold] = {
-                    'count': num_detections,
-                    'classes': [self.classes[int(box.cls[0])] for box in result.boxes]
-                }
+            kept = detections[detections.confidence >= threshold]
+            results[threshold] = {
+                'count': len(kept),
+                'classes': kept.class_names
+            }
 
         return results
 
@@ -0,0 +1,331 @@
+"""
+JobManager - Job detection offline cho số lượng ảnh lớn
+Mỗi job chạy ObjectDetector.iter_detect_folder trên worker pool riêng (thread riêng,
+không chiếm event loop), ghi kết quả dần vào file NDJSON trên disk và lưu manifest
+để có thể theo dõi tiến độ, hủy và tiếp tục sau khi restart server
+
+Job chỉ tách khỏi request interactive về thread, không về model: nếu detector là
+detector dùng chung với API thì model.predict của job và của request chạy lần lượt
+qua ObjectDetector.predict_lock (batch lớn của job làm request chờ). Muốn tách hẳn
+thì truyền detector riêng (model instance + lock riêng), xem JOB_SEPARATE_MODEL trong app.py
+
+Layout trên disk:
+    <jobs_dir>/<job_id>/manifest.json   # trạng thái + tiến độ
+    <jobs_dir>/<job_id>/results.ndjson  # 1 dòng / ảnh
+    <jobs_dir>/<job_id>/inputs/         # ảnh upload (job dạng upload)
+"""
+
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+from batch_engine import RunningSummary
+from inference import list_images
+
+
+# Trạng thái job
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_COMPLETED = "completed"
+JOB_FAILED = "failed"
+JOB_CANCELLED = "cancelled"
+FINISHED_STATUSES = (JOB_COMPLETED, JOB_FAILED, JOB_CANCELLED)
+
+
+class JobManager:
+    """
+    Quản lý job detection offline
+    """
+
+    MANIFEST_NAME = "manifest.json"
+    RESULTS_NAME = "results.ndjson"
+    INPUTS_NAME = "inputs"
+
+    def __init__(self, detector, jobs_dir="jobs", max_workers=1, batch_size=16, folder_root=None):
+        """
+        Parameters:
+        - detector: ObjectDetector chạy job (dùng chung với API = predict xếp hàng chung lock)
+        - jobs_dir: thư mục lưu manifest, kết quả và ảnh upload của các job
+        - max_workers: số job chạy đồng thời
+        - batch_size: số ảnh mỗi lần model.predict
+        - folder_root: chỉ cho phép job folder nằm trong thư mục này (None = không cho phép job folder)
+        """
+        self.detector = detector
+        self.jobs_dir = Path(jobs_dir)
+        self.jobs_dir.mkdir(parents=True, exist_ok=True)
+        self.batch_size = batch_size
+        self.folder_root = Path(folder_root).resolve() if folder_root else None
+
+        self._executor = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix="detection-job")
+        self._lock = threading.Lock()
+        self._jobs = {}
+        self._cancel_events = {}
+        self._shutting_down = False
+
+    # ---- Manifest ----
+
+    def _job_dir(self, job_id):
+        return self.jobs_dir / job_id
+
+    def _write_manifest(self, job):
+        """Ghi manifest atomic (file tạm + rename) để không hỏng khi crash giữa chừng"""
+        path = self._job_dir(job["job_id"]) / self.MANIFEST_NAME
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(job, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+    def _update(self, job_id, **fields):
+        with self._lock:
+            job = self._jobs[job_id]
+            job.update(fields)
+            job["updated_at"] = time.time()
+            self._write_manifest(job)
+            return dict(job)
+
+    # ---- Public API ----
+
+    def resolve_folder(self, folder_path):
+        """
+        Kiểm tra folder của job nằm trong folder_root
+
+        Returns:
+        - folder: Path đã resolve
+
+        Raises:
+        - PermissionError: job folder bị tắt hoặc folder nằm ngoài folder_root
+        - FileNotFoundError: folder không tồn tại
+        """
+        if self.folder_root is None:
+            raise PermissionError("Job theo folder trên server chưa được bật (JOB_FOLDER_ROOT).")
+        folder = (self.folder_root / folder_path).resolve()
+        if folder != self.folder_root and self.folder_root not in folder.parents:
+            raise PermissionError("Folder nằm ngoài thư mục cho phép.")
+        if not folder.is_dir():
+            raise FileNotFoundError(f"Folder không tồn tại: {folder_path}")
+        return folder
+
+    def create_upload_job(self, uploads, conf, iou):
+        """
+        Tạo job từ các file upload
+
+        Parameters:
+        - uploads: list (filename, file object) - file được copy dần vào thư mục inputs của job
+        - conf, iou: thresholds
+
+        Returns:
+        - job: dict manifest
+        """
+        job_id = uuid.uuid4().hex
+        inputs = self._job_dir(job_id) / self.INPUTS_NAME
+        inputs.mkdir(parents=True)
+        for filename, fileobj in uploads:
+            with open(inputs / filename, "wb") as f:
+                shutil.copyfileobj(fileobj, f)
+        return self._create(job_id, {"type": "upload", "path": str(inputs)}, conf, iou)
+
+    def create_folder_job(self, folder_path, conf, iou):
+        """
+        Tạo job cho 1 folder trên server (đã kiểm tra bằng resolve_folder)
+        """
+        folder = self.resolve_folder(folder_path)
+        job_id = uuid.uuid4().hex
+        self._job_dir(job_id).mkdir(parents=True)
+        return self._create(job_id, {"type": "folder", "path": str(folder)}, conf, iou)
+
+    def _create(self, job_id, source, conf, iou):
+        now = time.time()
+        job = {
+            "job_id": job_id,
+            "status": JOB_QUEUED,
+            "source": source,
+            "conf_threshold": conf,
+            "iou_threshold": iou,
+            "total_images": len(list_images(source["path"])),
+            "processed_images": 0,
+            "failed_images": 0,
+            "summary": RunningSummary().to_dict(),
+            "error": None,
+            "created_at": now,
+            "updated_at": now,
+            "started_at": None,
+            "finished_at": None
+        }
+        with self._lock:
+            self._jobs[job_id] = job
+            self._cancel_events[job_id] = threading.Event()
+            self._write_manifest(job)
+        self._executor.submit(self._run, job_id)
+        return dict(job)
+
+    def get(self, job_id):
+        """Manifest của job, None nếu không tồn tại"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def list(self):
+        """Tất cả jobs, mới nhất trước"""
+        with self._lock:
+            jobs = [dict(job) for job in self._jobs.values()]
+        return sorted(jobs, key=lambda job: job["created_at"], reverse=True)
+
+    def results_path(self, job_id):
+        return self._job_dir(job_id) / self.RESULTS_NAME
+
+    def cancel(self, job_id):
+        """
+        Hủy job (job đang chạy dừng sau ảnh hiện tại)
+
+        Returns:
+        - job: manifest sau khi hủy, None nếu không tồn tại
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            if job["status"] in FINISHED_STATUSES:
+                return dict(job)
+            self._cancel_events[job_id].set()
+        if job["status"] == JOB_QUEUED:
+            return self._update(job_id, status=JOB_CANCELLED, finished_at=time.time())
+        return self.get(job_id)
+
+    def resume(self):
+        """
+        Load manifest của các job trên disk, đưa lại các job chưa xong vào hàng đợi
+        (gọi khi khởi động server)
+
+        Returns:
+        - số job được tiếp tục
+        """
+        resumed = 0
+        for manifest in sorted(self.jobs_dir.glob(f"*/{self.MANIFEST_NAME}")):
+            try:
+                with open(manifest, encoding="utf-8") as f:
+                    job = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Skipping job manifest {manifest}: {e}")
+                continue
+
+            job_id = job["job_id"]
+            with self._lock:
+                if job_id in self._jobs:
+                    continue
+                self._jobs[job_id] = job
+                self._cancel_events[job_id] = threading.Event()
+
+            if job["status"] not in FINISHED_STATUSES:
+                self._update(job_id, status=JOB_QUEUED)
+                self._executor.submit(self._run, job_id)
+                resumed += 1
+        return resumed
+
+    def shutdown(self):
+        """Dừng các job đang chạy (sẽ được resume ở lần khởi động sau)"""
+        with self._lock:
+            job_ids = [job_id for job_id, job in self._jobs.items() if job["status"] not in FINISHED_STATUSES]
+            self._shutting_down = True
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        for job_id in job_ids:
+            self._cancel_events[job_id].set()
+
+    # ---- Worker ----
+
+    def _load_progress(self, job_id):
+        """
+        Đọc lại results.ndjson đã ghi (resume): bỏ dòng cuối bị ghi dở, tính lại tiến độ
+
+        Returns:
+        - done: set tên ảnh đã xử lý
+        - summary: RunningSummary
+        - failed: số ảnh lỗi
+        """
+        done, failed, summary = set(), 0, RunningSummary()
+        path = self.results_path(job_id)
+        if not path.exists():
+            return done, summary, failed
+
+        content = path.read_text(encoding="utf-8")
+        valid_lines = []
+        for line in content.splitlines(keepends=True):
+            # Dòng cuối bị ghi dở (crash) không có newline hoặc không parse được
+            if not line.endswith("\n"):
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+            valid_lines.append(line)
+            done.add(record["image"])
+            if "error" in record:
+                failed += 1
+            else:
+                summary.add(self._record_detections(record))
+
+        # Ghi lại file nếu có dòng hỏng để lần append tiếp theo bắt đầu từ dòng mới
+        if "".join(valid_lines) != content:
+            path.write_text("".join(valid_lines), encoding="utf-8")
+        return done, summary, failed
+
+    @staticmethod
+    def _record_detections(record):
+        return [{"class": c, "confidence": conf} for c, conf in zip(record["classes"], record["confidences"])]
+
+    def _run(self, job_id):
+        cancel_event = self._cancel_events[job_id]
+        job = self.get(job_id)
+        if job is None or job["status"] in FINISHED_STATUSES or cancel_event.is_set():
+            return
+
+        try:
+            done, summary, failed = self._load_progress(job_id)
+            self._update(
+                job_id, status=JOB_RUNNING, started_at=job["started_at"] or time.time(),
+                processed_images=len(done), failed_images=failed, summary=summary.to_dict()
+            )
+
+            records = self.detector.iter_detect_folder(
+                job["source"]["path"], batch_size=self.batch_size,
+                conf=job["conf_threshold"], iou=job["iou_threshold"],
+                skip=done, include_errors=True
+            )
+            processed = len(done)
+            last_saved = time.time()
+
+            with open(self.results_path(job_id), "a", encoding="utf-8") as results_file:
+                for record in records or []:
+                    if cancel_event.is_set():
+                        break
+                    results_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    processed += 1
+                    if "error" in record:
+                        failed += 1
+                    else:
+                        summary.add(self._record_detections(record))
+
+                    # Flush + cập nhật manifest định kỳ (không ghi manifest sau mỗi ảnh)
+                    if time.time() - last_saved >= 1.0:
+                        results_file.flush()
+                        self._update(job_id, processed_images=processed, failed_images=failed,
+                                     summary=summary.to_dict())
+                        last_saved = time.time()
+
+            progress = dict(processed_images=processed, failed_images=failed, summary=summary.to_dict())
+            if cancel_event.is_set():
+                if self._shutting_down:
+                    # Dừng do shutdown: giữ trạng thái running để resume ở lần khởi động sau
+                    self._update(job_id, **progress)
+                else:
+                    self._update(job_id, status=JOB_CANCELLED, finished_at=time.time(), **progress)
+                return
+
+            self._update(job_id, status=JOB_COMPLETED, finished_at=time.time(), **progress)
+        except Exception as e:
+            print(f"Error running job {job_id}: {e}")
+            self._update(job_id, status=JOB_FAILED, error=str(e), finished_at=time.time())
@@ -0,0 +1,73 @@
+"""
+ModelRegistry - Quản lý model dùng chung trong toàn process
+Mỗi file weights chỉ được load một lần, mọi session/endpoint dùng chung handle
+"""
+
+import threading
+from pathlib import Path
+
+from inference import ObjectDetector
+
+
+class ModelRegistry:
+    """
+    Registry cho các ObjectDetector đã load, key theo đường dẫn weights
+    """
+
+    def __init__(self):
+        self._detectors = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _key(model_path, backend="torch", imgsz=640):
+        key = str(Path(model_path).resolve())
+        # Giữ key cũ cho backend mặc định
+        return key if (backend, imgsz) == ("torch", 640) else f"{key}[{backend}@{imgsz}]"
+
+    def get(self, model_path, conf_threshold=0.25, iou_threshold=0.45, backend="torch", imgsz=640):
+        """
+        Lấy detector dùng chung cho model_path (load nếu chưa có)
+
+        Parameters:
+        - model_path: đường dẫn tới file weights
+        - conf_threshold, iou_threshold: ngưỡng mặc định khi load lần đầu
+        - backend, imgsz: backend inference (mỗi backend là 1 detector riêng)
+
+        Returns:
+        - detector: ObjectDetector dùng chung
+        """
+        key = self._key(model_path, backend, imgsz)
+        detector = self._detectors.get(key)
+        if detector is not None:
+            return detector
+
+        with self._lock:
+            # Kiểm tra lại sau khi lấy lock (tránh load 2 lần khi có nhiều request đồng thời)
+            detector = self._detectors.get(key)
+            if detector is None:
+                detector = ObjectDetector(
+                    model_path=model_path,
+                    conf_threshold=conf_threshold,
+                    iou_threshold=iou_threshold,
+                    backend=backend,
+                    imgsz=imgsz
+                )
+                self._detectors[key] = detector
+            return detector
+
+    def is_loaded(self, model_path, backend="torch", imgsz=640):
+        """Kiểm tra model đã được load chưa"""
+        return self._key(model_path, backend, imgsz) in self._detectors
+
+    def unload(self, model_path, backend="torch", imgsz=640):
+        """Bỏ model khỏi registry (các handle đang dùng vẫn hợp lệ tới khi được giải phóng)"""
+        with self._lock:
+            return self._detectors.pop(self._key(model_path, backend, imgsz), None) is not None
+
+    def loaded_models(self):
+        """Danh sách đường dẫn các model đang được load"""
+        return list(self._detectors.keys())
+
+
+# Registry dùng chung cho toàn process
+model_registry = ModelRegistry()
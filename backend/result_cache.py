@@ -0,0 +1,127 @@
+"""
+ResultCache - LRU cache kết quả detection theo nội dung ảnh
+Key: (sha256 của bytes ảnh, conf, iou, model version, render mode)
+Cache hit bỏ qua hoàn toàn decode, inference và encode ảnh
+"""
+
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+
+
+CacheKey = namedtuple("CacheKey", ["digest", "conf", "iou", "model_version", "render", "imgsz"])
+
+
+class ResultCache:
+    """
+    LRU cache giới hạn theo số entry và tổng dung lượng ước tính
+    Tự xóa toàn bộ khi model version thay đổi (model được swap)
+    """
+
+    def __init__(self, max_entries=1024, max_bytes=256 * 1024 * 1024):
+        """
+        Parameters:
+        - max_entries: số entry tối đa (0 = tắt cache)
+        - max_bytes: tổng dung lượng ước tính tối đa của các entry
+        """
+        self.max_entries = max(0, int(max_entries))
+        self.max_bytes = max(0, int(max_bytes))
+
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+        self._model_version = None
+        self.current_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    @property
+    def enabled(self):
+        return self.max_entries > 0 and self.max_bytes > 0
+
+    @staticmethod
+    def make_key(data, conf, iou, model_version, render, imgsz=None):
+        """Tạo cache key từ bytes ảnh gốc và tham số request"""
+        return CacheKey(
+            hashlib.sha256(data).hexdigest(),
+            round(float(conf), 6),
+            round(float(iou), 6),
+            model_version,
+            render,
+            imgsz
+        )
+
+    def _check_version(self, model_version):
+        """Xóa cache khi model version đổi (gọi trong lock)"""
+        if model_version != self._model_version:
+            if self._entries:
+                self.invalidations += 1
+            self._entries.clear()
+            self.current_bytes = 0
+            self._model_version = model_version
+
+    def get(self, key):
+        """
+        Lấy value theo key (đánh dấu mới dùng), None nếu miss
+        """
+        if not self.enabled:
+            return None
+        with self._lock:
+            self._check_version(key.model_version)
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0]
+
+    def put(self, key, value, size):
+        """
+        Lưu value vào cache
+
+        Parameters:
+        - key: CacheKey
+        - value: kết quả cần cache (không được sửa sau khi put)
+        - size: dung lượng ước tính của value (bytes)
+        """
+        if not self.enabled or size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(key.model_version)
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.current_bytes -= old[1]
+            self._entries[key] = (value, size)
+            self.current_bytes += size
+
+            # Evict LRU tới khi nằm trong giới hạn
+            while len(self._entries) > self.max_entries or self.current_bytes > self.max_bytes:
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.current_bytes -= evicted_size
+                self.evictions += 1
+
+    def invalidate(self):
+        """Xóa toàn bộ cache"""
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+            self.invalidations += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "entries": len(self._entries),
+                "bytes": self.current_bytes,
+                "max_entries": self.max_entries,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+                "model_version": self._model_version
+            }
@@ -0,0 +1,322 @@
+"""
+InferenceScheduler - Dynamic micro-batching cho các request inference đồng thời
+Gom các frame đang chờ trong một cửa sổ thời gian ngắn (hoặc tới max batch size)
+rồi chạy 1 lần model.predict cho cả batch và trả kết quả về từng request
+
+Mỗi request có thể mang deadline (time.monotonic()): request đã quá hạn bị bỏ
+trước khi predict, không chiếm CPU của các request còn hiệu lực
+"""
+
+import asyncio
+import time
+from collections import defaultdict, deque
+
+import numpy as np
+
+
+class DeadlineExceeded(asyncio.TimeoutError):
+    """Deadline của request đã qua trước khi công việc được xử lý"""
+
+
+def check_deadline(deadline):
+    """
+    Raise DeadlineExceeded nếu deadline (time.monotonic()) đã qua, None = không có deadline
+    (gọi giữa các bước xử lý để bỏ frame cũ)
+    """
+    if deadline is not None and time.monotonic() >= deadline:
+        raise DeadlineExceeded()
+
+
+def time_left(deadline):
+    """
+    Số giây còn lại tới deadline (dùng làm timeout cho asyncio.wait_for)
+
+    Raises:
+    - DeadlineExceeded: deadline đã qua
+    """
+    check_deadline(deadline)
+    return deadline - time.monotonic()
+
+
+class SchedulerMetrics:
+    """
+    Thống kê batching/scheduling để tune cửa sổ gom batch theo p99 latency
+    """
+
+    # Hệ số EWMA cho thời gian inference mỗi ảnh theo imgsz
+    EWMA_ALPHA = 0.2
+
+    def __init__(self, window=1000):
+        self.total_requests = 0
+        self.total_batches = 0
+        self.total_batched_images = 0
+        self.failed_requests = 0
+        self.expired_requests = 0
+        self.batch_size_histogram = defaultdict(int)
+        # Lưu các mẫu gần nhất để tính percentile
+        self.queue_wait_ms = deque(maxlen=window)
+        self.inference_ms = deque(maxlen=window)
+        self.latency_ms = deque(maxlen=window)
+        # EWMA thời gian inference / ảnh (ms) theo imgsz, dùng để chọn imgsz theo latency budget
+        self.image_ms = {}
+
+    def record_batch(self, batch_size, inference_ms, imgsz=None):
+        self.total_batches += 1
+        self.total_batched_images += batch_size
+        self.batch_size_histogram[batch_size] += 1
+        self.inference_ms.append(inference_ms)
+        if imgsz is not None:
+            per_image = inference_ms / batch_size
+            previous = self.image_ms.get(imgsz)
+            self.image_ms[imgsz] = (
+                per_image if previous is None else previous + self.EWMA_ALPHA * (per_image - previous)
+            )
+
+    @staticmethod
+    def _percentiles(samples):
+        if not samples:
+            return {"p50": 0, "p95": 0, "p99": 0, "mean": 0}
+        values = np.asarray(samples, dtype=np.float64)
+        return {
+            "p50": round(float(np.percentile(values, 50)), 3),
+            "p95": round(float(np.percentile(values, 95)), 3),
+            "p99": round(float(np.percentile(values, 99)), 3),
+            "mean": round(float(values.mean()), 3)
+        }
+
+    def to_dict(self):
+        avg_batch = self.total_batched_images / self.total_batches if self.total_batches else 0
+        return {
+            "total_requests": self.total_requests,
+            "total_batches": self.total_batches,
+            "failed_requests": self.failed_requests,
+            "expired_requests": self.expired_requests,
+            "avg_batch_size": round(avg_batch, 3),
+            "batch_size_histogram": {str(k): v for k, v in sorted(self.batch_size_histogram.items())},
+            "queue_wait_ms": self._percentiles(self.queue_wait_ms),
+            "inference_ms": self._percentiles(self.inference_ms),
+            "latency_ms": self._percentiles(self.latency_ms),
+            "image_ms_by_imgsz": {str(k): round(v, 3) for k, v in sorted(self.image_ms.items())}
+        }
+
+
+class _InferenceJob:
+    """Một ảnh đang chờ được đưa vào batch"""
+
+    __slots__ = ("image", "conf", "iou", "imgsz", "future", "deadline", "submitted_at")
+
+    def __init__(self, image, conf, iou, future, deadline=None, imgsz=None):
+        self.image = image
+        self.conf = conf
+        self.iou = iou
+        self.imgsz = imgsz
+        self.future = future
+        self.deadline = deadline
+        self.submitted_at = time.perf_counter()
+
+    def expired(self):
+        return self.deadline is not None and time.monotonic() >= self.deadline
+
+
+class InferenceScheduler:
+    """
+    Scheduler gom các request inference thành micro-batch
+    """
+
+    def __init__(self, detector, window_ms=8.0, max_batch_size=8):
+        """
+        Parameters:
+        - detector: ObjectDetector dùng chung
+        - window_ms: thời gian tối đa chờ gom batch (ms), 0 = không chờ
+        - max_batch_size: số ảnh tối đa trong 1 lần predict
+        """
+        self.detector = detector
+        self.window_ms = window_ms
+        self.max_batch_size = max(1, int(max_batch_size))
+        self.metrics = SchedulerMetrics()
+
+        self._queue = None
+        self._worker = None
+        self._loop = None
+
+    def _ensure_started(self):
+        """Khởi động worker trên event loop hiện tại (lazy, chỉ 1 lần mỗi loop)"""
+        loop = asyncio.get_running_loop()
+        if self._worker is None or self._worker.done() or self._loop is not loop:
+            self._loop = loop
+            self._queue = asyncio.Queue()
+            self._worker = loop.create_task(self._run())
+
+    async def submit(self, image, conf, iou, deadline=None, imgsz=None):
+        """
+        Đưa 1 ảnh vào hàng đợi và chờ kết quả
+
+        Parameters:
+        - image: numpy array (H, W, 3) BGR
+        - conf, iou: thresholds cho request này
+        - deadline: time.monotonic() mà sau đó kết quả không còn cần (None = không giới hạn)
+        - imgsz: kích thước input của model cho request này (None = imgsz của detector)
+
+        Returns:
+        - result: YOLO result của ảnh
+
+        Raises:
+        - DeadlineExceeded: deadline qua trước khi ảnh được predict
+        """
+        check_deadline(deadline)
+        self._ensure_started()
+        future = self._loop.create_future()
+        if imgsz == self.default_imgsz:
+            imgsz = None
+        self._queue.put_nowait(_InferenceJob(image, conf, iou, future, deadline, imgsz))
+        self.metrics.total_requests += 1
+        return await future
+
+    async def stop(self):
+        """Dừng worker"""
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    @property
+    def default_imgsz(self):
+        return getattr(self.detector, "imgsz", None)
+
+    def estimate_image_ms(self, imgsz):
+        """
+        Thời gian inference ước tính cho 1 ảnh ở imgsz (ms): EWMA đã đo, hoặc ngoại suy
+        theo diện tích input từ imgsz gần nhất đã đo. None nếu chưa đo được gì
+        """
+        known = self.metrics.image_ms
+        if imgsz in known:
+            return known[imgsz]
+        if not known:
+            return None
+        nearest = min(known, key=lambda size: abs(size - imgsz))
+        return known[nearest] * (imgsz / nearest) ** 2
+
+    def select_imgsz(self, budget_ms, choices):
+        """
+        imgsz lớn nhất trong choices mà queue wait (p50) + inference ước tính nằm trong budget_ms
+
+        Returns:
+        - imgsz: nhỏ nhất trong choices nếu không cái nào đạt, None nếu chưa có số liệu để ước tính
+        """
+        choices = sorted(choices)
+        if not choices:
+            return None
+        queue_wait = self.metrics._percentiles(self.metrics.queue_wait_ms)["p50"]
+        estimates = [(imgsz, self.estimate_image_ms(imgsz)) for imgsz in choices]
+        if all(estimate is None for _, estimate in estimates):
+            return None
+        for imgsz, estimate in reversed(estimates):
+            if queue_wait + estimate <= budget_ms:
+                return imgsz
+        return choices[0]
+
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    async def _collect_batch(self):
+        """Lấy job đầu tiên rồi gom thêm trong cửa sổ window_ms"""
+        batch = [await self._queue.get()]
+        deadline = self._loop.time() + self.window_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            # Lấy ngay các job đã có sẵn trong queue
+            if not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+                continue
+            remaining = deadline - self._loop.time()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        while True:
+            batch = await self._collect_batch()
+
+            # Bỏ các request đã bị hủy (client timeout/disconnect) hoặc đã quá deadline
+            batch = [job for job in batch if not job.future.done()]
+            for job in batch:
+                if job.expired():
+                    self._expire(job)
+            batch = [job for job in batch if not job.future.done()]
+            if not batch:
+                continue
+
+            # model.predict chỉ nhận 1 bộ conf/iou/imgsz -> nhóm theo tham số
+            groups = defaultdict(list)
+            for job in batch:
+                groups[(job.conf, job.iou, job.imgsz)].append(job)
+
+            started = time.perf_counter()
+            for job in batch:
+                self.metrics.queue_wait_ms.append((started - job.submitted_at) * 1000)
+
+            outcomes = await asyncio.to_thread(self._predict_groups, list(groups.items()))
+
+            finished = time.perf_counter()
+            for jobs, results, error in outcomes:
+                for i, job in enumerate(jobs):
+                    if job.future.done():
+                        continue
+                    if isinstance(error, DeadlineExceeded):
+                        self._expire(job)
+                        continue
+                    if error is not None:
+                        self.metrics.failed_requests += 1
+                        job.future.set_exception(error)
+                    else:
+                        job.future.set_result(results[i] if i < len(results) else None)
+                    self.metrics.latency_ms.append((finished - job.submitted_at) * 1000)
+
+    def _expire(self, job):
+        self.metrics.expired_requests += 1
+        job.future.set_exception(DeadlineExceeded())
+
+    def _predict_groups(self, groups):
+        """Chạy predict cho từng nhóm thresholds/imgsz (trong worker thread)"""
+        outcomes = []
+        for (conf, iou, imgsz), jobs in groups:
+            # Các nhóm trước có thể đã chạy lâu -> kiểm tra lại deadline ngay trước predict
+            expired = [job.expired() for job in jobs]
+            if any(expired):
+                outcomes.append(([job for job, e in zip(jobs, expired) if e], [], DeadlineExceeded()))
+                jobs = [job for job, e in zip(jobs, expired) if not e]
+                if not jobs:
+                    continue
+            started = time.perf_counter()
+            try:
+                images = [job.image for job in jobs]
+                if imgsz is None:
+                    results = self.detector.predict_batch(images, conf, iou)
+                else:
+                    results = self.detector.predict_batch(images, conf, iou, imgsz=imgsz)
+                outcomes.append((jobs, results, None))
+            except Exception as e:
+                print(f"Error in batched inference: {e}")
+                outcomes.append((jobs, [], e))
+            self.metrics.record_batch(
+                len(jobs), (time.perf_counter() - started) * 1000,
+                self.default_imgsz if imgsz is None else imgsz
+            )
+        return outcomes
+
+    def get_metrics(self):
+        metrics = self.metrics.to_dict()
+        metrics.update({
+            "window_ms": self.window_ms,
+            "max_batch_size": self.max_batch_size,
+            "queue_depth": self.queue_depth()
+        })
+        return metrics
@@ -0,0 +1,304 @@
+"""
+Session stores - Lưu state tracking (bytes từ VideoTracker.export_state) ngoài process
+để nhiều worker/process dùng chung session, không cần sticky routing
+
+Backends:
+- SQLiteSessionStore: file SQLite local (nhiều worker trên cùng máy)
+- KVSessionStore: key-value store qua network (Redis hoặc client tương thích get/set/delete)
+- LocalKVClient: client KV in-process cùng interface, dùng thay KV thật khi dev/test
+
+Mỗi state có version tăng dần: save là compare-and-set theo version worker đã load
+(2 worker ghi cùng session thì worker ghi sau bị từ chối thay vì ghi đè), load bỏ qua
+phần state khi version trong store trùng với bản worker đang giữ
+"""
+
+import sqlite3
+import struct
+import threading
+import time
+from pathlib import Path
+
+
+class SessionStore:
+    """
+    Interface chung của session store
+    """
+
+    name = "base"
+
+    def load(self, session_id, known_version=None):
+        """
+        State của session
+
+        Parameters:
+        - known_version: version bản state worker đang giữ (None = không có)
+
+        Returns:
+        - (version, data): data là None khi version == known_version (không cần tải lại state);
+          None nếu session không có hoặc đã hết hạn
+        """
+        raise NotImplementedError
+
+    def save(self, session_id, data, ttl, expected_version):
+        """
+        Compare-and-set: lưu state bytes với thời gian sống ttl (giây) nếu version trong store
+        vẫn là expected_version (0 = session chưa có trong store)
+
+        Returns:
+        - version mới, None nếu worker khác đã ghi session trước (conflict)
+        """
+        raise NotImplementedError
+
+    def delete(self, session_id):
+        raise NotImplementedError
+
+    def sweep(self):
+        """Xóa các session hết hạn (backend không tự expire), trả về số session bị xóa"""
+        return 0
+
+    def count(self):
+        """Số session đang lưu, None nếu backend không hỗ trợ"""
+        return None
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Session store trên file SQLite (WAL mode, dùng được từ nhiều process)
+    """
+
+    name = "sqlite"
+
+    def __init__(self, path):
+        """
+        path: đường dẫn file SQLite
+        """
+        self.path = str(path)
+        Path(self.path).parent.mkdir(parents=True, exist_ok=True)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=10)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS tracker_sessions ("
+                "session_id TEXT PRIMARY KEY, data BLOB NOT NULL, expires_at REAL NOT NULL, "
+                "version INTEGER NOT NULL DEFAULT 1)"
+            )
+            columns = [row[1] for row in self._conn.execute("PRAGMA table_info(tracker_sessions)")]
+            if "version" not in columns:
+                # File tạo bởi bản cũ (chưa có version)
+                self._conn.execute("ALTER TABLE tracker_sessions ADD COLUMN version INTEGER NOT NULL DEFAULT 1")
+
+    def load(self, session_id, known_version=None):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT version, CASE WHEN version = ? THEN NULL ELSE data END "
+                "FROM tracker_sessions WHERE session_id = ? AND expires_at > ?",
+                (known_version, session_id, time.time())
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], bytes(row[1]) if row[1] is not None else None
+
+    def save(self, session_id, data, ttl, expected_version):
+        now = time.time()
+        with self._lock, self._conn:
+            if expected_version:
+                cursor = self._conn.execute(
+                    "UPDATE tracker_sessions SET data = ?, version = version + 1, expires_at = ? "
+                    "WHERE session_id = ? AND version = ? AND expires_at > ?",
+                    (sqlite3.Binary(data), now + ttl, session_id, expected_version, now)
+                )
+                return expected_version + 1 if cursor.rowcount else None
+            # Session mới: chỉ ghi đè row đã hết hạn (version vẫn tăng tiếp để worker giữ bản cũ bị conflict)
+            cursor = self._conn.execute(
+                "INSERT INTO tracker_sessions (session_id, data, expires_at, version) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(session_id) DO UPDATE SET data = excluded.data, expires_at = excluded.expires_at, "
+                "version = tracker_sessions.version + 1 WHERE tracker_sessions.expires_at <= ?",
+                (session_id, sqlite3.Binary(data), now + ttl, now)
+            )
+            if not cursor.rowcount:
+                return None
+            return self._conn.execute(
+                "SELECT version FROM tracker_sessions WHERE session_id = ?", (session_id,)
+            ).fetchone()[0]
+
+    def delete(self, session_id):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM tracker_sessions WHERE session_id = ?", (session_id,))
+
+    def sweep(self):
+        with self._lock, self._conn:
+            cursor = self._conn.execute("DELETE FROM tracker_sessions WHERE expires_at <= ?", (time.time(),))
+            return cursor.rowcount
+
+    def count(self):
+        with self._lock:
+            return self._conn.execute(
+                "SELECT COUNT(*) FROM tracker_sessions WHERE expires_at > ?", (time.time(),)
+            ).fetchone()[0]
+
+
+class LocalKVClient:
+    """
+    KV client in-process với interface giống Redis (get / getrange / set(ex=) / delete)
+    và compare_and_set như RedisKVClient
+    Thay thế KV thật khi chạy 1 process hoặc test
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._lock = threading.Lock()
+
+    def _get(self, key):
+        """Value còn hạn của key (gọi trong lock)"""
+        entry = self._data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and expires_at <= time.time():
+            del self._data[key]
+            return None
+        return value
+
+    def get(self, key):
+        with self._lock:
+            return self._get(key)
+
+    def getrange(self, key, start, end):
+        with self._lock:
+            value = self._get(key)
+        return value[start:end + 1] if value is not None else b""
+
+    def set(self, key, value, ex=None):
+        with self._lock:
+            self._data[key] = (bytes(value), time.time() + ex if ex else None)
+        return True
+
+    def compare_and_set(self, key, expected_head, value, ex=None):
+        """Set value nếu value hiện tại bắt đầu bằng expected_head (b"" = key chưa tồn tại)"""
+        with self._lock:
+            current = self._get(key)
+            if expected_head:
+                if current is None or not current.startswith(expected_head):
+                    return False
+            elif current is not None:
+                return False
+            self._data[key] = (bytes(value), time.time() + ex if ex else None)
+        return True
+
+    def delete(self, key):
+        with self._lock:
+            return 1 if self._data.pop(key, None) is not None else 0
+
+
+class RedisKVClient:
+    """
+    Bọc redis.Redis cho KVSessionStore: get/getrange/delete gọi thẳng redis,
+    compare_and_set chạy bằng Lua script (atomic trên server)
+    """
+
+    _CAS_SCRIPT = """
+    local exists = redis.call('EXISTS', KEYS[1]) == 1
+    if ARGV[1] == '' then
+        if exists then
+            return 0
+        end
+    elseif not exists or redis.call('GETRANGE', KEYS[1], 0, string.len(ARGV[1]) - 1) ~= ARGV[1] then
+        return 0
+    end
+    redis.call('SET', KEYS[1], ARGV[2], 'EX', ARGV[3])
+    return 1
+    """
+
+    def __init__(self, redis_client):
+        self.redis = redis_client
+        self._cas = redis_client.register_script(self._CAS_SCRIPT)
+
+    def get(self, key):
+        return self.redis.get(key)
+
+    def getrange(self, key, start, end):
+        return self.redis.getrange(key, start, end)
+
+    def delete(self, key):
+        return self.redis.delete(key)
+
+    def compare_and_set(self, key, expected_head, value, ex=None):
+        return bool(self._cas(keys=[key], args=[expected_head or b"", value, ex]))
+
+
+class KVSessionStore(SessionStore):
+    """
+    Session store trên KV qua network, expire dựa vào TTL của KV
+    Value = version (8 byte big-endian) + state bytes
+    """
+
+    name = "kv"
+
+    VERSION_HEADER = struct.Struct(">Q")
+
+    def __init__(self, client, prefix="tracker_session:"):
+        """
+        Parameters:
+        - client: object có get(key), getrange(key, start, end), delete(key) và
+          compare_and_set(key, expected_head, value, ex=ttl) (LocalKVClient, RedisKVClient)
+        - prefix: prefix cho key của session
+        """
+        self.client = client
+        self.prefix = prefix
+
+    def load(self, session_id, known_version=None):
+        key = self.prefix + session_id
+        if known_version is not None:
+            # Chỉ đọc version trước, bỏ qua tải state nếu worker đang giữ bản mới nhất
+            head = bytes(self.client.getrange(key, 0, self.VERSION_HEADER.size - 1))
+            if len(head) < self.VERSION_HEADER.size:
+                return None
+            version = self.VERSION_HEADER.unpack(head)[0]
+            if version == known_version:
+                return version, None
+        value = self.client.get(key)
+        if value is None:
+            return None
+        value = bytes(value)
+        return self.VERSION_HEADER.unpack_from(value)[0], value[self.VERSION_HEADER.size:]
+
+    def save(self, session_id, data, ttl, expected_version):
+        expected_head = self.VERSION_HEADER.pack(expected_version) if expected_version else b""
+        version = (expected_version or 0) + 1
+        saved = self.client.compare_and_set(
+            self.prefix + session_id, expected_head,
+            self.VERSION_HEADER.pack(version) + bytes(data), ex=max(1, int(ttl))
+        )
+        return version if saved else None
+
+    def delete(self, session_id):
+        self.client.delete(self.prefix + session_id)
+
+
+def create_session_store(url):
+    """
+    Tạo session store từ URL cấu hình
+
+    - "" / "memory": không dùng store ngoài (session chỉ nằm trong process)
+    - "sqlite:///path/to/sessions.db": SQLiteSessionStore
+    - "kv://local": KVSessionStore với LocalKVClient
+    - "redis://host:port/db": KVSessionStore với redis client (cần cài package redis)
+
+    Returns:
+    - store: SessionStore, None nếu dùng memory
+    """
+    url = (url or "").strip()
+    if not url or url == "memory":
+        return None
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):])
+    if url == "kv://local":
+        return KVSessionStore(LocalKVClient())
+    if url.startswith(("redis://", "rediss://")):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Session store redis cần cài package redis (pip install redis)")
+        return KVSessionStore(RedisKVClient(redis.Redis.from_url(url)))
+    raise ValueError(f"Session store không hỗ trợ: {url}")
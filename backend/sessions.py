@@ -0,0 +1,328 @@
+"""
+SessionManager - Quản lý tracker sessions cho video tracking
+Giới hạn số session và tổng memory ước tính (LRU eviction), session hết hạn
+được dọn bởi background sweeper thay vì quét toàn bộ mỗi request
+
+Khi có session store (SQLite / KV), state tracking được lưu ra store sau mỗi frame
+(compare-and-set theo version) và đồng bộ lại ở mỗi request, nên các worker process
+dùng chung session; tracker trong process chỉ còn là bản làm việc, bị evict cũng
+không mất state. Khi bản trong process vẫn là version mới nhất thì không tải/deserialize
+lại state
+
+Request đang xử lý frame giữ session bằng acquire()/release() (pin): session đang
+được pin không bị evict hay sweep giữa request
+"""
+
+import asyncio
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Session:
+    """Tracker của 1 session và thông tin hoạt động"""
+
+    __slots__ = ("tracker", "created_at", "last_activity", "memory_bytes", "pins", "version")
+
+    def __init__(self, tracker):
+        self.tracker = tracker
+        self.created_at = time.time()
+        self.last_activity = self.created_at
+        self.memory_bytes = tracker.estimate_memory_bytes()
+        self.pins = 0  # số request đang dùng session
+        self.version = 0  # version state trong store mà tracker đang giữ (0 = chưa lưu)
+
+
+class SessionManager:
+    """
+    Store các VideoTracker theo session_id (LRU, thứ tự theo lần hoạt động gần nhất)
+    """
+
+    def __init__(self, factory, max_sessions=200, max_memory_bytes=512 * 1024 * 1024,
+                 timeout=300, sweep_interval=30, store=None):
+        """
+        Parameters:
+        - factory: hàm(conf_threshold, iou_threshold) -> VideoTracker cho session mới
+        - max_sessions: số session tối đa
+        - max_memory_bytes: tổng memory ước tính tối đa của tất cả sessions
+        - timeout: số giây không hoạt động trước khi session bị xóa
+        - sweep_interval: chu kỳ (giây) chạy background sweeper
+        - store: SessionStore dùng chung giữa các worker (None = state chỉ nằm trong process)
+        """
+        self.factory = factory
+        self.max_sessions = max(1, int(max_sessions))
+        self.max_memory_bytes = max_memory_bytes
+        self.timeout = timeout
+        self.sweep_interval = sweep_interval
+        self.store = store
+
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self.total_memory_bytes = 0
+        self.evicted = 0
+        self.expired = 0
+        self.conflicts = 0
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def __contains__(self, session_id):
+        return session_id in self._sessions
+
+    def get(self, session_id):
+        """Tracker của session (đánh dấu hoạt động), None nếu không tồn tại"""
+        if self.store is not None:
+            return self._sync(session_id, None, None, create=False)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            self._touch(session_id, session)
+            return session.tracker
+
+    def get_or_create(self, session_id, conf_threshold, iou_threshold):
+        """
+        Lấy tracker của session, tạo mới nếu chưa có (có thể evict session LRU)
+
+        Returns:
+        - tracker: VideoTracker
+        """
+        return self._get_or_create(session_id, conf_threshold, iou_threshold, pin=False)
+
+    def acquire(self, session_id, conf_threshold, iou_threshold):
+        """
+        Như get_or_create nhưng pin session cho tới khi gọi release():
+        session đang pin không bị evict (LRU/memory) hay sweep giữa request
+
+        Returns:
+        - tracker: VideoTracker
+        """
+        return self._get_or_create(session_id, conf_threshold, iou_threshold, pin=True)
+
+    def release(self, session_id, tracker):
+        """
+        Bỏ pin session sau khi request xử lý xong và cập nhật usage (như record_usage)
+
+        Parameters:
+        - tracker: tracker nhận từ acquire() (session có thể đã bị xóa/tạo lại trong lúc xử lý)
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.tracker is not tracker:
+                return
+            session.pins = max(0, session.pins - 1)
+        self.record_usage(session_id)
+
+    def _get_or_create(self, session_id, conf_threshold, iou_threshold, pin):
+        if self.store is not None:
+            return self._sync(session_id, conf_threshold, iou_threshold, pin)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._create(session_id, conf_threshold, iou_threshold, pin)
+            else:
+                self._touch(session_id, session)
+                session.pins += pin
+            return session.tracker
+
+    def _create(self, session_id, conf_threshold, iou_threshold, pin=False):
+        """Tạo session mới (gọi trong lock)"""
+        session = _Session(self.factory(conf_threshold, iou_threshold))
+        session.pins += pin
+        self._sessions[session_id] = session
+        self.total_memory_bytes += session.memory_bytes
+        self._evict(keep=session_id)
+        print(f"✅ Created new tracker session: {session_id}")
+        return session
+
+    def _sync(self, session_id, conf_threshold, iou_threshold, pin=False, create=True):
+        """
+        Worker khác có thể đã xử lý frame của session -> kiểm tra version mới nhất trong store,
+        chỉ tải state khi tracker trong process đã cũ
+
+        Parameters:
+        - create: False = trả về None nếu session không có trong store
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            known_version = session.version if session is not None else None
+        loaded = self.store.load(session_id, known_version)
+        if loaded is None and not create:
+            return None
+        tracker = self._attach(session_id, loaded, conf_threshold, iou_threshold, pin)
+        if tracker is None:
+            # Tracker trong process bị evict/thay đổi sau khi kiểm tra version -> tải lại đủ state
+            tracker = self._attach(session_id, self.store.load(session_id), conf_threshold, iou_threshold, pin)
+        return tracker
+
+    def _attach(self, session_id, loaded, conf_threshold, iou_threshold, pin=False):
+        """
+        Đồng bộ tracker trong process với state từ store
+
+        Parameters:
+        - loaded: (version, data) từ SessionStore.load (data None = tracker đang ở version đó),
+          None nếu session chưa có trong store (hoặc đã hết hạn)
+        - conf_threshold, iou_threshold: thresholds khi phải tạo tracker mới
+        - pin: pin session cho request (xem acquire)
+
+        Returns:
+        - tracker, None nếu loaded không kèm state nhưng tracker không còn ở version đó
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if loaded is not None and loaded[1] is None and (session is None or session.version != loaded[0]):
+                return None
+            if session is None:
+                session = self._create(session_id, conf_threshold, iou_threshold)
+            elif loaded is None:
+                # State trong store đã hết hạn/bị xóa -> bắt đầu lại như session mới
+                session.tracker.reset()
+            self._touch(session_id, session)
+            session.pins += pin
+            if loaded is None:
+                session.version = 0
+            else:
+                version, data = loaded
+                if data is not None:
+                    session.tracker.load_state(data)
+                session.version = version
+            return session.tracker
+
+    def record_usage(self, session_id):
+        """
+        Cập nhật thời gian hoạt động và memory ước tính sau khi session xử lý 1 frame
+        (evict session LRU nếu vượt giới hạn memory), lưu state ra store nếu có
+        """
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return
+            self._touch(session_id, session)
+            memory_bytes = session.tracker.estimate_memory_bytes()
+            self.total_memory_bytes += memory_bytes - session.memory_bytes
+            session.memory_bytes = memory_bytes
+            self._evict(keep=session_id)
+            tracker = session.tracker
+            version = session.version
+        if self.store is None:
+            return
+        version = self.store.save(session_id, tracker.export_state(), self.timeout, version)
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is not None and session.tracker is tracker:
+                # None: worker khác đã ghi state mới hơn -> request sau tải lại bản trong store
+                session.version = version
+            if version is None:
+                self.conflicts += 1
+        if version is None:
+            print(f"⚠️  Session state conflict (ghi bởi worker khác): {session_id}")
+
+    def remove(self, session_id):
+        """Xóa session, trả về True nếu có tồn tại"""
+        existed = False
+        if self.store is not None:
+            existed = self.store.load(session_id) is not None
+            self.store.delete(session_id)
+        with self._lock:
+            session = self._sessions.pop(session_id, None)
+            if session is None:
+                return existed
+            self.total_memory_bytes -= session.memory_bytes
+            return True
+
+    def _touch(self, session_id, session):
+        session.last_activity = time.time()
+        self._sessions.move_to_end(session_id)
+
+    def _evict(self, keep=None):
+        """
+        Evict session ít dùng nhất tới khi nằm trong giới hạn
+        (bỏ qua session keep và session đang được pin; có thể tạm vượt giới hạn nếu mọi session đều đang dùng)
+        """
+        for session_id in list(self._sessions):
+            if len(self._sessions) <= self.max_sessions and self.total_memory_bytes <= self.max_memory_bytes:
+                break
+            session = self._sessions[session_id]
+            if session_id == keep or session.pins:
+                continue
+            del self._sessions[session_id]
+            self.total_memory_bytes -= session.memory_bytes
+            self.evicted += 1
+            print(f"♻️  Evicted tracker session: {session_id}")
+
+    def sweep(self):
+        """
+        Xóa các session không hoạt động quá timeout
+
+        Returns:
+        - số session bị xóa
+        """
+        deadline = time.time() - self.timeout
+        removed = 0
+        with self._lock:
+            # OrderedDict theo thứ tự hoạt động -> chỉ cần duyệt từ đầu tới session còn hạn
+            for session_id, session in list(self._sessions.items()):
+                if session.last_activity > deadline:
+                    break
+                if session.pins:
+                    continue
+                del self._sessions[session_id]
+                self.total_memory_bytes -= session.memory_bytes
+                removed += 1
+            self.expired += removed
+        if self.store is not None:
+            self.store.sweep()
+        return removed
+
+    async def _sweep_loop(self):
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            removed = self.sweep()
+            if removed:
+                print(f"🧹 Removed {removed} expired tracker session(s)")
+
+    def start(self):
+        """Khởi động background sweeper trên event loop hiện tại"""
+        if self._sweeper is None or self._sweeper.done():
+            self._sweeper = asyncio.get_running_loop().create_task(self._sweep_loop())
+
+    async def stop(self):
+        """Dừng background sweeper"""
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+
+    def stats(self):
+        """Thống kê sessions cho endpoint introspection"""
+        now = time.time()
+        with self._lock:
+            sessions = [
+                {
+                    "session_id": session_id,
+                    "tracks": len(session.tracker.tracker.tracks),
+                    "active_tracks": session.tracker.get_active_tracks_count(),
+                    "memory_bytes": session.memory_bytes,
+                    "in_use": session.pins,
+                    "idle_seconds": round(now - session.last_activity, 1),
+                    "age_seconds": round(now - session.created_at, 1)
+                }
+                for session_id, session in reversed(self._sessions.items())
+            ]
+            return {
+                "count": len(sessions),
+                "max_sessions": self.max_sessions,
+                "total_memory_bytes": self.total_memory_bytes,
+                "max_memory_bytes": self.max_memory_bytes,
+                "timeout_seconds": self.timeout,
+                "evicted": self.evicted,
+                "expired": self.expired,
+                "conflicts": self.conflicts,
+                "store": self.store.name if self.store is not None else "memory",
+                "stored_sessions": self.store.count() if self.store is not None else None,
+                "sessions": sessions
+            }
@@ -2,13 +2,17 @@
 VideoTracker - Wrapper để tích hợp YOLO Detection + DeepSORT Tracking
 """
 
+import struct
+
 import cv2
 import numpy as np
 from pathlib import Path
 from typing import List, Dict, Optional, Tuple
 
-from inference import ObjectDetector
 from deepsort import DeepSortTracker
+from detections import Detections
+from inference import load_image
+from model_registry import model_registry
 
 
 class VideoTracker:
@@ -16,19 +20,43 @@ class VideoTracker:
     Video Tracker kết hợp YOLO detection và DeepSORT tracking
     """
     
-    def __init__(self, model_path, conf_threshold=0.25, iou_threshold=0.45, 
-                 max_age=30, min_hits=3, track_iou_threshold=0.3):
+    # Adaptive stride: độ trôi tối đa cho phép giữa 2 lần detect (tỉ lệ kích thước box)
+    MOTION_TOLERANCE = 0.25
+    # Độ bất định vị trí (std, tỉ lệ kích thước box) vượt ngưỡng này thì detect ngay
+    MAX_POSITION_UNCERTAINTY = 0.5
+    # Optical flow: lưới điểm mỗi box và số điểm hợp lệ tối thiểu
+    FLOW_GRID = 4
+    FLOW_MIN_POINTS = 4
+    
+    def __init__(self, model_path=None, conf_threshold=0.25, iou_threshold=0.45, 
+                 max_age=30, min_hits=3, track_iou_threshold=0.3, detector=None,
+                 detect_stride=1, adaptive_stride=False, max_detect_stride=5,
+                 optical_flow=False):
         """
         Parameters:
-        - model_path: đường dẫn tới YOLO model
+        - model_path: đường dẫn tới YOLO model (dùng khi không truyền detector)
         - conf_threshold: confidence threshold cho YOLO
         - iou_threshold: IoU threshold cho YOLO NMS
-        - max_age: số frame tối đa để giữ track không match
+        - max_age: số frame có detection tối đa để giữ track không match
         - min_hits: số frame match tối thiểu để confirm track
         - track_iou_threshold: IoU threshold cho tracking association
+        - detector: ObjectDetector dùng chung (None = lấy từ model_registry)
+        - detect_stride: chạy YOLO mỗi N frame, các frame giữa chỉ Kalman-propagate (1 = mọi frame)
+        - adaptive_stride: tự chọn stride theo chuyển động và độ bất định của tracks
+          (trong khoảng 1..max_detect_stride, bỏ qua detect_stride)
+        - max_detect_stride: stride tối đa khi adaptive_stride=True
+        - optical_flow: hiệu chỉnh prediction ở frame bỏ qua bằng sparse optical flow (Lucas-Kanade)
         """
-        # YOLO Detector
-        self.detector = ObjectDetector(model_path, conf_threshold, iou_threshold)
+        # YOLO Detector dùng chung - session chỉ giữ state của DeepSORT
+        if detector is None:
+            if model_path is None:
+                raise ValueError("Cần truyền model_path hoặc detector")
+            detector = model_registry.get(model_path, conf_threshold, iou_threshold)
+        self.detector = detector
+        
+        # Thresholds riêng của session (không sửa state của detector dùng chung)
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
         
         # DeepSORT Tracker
         self.tracker = DeepSortTracker(
@@ -36,132 +64,258 @@ class VideoTracker:
             min_hits=min_hits,
             iou_threshold=track_iou_threshold
         )
+        
+        # Detection stride
+        self.detect_stride = max(1, int(detect_stride))
+        self.adaptive_stride = adaptive_stride
+        self.max_detect_stride = max(1, int(max_detect_stride))
+        self.optical_flow = optical_flow
+        self.current_stride = 1 if adaptive_stride else self.detect_stride
+        self.frames_since_detection = 0
+        self._prev_gray = None
     
-    def process_frame(self, frame_image_path: str, frame_image_array: Optional[np.ndarray] = None):
+    def process_frame(self, frame, frame_image_array: Optional[np.ndarray] = None,
+                      conf: Optional[float] = None, iou: Optional[float] = None,
+                      render: bool = True):
         """
         Process một frame: Detect + Track
         
         Parameters:
-        - frame_image_path: đường dẫn tới frame image (nếu có)
-        - frame_image_array: numpy array của frame (H, W, 3) RGB (nếu có)
+        - frame: numpy array (H, W, 3) BGR đã decode, bytes ảnh hoặc đường dẫn tới frame image
+        - frame_image_array: numpy array của frame (H, W, 3) RGB (nếu có, ưu tiên hơn frame)
+        - conf, iou: thresholds cho frame này (None = dùng thresholds của session)
+        - render: vẽ tracks lên ảnh (False = chỉ trả tracks, img_rgb là None)
         
         Returns:
         - result: YOLO result object
         - img_rgb: image với bounding boxes và track IDs (RGB format)
         - tracks: list of track dicts
         """
-        # Load frame
+        # Load frame (giữ BGR - thứ tự kênh gốc cho cả YOLO và feature extraction)
         if frame_image_array is not None:
-            img_rgb = frame_image_array.copy()
             # Convert RGB to BGR cho YOLO (YOLO expects BGR)
-            img_bgr = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR)
-            # Save temp để YOLO có thể đọc
-            temp_path = Path(frame_image_path) if frame_image_path else None
-            if temp_path and temp_path.exists():
-                cv2.imwrite(str(temp_path), img_bgr)
+            img_bgr = cv2.cvtColor(frame_image_array, cv2.COLOR_RGB2BGR)
         else:
-            if not Path(frame_image_path).exists():
-                return None, None, []
-            
-            # Read image
-            img_bgr = cv2.imread(str(frame_image_path))
+            img_bgr = load_image(frame)
             if img_bgr is None:
                 return None, None, []
-            
-            img_rgb = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB)
+        
+        # Frame nằm giữa 2 lần detect: chỉ propagate tracks
+        if not self.should_detect():
+            return self.propagate_frame(img_bgr, render)
         
         # 1. YOLO Detection
         try:
-            results = self.detector.model.predict(
-                source=img_bgr,
-                conf=self.detector.conf_threshold,
-                iou=self.detector.iou_threshold,
-                save=False,
-                verbose=False
+            # Qua predict_batch để giữ lock predictor của detector dùng chung
+            results = self.detector.predict_batch(
+                [img_bgr],
+                self.conf_threshold if conf is None else conf,
+                self.iou_threshold if iou is None else iou
             )
             
             if not results or len(results) == 0:
-                return None, img_rgb, []
+                return None, self._to_rgb(img_bgr, render), []
             
             result = results[0]
             
-            if result is None or not hasattr(result, 'boxes') or result.boxes is None:
-                return None, img_rgb, []
-            
         except Exception as e:
             print(f"Error in YOLO detection: {e}")
-            return None, img_rgb, []
+            return None, self._to_rgb(img_bgr, render), []
+        
+        return self.track_result(result, img_bgr, render)
+    
+    def track_result(self, result, img_bgr: np.ndarray, render: bool = True):
+        """
+        Tracking từ YOLO result đã có sẵn (vd. từ InferenceScheduler)
+        
+        Parameters:
+        - result: YOLO result của frame
+        - img_bgr: frame gốc (H, W, 3) BGR
+        - render: vẽ tracks lên ảnh (False = img_rgb trả về là None)
+        
+        Returns:
+        - result, img_rgb, tracks: giống process_frame
+        """
+        if result is None or not hasattr(result, 'boxes') or result.boxes is None:
+            return None, self._to_rgb(img_bgr, render), []
+        img_with_tracks, formatted_tracks = self._track(result, img_bgr, render)
+        
+        # Sau mỗi lần detect: reset bộ đếm và chọn stride cho các frame tiếp theo
+        self.frames_since_detection = 0
+        if self.adaptive_stride:
+            self.current_stride = self._compute_adaptive_stride()
+        if self.optical_flow:
+            self._prev_gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+        
+        return result, img_with_tracks, formatted_tracks
+    
+    def should_detect(self) -> bool:
+        """
+        Frame tiếp theo có cần chạy YOLO hay không
+        (luôn detect khi chưa có track nào để không bỏ lỡ đối tượng mới)
+        """
+        if not self.tracker.tracks:
+            return True
+        return self.frames_since_detection + 1 >= self.current_stride
+    
+    def propagate_frame(self, frame, render: bool = True):
+        """
+        Frame không chạy detection: advance Kalman prediction của tất cả tracks
+        (hiệu chỉnh bằng optical flow nếu bật) và trả về tracks dự đoán
+        
+        Parameters:
+        - frame: numpy array (H, W, 3) BGR, bytes ảnh hoặc đường dẫn
+        - render: vẽ tracks lên ảnh (False = img_rgb là None)
+        
+        Returns:
+        - result: luôn None (không có YOLO result)
+        - img_rgb, tracks: giống process_frame, mỗi track có 'predicted': True
+        """
+        img_bgr = load_image(frame)
+        if img_bgr is None:
+            return None, None, []
         
+        center_shifts = None
+        if self.optical_flow:
+            gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+            center_shifts = self._estimate_flow_shifts(gray)
+            self._prev_gray = gray
+        
+        tracks = self.tracker.predict_only(center_shifts)
+        self.frames_since_detection += 1
+        
+        formatted_tracks = []
+        for track in tracks:
+            track_dict = track.to_dict(is_new=False)
+            track_dict['predicted'] = True
+            formatted_tracks.append(track_dict)
+        
+        if not render:
+            return None, None, formatted_tracks
+        img_with_tracks = self._draw_tracks(self._to_rgb(img_bgr, render), tracks, is_new_tracks={})
+        return None, img_with_tracks, formatted_tracks
+    
+    def _compute_adaptive_stride(self) -> int:
+        """
+        Chọn stride theo tốc độ và độ bất định vị trí của tracks (từ Kalman state)
+        
+        Stride lớn nhất sao cho track nhanh nhất trôi không quá MOTION_TOLERANCE
+        kích thước box; detect mọi frame khi còn track chưa confirm hoặc bất định cao
+        """
+        tracks = self.tracker.tracks
+        if not tracks or not all(t.is_confirmed for t in tracks):
+            return 1
+        
+        kf_indices = [t.kf_index for t in tracks]
+        x = self.tracker.kalman.x[kf_indices]
+        P = self.tracker.kalman.P[kf_indices]
+        
+        # Kích thước box ~ sqrt(area)
+        size = np.sqrt(np.maximum(x[:, 2], 1.0))
+        uncertainty = np.sqrt(P[:, 0, 0] + P[:, 1, 1]) / size
+        if uncertainty.max() > self.MAX_POSITION_UNCERTAINTY:
+            return 1
+        
+        speed = np.hypot(x[:, 4], x[:, 5]) / size  # tỉ lệ kích thước box / frame
+        max_speed = float(speed.max())
+        if max_speed <= 1e-6:
+            return self.max_detect_stride
+        return int(np.clip(self.MOTION_TOLERANCE / max_speed, 1, self.max_detect_stride))
+    
+    def _estimate_flow_shifts(self, gray: np.ndarray):
+        """
+        Đo độ dịch tâm của từng track bằng Lucas-Kanade trên lưới điểm trong box
+        (1 lần calcOpticalFlowPyrLK cho tất cả tracks)
+        
+        Returns:
+        - shifts: numpy array (N, 2) median displacement, NaN nếu không đủ điểm hợp lệ;
+          None nếu không có frame trước
+        """
+        tracks = self.tracker.tracks
+        if self._prev_gray is None or self._prev_gray.shape != gray.shape or not tracks:
+            return None
+        
+        h, w = gray.shape[:2]
+        boxes = self.tracker.kalman.get_states([t.kf_index for t in tracks])
+        x1 = np.clip(boxes[:, 0], 0, w - 1)
+        y1 = np.clip(boxes[:, 1], 0, h - 1)
+        x2 = np.clip(boxes[:, 2], 0, w - 1)
+        y2 = np.clip(boxes[:, 3], 0, h - 1)
+        
+        # Lưới FLOW_GRID x FLOW_GRID điểm ở phần giữa box (tránh background ở viền)
+        grid = np.linspace(0.2, 0.8, self.FLOW_GRID, dtype=np.float32)
+        gx, gy = np.meshgrid(grid, grid)
+        px = x1[:, None] + (x2 - x1)[:, None] * gx.ravel()[None, :]
+        py = y1[:, None] + (y2 - y1)[:, None] * gy.ravel()[None, :]
+        points = np.stack([px, py], axis=2).astype(np.float32)
+        
+        next_points, status, _ = cv2.calcOpticalFlowPyrLK(
+            self._prev_gray, gray, points.reshape(-1, 1, 2), None,
+            winSize=(15, 15), maxLevel=2
+        )
+        if next_points is None:
+            return None
+        
+        displacement = (next_points.reshape(points.shape) - points).astype(np.float64)
+        ok = status.reshape(points.shape[:2]).astype(bool)
+        displacement[~ok] = np.nan
+        
+        shifts = np.full((len(tracks), 2), np.nan)
+        enough = ok.sum(axis=1) >= self.FLOW_MIN_POINTS
+        if enough.any():
+            shifts[enough] = np.nanmedian(displacement[enough], axis=1)
+        return shifts
+    
+    @staticmethod
+    def _to_rgb(img_bgr: np.ndarray, render: bool):
+        """Chuyển BGR sang RGB cho web (chỉ khi cần render)"""
+        return cv2.cvtColor(img_bgr, cv2.COLOR_BGR2RGB) if render else None
+    
+    def _track(self, result, img_bgr: np.ndarray, render: bool = True):
+        """
+        Extract detections, update DeepSORT và vẽ tracks
+        
+        Returns:
+        - img_with_tracks: image với bounding boxes và track IDs (RGB), None nếu render=False
+        - formatted_tracks: list of track dicts
+        """
         # 2. Extract detections format cho DeepSORT
         detections = self._extract_detections_for_tracking(result)
         
         if len(detections) == 0:
             # Không có detections, chỉ predict tracks
-            tracks = self.tracker.update([], img_rgb)
-            img_with_tracks = self._draw_tracks(img_rgb, tracks, is_new_tracks={})
-            return result, img_with_tracks, []
+            tracks = self.tracker.update([], img_bgr, channel_order='BGR')
+            if not render:
+                return None, []
+            img_with_tracks = self._draw_tracks(self._to_rgb(img_bgr, render), tracks, is_new_tracks={})
+            return img_with_tracks, []
         
-        # 3. DeepSORT Tracking
-        tracks = self.tracker.update(detections, img_rgb)
+        # 3. DeepSORT Tracking (features tính trực tiếp trên frame BGR)
+        tracks = self.tracker.update(detections, img_bgr, channel_order='BGR')
         
         # 4. Format tracks output
         formatted_tracks = self._format_tracks(tracks, detections)
         
-        # 5. Draw tracks on image
+        # 5. Draw tracks on image (bỏ qua khi client tự vẽ)
+        if not render:
+            return None, formatted_tracks
         is_new_tracks = {t['track_id']: t['is_new'] for t in formatted_tracks}
-        img_with_tracks = self._draw_tracks(img_rgb, tracks, is_new_tracks)
+        img_with_tracks = self._draw_tracks(self._to_rgb(img_bgr, render), tracks, is_new_tracks)
         
-        return result, img_with_tracks, formatted_tracks
+        return img_with_tracks, formatted_tracks
     
-    def _extract_detections_for_tracking(self, result) -> List[Dict]:
+    def _extract_detections_for_tracking(self, result) -> Detections:
         """
-        Extract detections từ YOLO result format cho DeepSORT
+        Extract detections từ YOLO result cho DeepSORT (1 lần copy tensor, lọc vectorized)
         
         Returns:
-        - detections: list of dicts với keys: bbox, class, confidence, class_id
+        - detections: Detections (xyxy, confidence, class_id)
         """
-        detections = []
-        
-        if result is None or not hasattr(result, 'boxes'):
-            return detections
-        
-        boxes = result.boxes
-        
-        if boxes is None or len(boxes) == 0:
-            return detections
-        
         try:
-            for box in boxes:
-                try:
-                    cls_id = int(box.cls[0])
-                    conf = float(box.conf[0])
-                    
-                    # Kiểm tra class_id hợp lệ
-                    if cls_id not in self.detector.classes:
-                        continue
-                    
-                    class_name = self.detector.classes[cls_id]
-                    x1, y1, x2, y2 = box.xyxy[0].cpu().numpy()
-                    
-                    # Validate bbox coordinates
-                    if x2 <= x1 or y2 <= y1:
-                        continue
-                    
-                    detections.append({
-                        'bbox': [float(x1), float(y1), float(x2), float(y2)],
-                        'class': class_name,
-                        'class_id': cls_id,
-                        'confidence': float(conf)
-                    })
-                except (IndexError, ValueError, AttributeError) as e:
-                    print(f"Warning: Skipping invalid box: {e}")
-                    continue
-        
+            return Detections.from_result(result, self.detector.classes)
         except Exception as e:
             print(f"Error extracting detections: {e}")
-            return detections
-        
-        return detections
+            return Detections.empty(self.detector.classes)
     
     def _format_tracks(self, tracks, detections) -> List[Dict]:
         """
@@ -273,6 +427,57 @@ class VideoTracker:
         Reset tracker (xóa tất cả tracks)
         """
         self.tracker.reset()
+        self.current_stride = 1 if self.adaptive_stride else self.detect_stride
+        self.frames_since_detection = 0
+        self._prev_gray = None
+    
+    # State của session: magic + thresholds + bộ đếm stride, tiếp theo là DeepSortTracker.to_bytes()
+    _STATE_HEADER = struct.Struct("<4sddII")
+    STATE_MAGIC = b"VTRK"
+    
+    def export_state(self) -> bytes:
+        """
+        Serialize state tracking của session (DeepSORT + thresholds + bộ đếm stride)
+        để lưu vào session store dùng chung giữa các worker
+        (frame trước của optical flow không được lưu)
+        """
+        header = self._STATE_HEADER.pack(
+            self.STATE_MAGIC, self.conf_threshold, self.iou_threshold,
+            self.current_stride, self.frames_since_detection
+        )
+        return header + self.tracker.to_bytes()
+    
+    def load_state(self, data: bytes):
+        """
+        Load state đã export bằng export_state (thay thế state hiện tại)
+        
+        Raises:
+        - ValueError: dữ liệu không đúng format
+        """
+        if len(data) < self._STATE_HEADER.size:
+            raise ValueError("Session state không hợp lệ")
+        magic, conf, iou, current_stride, frames_since_detection = self._STATE_HEADER.unpack_from(data)
+        if magic != self.STATE_MAGIC:
+            raise ValueError("Session state không hợp lệ")
+        self.tracker = DeepSortTracker.from_bytes(data[self._STATE_HEADER.size:])
+        self.conf_threshold = conf
+        self.iou_threshold = iou
+        self.current_stride = current_stride
+        self.frames_since_detection = frames_since_detection
+        self._prev_gray = None
+    
+    def estimate_memory_bytes(self) -> int:
+        """
+        Ước tính memory của session: Kalman bank, features + history của tracks
+        và frame trước (optical flow)
+        """
+        # Overhead cố định của session và của mỗi Track object (dict/attributes)
+        total = 8 * 1024 + self.tracker.kalman.nbytes
+        for track in self.tracker.tracks:
+            total += 1024 + track.feature.nbytes + 16 * len(track.history)
+        if self._prev_gray is not None:
+            total += self._prev_gray.nbytes
+        return total
     
     def get_active_tracks_count(self):
         """
@@ -0,0 +1,364 @@
+"""
+VideoPipeline - Detection + tracking cho file video trên server
+Chia thành 4 stage: decode (OpenCV) → inference (YOLO theo batch nhỏ) → tracking
+(DeepSORT) → encode (NDJSON/MOT + video đã vẽ tracks). Mỗi stage chạy trên thread
+riêng, nối bằng queue có giới hạn nên các stage chạy chồng lên nhau và bộ nhớ chỉ
+giữ tối đa queue_size frame giữa 2 stage
+
+Chạy từ command line:
+    python video_pipeline.py input.mp4 --output tracks.ndjson
+    python video_pipeline.py input.mp4 --output tracks.txt --format mot --annotated output.mp4
+"""
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+
+import cv2
+
+from tracker import VideoTracker
+
+
+OUTPUT_FORMATS = ("ndjson", "mot")
+STAGES = ("decode", "inference", "tracking", "encode")
+
+# Đánh dấu hết frame giữa các stage
+_END = object()
+
+
+class PipelineStats:
+    """
+    Tiến độ và throughput của pipeline (cập nhật bởi các stage thread)
+    """
+
+    def __init__(self):
+        self.frames_total = 0
+        self.fps_source = 0.0
+        self.frames = dict.fromkeys(STAGES, 0)
+        self.busy_seconds = dict.fromkeys(STAGES, 0.0)
+        self.started_at = None
+        self.finished_at = None
+
+    def record(self, stage, frames, seconds):
+        self.frames[stage] += frames
+        self.busy_seconds[stage] += seconds
+
+    def to_dict(self):
+        end = self.finished_at or time.perf_counter()
+        elapsed = end - self.started_at if self.started_at else 0.0
+        done = self.frames["encode"]
+        return {
+            "frames_total": self.frames_total,
+            "frames_done": done,
+            "progress": round(done / self.frames_total, 4) if self.frames_total else None,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_fps": round(done / elapsed, 2) if elapsed > 0 else 0,
+            "source_fps": self.fps_source,
+            "stages": {
+                stage: {
+                    "frames": self.frames[stage],
+                    "busy_ms_per_frame": (
+                        round(self.busy_seconds[stage] * 1000 / self.frames[stage], 3) if self.frames[stage] else 0
+                    )
+                }
+                for stage in STAGES
+            }
+        }
+
+
+class _Frame:
+    """1 frame đi qua các stage"""
+
+    __slots__ = ("index", "image", "result", "tracks")
+
+    def __init__(self, index, image):
+        self.index = index
+        self.image = image
+        self.result = None
+        self.tracks = None
+
+
+def format_mot(frame_index, tracks):
+    """
+    Dòng MOTChallenge cho 1 frame: frame,id,x,y,w,h,conf,-1,-1,-1 (frame bắt đầu từ 1)
+    """
+    lines = []
+    for track in tracks:
+        x1, y1, x2, y2 = track["bbox"]
+        lines.append(
+            f"{frame_index + 1},{track['track_id']},{x1:.2f},{y1:.2f},{x2 - x1:.2f},{y2 - y1:.2f},"
+            f"{track['confidence']:.4f},-1,-1,-1\n"
+        )
+    return "".join(lines)
+
+
+class VideoPipeline:
+    """
+    Pipeline xử lý 1 file video (mỗi lần chạy dùng 1 VideoTracker riêng)
+    """
+
+    def __init__(self, detector, conf_threshold=0.25, iou_threshold=0.45, batch_size=4, queue_size=8):
+        """
+        Parameters:
+        - detector: ObjectDetector dùng chung
+        - conf_threshold, iou_threshold: thresholds cho YOLO
+        - batch_size: số frame tối đa mỗi lần model.predict (lấy các frame đã decode sẵn)
+        - queue_size: số frame tối đa chờ giữa 2 stage
+        """
+        self.detector = detector
+        self.conf_threshold = conf_threshold
+        self.iou_threshold = iou_threshold
+        self.batch_size = max(1, int(batch_size))
+        self.queue_size = max(1, int(queue_size))
+        self.stats = PipelineStats()
+
+        self._stop = threading.Event()
+        self._error = None
+
+    # ---- Queue helpers (dừng được khi pipeline bị hủy) ----
+
+    def _put(self, q, item):
+        while not self._stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _get(self, q):
+        while not self._stop.is_set():
+            try:
+                return q.get(timeout=0.1)
+            except queue.Empty:
+                continue
+        return _END
+
+    def _fail(self, stage, error):
+        print(f"Error in video pipeline ({stage}): {error}")
+        if self._error is None:
+            self._error = error
+        self._stop.set()
+
+    # ---- Stages ----
+
+    def _decode(self, capture, out_q):
+        try:
+            index = 0
+            while not self._stop.is_set():
+                started = time.perf_counter()
+                ok, image = capture.read()
+                if not ok:
+                    break
+                self.stats.record("decode", 1, time.perf_counter() - started)
+                if not self._put(out_q, _Frame(index, image)):
+                    return
+                index += 1
+        except Exception as e:
+            self._fail("decode", e)
+        finally:
+            capture.release()
+        self._put(out_q, _END)
+
+    def _infer(self, in_q, out_q):
+        try:
+            finished = False
+            while not finished:
+                frame = self._get(in_q)
+                if frame is _END:
+                    break
+                # Gom thêm các frame đã decode sẵn (không chờ) thành 1 batch
+                batch = [frame]
+                while len(batch) < self.batch_size:
+                    try:
+                        frame = in_q.get_nowait()
+                    except queue.Empty:
+                        break
+                    if frame is _END:
+                        finished = True
+                        break
+                    batch.append(frame)
+
+                started = time.perf_counter()
+                # predict_batch giữ predict_lock của detector dùng chung (không chạy chồng với API/jobs)
+                results = self.detector.predict_batch(
+                    [frame.image for frame in batch], self.conf_threshold, self.iou_threshold
+                )
+                self.stats.record("inference", len(batch), time.perf_counter() - started)
+                for frame, result in zip(batch, results):
+                    frame.result = result
+                    if not self._put(out_q, frame):
+                        return
+        except Exception as e:
+            self._fail("inference", e)
+        self._put(out_q, _END)
+
+    def _track(self, in_q, out_q, render):
+        try:
+            tracker = VideoTracker(
+                detector=self.detector,
+                conf_threshold=self.conf_threshold,
+                iou_threshold=self.iou_threshold
+            )
+            while True:
+                frame = self._get(in_q)
+                if frame is _END:
+                    break
+                started = time.perf_counter()
+                _, img_rgb, frame.tracks = tracker.track_result(frame.result, frame.image, render=render)
+                # Giữ ảnh đã vẽ tracks cho stage encode (BGR cho VideoWriter)
+                frame.image = cv2.cvtColor(img_rgb, cv2.COLOR_RGB2BGR) if render and img_rgb is not None else (
+                    frame.image if render else None
+                )
+                frame.result = None
+                self.stats.record("tracking", 1, time.perf_counter() - started)
+                if not self._put(out_q, frame):
+                    return
+        except Exception as e:
+            self._fail("tracking", e)
+        self._put(out_q, _END)
+
+    def _encode(self, in_q, out_q, fmt, writer):
+        try:
+            while True:
+                frame = self._get(in_q)
+                if frame is _END:
+                    break
+                started = time.perf_counter()
+                if writer is not None:
+                    writer.write(frame.image)
+                if fmt == "mot":
+                    text = format_mot(frame.index, frame.tracks)
+                else:
+                    text = json.dumps({"type": "frame", "frame": frame.index, "tracks": frame.tracks},
+                                      ensure_ascii=False) + "\n"
+                self.stats.record("encode", 1, time.perf_counter() - started)
+                if not self._put(out_q, text):
+                    return
+        except Exception as e:
+            self._fail("encode", e)
+        finally:
+            if writer is not None:
+                writer.release()
+        self._put(out_q, _END)
+
+    # ---- Public API ----
+
+    def iter_output(self, video_path, fmt="ndjson", annotated_path=None):
+        """
+        Chạy pipeline, yield output của từng frame theo thứ tự frame
+
+        Parameters:
+        - video_path: đường dẫn file video
+        - fmt: ndjson (1 dòng JSON / frame) | mot (dòng MOTChallenge cho mỗi track)
+        - annotated_path: ghi video đã vẽ tracks ra file này (mp4, None = không ghi)
+
+        Yields:
+        - text: output của 1 frame (có thể rỗng với MOT khi frame không có track)
+
+        Raises:
+        - ValueError: format không hỗ trợ hoặc không mở được video
+        - RuntimeError: 1 stage bị lỗi giữa chừng
+        """
+        if fmt not in OUTPUT_FORMATS:
+            raise ValueError(f"Format không hỗ trợ: {fmt}")
+        capture = cv2.VideoCapture(str(video_path))
+        if not capture.isOpened():
+            raise ValueError("Không thể mở file video.")
+
+        self.stats = PipelineStats()
+        self.stats.frames_total = max(0, int(capture.get(cv2.CAP_PROP_FRAME_COUNT)))
+        self.stats.fps_source = round(float(capture.get(cv2.CAP_PROP_FPS) or 0), 3)
+        self._stop.clear()
+        self._error = None
+
+        writer = None
+        if annotated_path is not None:
+            size = (int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)), int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+            writer = cv2.VideoWriter(
+                str(annotated_path), cv2.VideoWriter_fourcc(*"mp4v"), self.stats.fps_source or 25.0, size
+            )
+
+        queues = [queue.Queue(maxsize=self.queue_size) for _ in range(4)]
+        threads = [
+            threading.Thread(target=self._decode, args=(capture, queues[0]), name="video-decode"),
+            threading.Thread(target=self._infer, args=(queues[0], queues[1]), name="video-inference"),
+            threading.Thread(target=self._track, args=(queues[1], queues[2], writer is not None),
+                             name="video-tracking"),
+            threading.Thread(target=self._encode, args=(queues[2], queues[3], fmt, writer), name="video-encode")
+        ]
+        self.stats.started_at = time.perf_counter()
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+
+        try:
+            while True:
+                text = self._get(queues[3])
+                if text is _END:
+                    break
+                yield text
+        finally:
+            # Consumer dừng sớm (client ngắt kết nối) hoặc đã xong: dừng và chờ các stage
+            self._stop.set()
+            for thread in threads:
+                thread.join()
+            self.stats.finished_at = time.perf_counter()
+
+        if self._error is not None:
+            raise RuntimeError(f"Lỗi xử lý video: {self._error}")
+
+    def run(self, video_path, output_path, fmt="ndjson", annotated_path=None, on_progress=None,
+            progress_interval=1.0):
+        """
+        Chạy pipeline và ghi output ra file
+
+        Parameters:
+        - on_progress: hàm(stats dict) được gọi mỗi progress_interval giây
+
+        Returns:
+        - stats: dict tiến độ/throughput cuối cùng
+        """
+        last_report = time.perf_counter()
+        with open(output_path, "w", encoding="utf-8") as f:
+            for text in self.iter_output(video_path, fmt, annotated_path):
+                f.write(text)
+                if on_progress is not None and time.perf_counter() - last_report >= progress_interval:
+                    on_progress(self.stats.to_dict())
+                    last_report = time.perf_counter()
+        return self.stats.to_dict()
+
+
+def main():
+    from model_registry import model_registry
+
+    parser = argparse.ArgumentParser(description="Detection + tracking cho file video")
+    parser.add_argument("video", help="File video đầu vào")
+    parser.add_argument("--model", default="../best.pt", help="Đường dẫn model YOLO")
+    parser.add_argument("--output", required=True, help="File output (NDJSON hoặc MOT)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="ndjson")
+    parser.add_argument("--annotated", default=None, help="Ghi video đã vẽ tracks (mp4)")
+    parser.add_argument("--backend", default="torch", help="Backend inference: torch | onnx | torchscript | onnx-int8")
+    parser.add_argument("--conf", type=float, default=0.25)
+    parser.add_argument("--iou", type=float, default=0.45)
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--queue-size", type=int, default=8)
+    args = parser.parse_args()
+
+    detector = model_registry.get(args.model, args.conf, args.iou, backend=args.backend)
+    pipeline = VideoPipeline(detector, args.conf, args.iou, batch_size=args.batch_size, queue_size=args.queue_size)
+
+    def report(stats):
+        progress = f"{stats['progress'] * 100:.1f}%" if stats["progress"] is not None else "?"
+        print(f"  {stats['frames_done']}/{stats['frames_total']} frames ({progress}), "
+              f"{stats['throughput_fps']} fps", file=sys.stderr)
+
+    stats = pipeline.run(args.video, args.output, args.format, args.annotated, on_progress=report)
+    print(json.dumps(stats, indent=2))
+
+
+if __name__ == "__main__":
+    main()
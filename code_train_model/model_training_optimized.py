@@ -359,16 +359,20 @@ class OptimizedTrainer:
             
             raise
     
-    def validate(self, model_path=None):
-        """Validation"""
+    def validate(self, model_path=None, imgsz=None):
+        """Validation (imgsz: kích thước input khi val, None = mặc định của ultralytics)"""
         if model_path:
             print(f"\n📦 Load: {model_path}")
             self.model = YOLO(model_path)
         
         print("\n📊 Validating...")
         
+        val_args = {"data": self.yaml_config}
+        if imgsz:
+            val_args["imgsz"] = imgsz
+        
         try:
-            metrics = self.model.val(data=self.yaml_config)
+            metrics = self.model.val(**val_args)
             
             print("\n" + "="*70)
             print("📈 FINAL RESULTS")
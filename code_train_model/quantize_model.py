@@ -0,0 +1,310 @@
+"""
+========================================
+FILE 3: quantize_model.py
+========================================
+INT8 post-training quantization cho model deploy (serve trên CPU)
+Input:  best.pt + folder ảnh calibration + data.yaml (validation)
+Output: best_<imgsz>_int8.onnx cạnh best.pt (backend "onnx-int8" của ObjectDetector)
+
+Các bước:
+1. Export best.pt -> ONNX FP32 (dùng lại export_model của backend, cache cạnh weights)
+2. Static quantization bằng ONNX Runtime, calibration trên ảnh thật (cùng letterbox với ultralytics)
+3. Validate FP32 và INT8 trên 1 subset của tập val (OptimizedTrainer.validate)
+4. Chỉ publish model INT8 khi mAP50 giảm không quá MAX_MAP50_DROP
+5. Benchmark latency FP32 vs INT8 trên CPU
+"""
+
+import json
+import os
+import random
+import sys
+from datetime import datetime
+from pathlib import Path
+
+import cv2
+import numpy as np
+import yaml
+
+from model_training_optimized import OptimizedTrainer
+
+BACKEND_DIR = Path(__file__).resolve().parent.parent / "backend"
+sys.path.insert(0, str(BACKEND_DIR))
+
+from inference import exported_model_path, export_model, list_images  # noqa: E402
+
+
+class CalibrationReader:
+    """
+    CalibrationDataReader cho ONNX Runtime: ảnh calibration đã letterbox (1, 3, imgsz, imgsz) float32 RGB / 255
+    """
+
+    def __init__(self, image_paths, input_name, imgsz=640):
+        from ultralytics.data.augment import LetterBox
+
+        self.image_paths = list(image_paths)
+        self.input_name = input_name
+        self.letterbox = LetterBox(new_shape=(imgsz, imgsz), auto=False)
+        self._iter = iter(self.image_paths)
+
+    def preprocess(self, image_path):
+        img_bgr = cv2.imread(str(image_path))
+        if img_bgr is None:
+            return None
+        img = self.letterbox(image=img_bgr)
+        img = img[..., ::-1].transpose(2, 0, 1)  # BGR HWC -> RGB CHW
+        return np.ascontiguousarray(img[None], dtype=np.float32) / 255.0
+
+    def get_next(self):
+        for image_path in self._iter:
+            tensor = self.preprocess(image_path)
+            if tensor is not None:
+                return {self.input_name: tensor}
+        return None
+
+    def rewind(self):
+        self._iter = iter(self.image_paths)
+
+
+class INT8Quantizer:
+    def __init__(self, model_path, yaml_config_path, imgsz=640, work_dir="quantization"):
+        """
+        model_path: best.pt
+        yaml_config_path: data.yaml của dataset (dùng tập val để validate)
+        imgsz: kích thước input (phải giống INFERENCE_IMGSZ của backend)
+        work_dir: thư mục chứa file trung gian (subset val, model candidate)
+        """
+        self.model_path = Path(model_path)
+        self.yaml_config = yaml_config_path
+        self.imgsz = imgsz
+        self.work_dir = Path(work_dir)
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+
+        self.fp32_path = None
+        self.int8_path = exported_model_path(self.model_path, "onnx-int8", imgsz)
+
+    def export_fp32(self):
+        """Export ONNX FP32 (dùng lại file cache nếu đã có)"""
+        print(f"\n📦 Export FP32: {self.model_path}")
+        self.fp32_path = export_model(self.model_path, "onnx", self.imgsz)
+        print(f"✓ {self.fp32_path}")
+        return self.fp32_path
+
+    def quantize(self, calibration_folder, num_calibration=200, seed=0):
+        """
+        Static quantization (QDQ, weights per-channel INT8, activations UINT8)
+        Chỉ quantize Conv/MatMul: phần decode boxes + concat ở head giữ FP32 để không lệch tọa độ
+
+        Returns:
+        - candidate_path: model INT8 chưa publish
+        """
+        try:
+            import onnx
+            from onnxruntime.quantization import CalibrationMethod, QuantFormat, QuantType, quantize_static
+            from onnxruntime.quantization.shape_inference import quant_pre_process
+        except ImportError:
+            raise RuntimeError("Quantization cần cài onnx và onnxruntime (pip install onnx onnxruntime)")
+
+        images = list_images(calibration_folder)
+        if not images:
+            raise FileNotFoundError(f"Không có ảnh calibration trong: {calibration_folder}")
+        random.Random(seed).shuffle(images)
+        images = images[:num_calibration]
+
+        print(f"\n⚙️  Calibration: {len(images)} ảnh từ {calibration_folder}")
+
+        fp32_model = onnx.load(str(self.fp32_path))
+        input_name = fp32_model.graph.input[0].name
+
+        # Shape inference + fold constants trước khi quantize (khuyến nghị của ONNX Runtime)
+        prepared_path = self.work_dir / f"{self.fp32_path.stem}_prepared.onnx"
+        try:
+            quant_pre_process(str(self.fp32_path), str(prepared_path))
+        except Exception as e:
+            print(f"⚠️  Pre-process failed, quantize trực tiếp: {e}")
+            prepared_path = self.fp32_path
+
+        candidate_path = self.work_dir / self.int8_path.name
+        quantize_static(
+            str(prepared_path),
+            str(candidate_path),
+            CalibrationReader(images, input_name, self.imgsz),
+            quant_format=QuantFormat.QDQ,
+            op_types_to_quantize=["Conv", "MatMul"],
+            per_channel=True,
+            activation_type=QuantType.QUInt8,
+            weight_type=QuantType.QInt8,
+            calibrate_method=CalibrationMethod.MinMax
+        )
+
+        # Giữ metadata của ultralytics (names, stride, imgsz) để YOLO load được model INT8
+        int8_model = onnx.load(str(candidate_path))
+        existing = {prop.key for prop in int8_model.metadata_props}
+        for prop in fp32_model.metadata_props:
+            if prop.key not in existing:
+                int8_model.metadata_props.add(key=prop.key, value=prop.value)
+        onnx.save(int8_model, str(candidate_path))
+
+        size_fp32 = self.fp32_path.stat().st_size / 1e6
+        size_int8 = candidate_path.stat().st_size / 1e6
+        print(f"✓ INT8 candidate: {candidate_path} ({size_fp32:.1f}MB -> {size_int8:.1f}MB)")
+        return candidate_path
+
+    def make_val_subset(self, num_images=500, seed=0):
+        """
+        data.yaml mới với tập val là subset ngẫu nhiên num_images ảnh (None = toàn bộ tập val)
+        """
+        with open(self.yaml_config, 'r') as f:
+            config = yaml.safe_load(f)
+        if not num_images:
+            return self.yaml_config
+
+        val_path = Path(config['val'])
+        if not val_path.is_absolute():
+            val_path = Path(config['path']) / val_path
+        images = list_images(val_path)
+        if not images:
+            raise FileNotFoundError(f"Không có ảnh val trong: {val_path}")
+        random.Random(seed).shuffle(images)
+        images = sorted(images[:num_images])
+
+        list_path = self.work_dir / "val_subset.txt"
+        list_path.write_text("\n".join(str(p.resolve()) for p in images) + "\n")
+
+        config['val'] = str(list_path.resolve())
+        subset_yaml = self.work_dir / "data_val_subset.yaml"
+        with open(subset_yaml, 'w') as f:
+            yaml.safe_dump(config, f, allow_unicode=True)
+
+        print(f"\n📊 Validation subset: {len(images)} ảnh ({subset_yaml})")
+        return str(subset_yaml)
+
+    def validate(self, data_yaml, candidate_path):
+        """
+        mAP50 của FP32 và INT8 trên cùng tập val (cùng backend ONNX Runtime, cùng letterbox,
+        cùng imgsz cố định của model export)
+
+        Returns:
+        - (map50_fp32, map50_int8)
+        """
+        trainer = OptimizedTrainer(yaml_config_path=data_yaml)
+
+        print("\n" + "="*70)
+        print("🎯 VALIDATION FP32")
+        print("="*70)
+        map50_fp32 = float(trainer.validate(str(self.fp32_path), imgsz=self.imgsz).box.map50)
+
+        print("\n" + "="*70)
+        print("🎯 VALIDATION INT8")
+        print("="*70)
+        map50_int8 = float(trainer.validate(str(candidate_path), imgsz=self.imgsz).box.map50)
+
+        return map50_fp32, map50_int8
+
+    def publish(self, candidate_path, report):
+        """Chuyển model INT8 vào cạnh best.pt (backend onnx-int8 load được) + ghi report"""
+        os.replace(candidate_path, self.int8_path)
+        report_path = self.int8_path.with_suffix(".json")
+        with open(report_path, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"✅ Published: {self.int8_path}")
+        print(f"📝 Report: {report_path}")
+
+    def run(self, calibration_folder, num_calibration=200, val_images=500, max_map50_drop=0.01):
+        """
+        Export -> quantize -> validate -> publish nếu qua accuracy gate
+
+        Returns:
+        - report: dict (mAP50 FP32/INT8, drop, published)
+        """
+        self.export_fp32()
+        candidate_path = self.quantize(calibration_folder, num_calibration)
+        data_yaml = self.make_val_subset(val_images)
+        map50_fp32, map50_int8 = self.validate(data_yaml, candidate_path)
+
+        drop = map50_fp32 - map50_int8
+        report = {
+            "source": str(self.model_path),
+            "imgsz": self.imgsz,
+            "calibration_images": num_calibration,
+            "val_images": val_images,
+            "map50_fp32": round(map50_fp32, 4),
+            "map50_int8": round(map50_int8, 4),
+            "map50_drop": round(drop, 4),
+            "max_map50_drop": max_map50_drop,
+            "published": round(drop, 4) <= max_map50_drop,
+            "created_at": datetime.now().isoformat(timespec="seconds")
+        }
+
+        print("\n" + "="*70)
+        print("📈 ACCURACY GATE")
+        print("="*70)
+        print(f"📊 mAP50 FP32: {map50_fp32:.4f}")
+        print(f"📊 mAP50 INT8: {map50_int8:.4f}")
+        print(f"📉 Drop:       {drop:.4f} (max {max_map50_drop:.4f})")
+
+        # Report của lần chạy luôn được ghi trong work_dir (kể cả khi không publish)
+        with open(self.work_dir / "quantization_report.json", 'w') as f:
+            json.dump(report, f, indent=2)
+
+        if report["published"]:
+            self.publish(candidate_path, report)
+        else:
+            print(f"❌ mAP50 giảm quá mức cho phép -> KHÔNG publish (candidate: {candidate_path})")
+        print("="*70)
+
+        return report
+
+
+# ============================================================
+# MAIN
+# ============================================================
+if __name__ == "__main__":
+    print("\n" + "="*70)
+    print("INT8 POST-TRAINING QUANTIZATION")
+    print("="*70)
+    print(f"Start: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("="*70)
+
+    # ========================================
+    # CONFIG
+    # ========================================
+    MODEL_PATH = "../best.pt"
+    YAML_CONFIG = "yolo_balanced_data/data.yaml"
+    CALIBRATION_FOLDER = "yolo_balanced_data/images/train"  # Ảnh đại diện cho dữ liệu thật
+
+    IMAGE_SIZE = 640          # Giống INFERENCE_IMGSZ của backend
+    NUM_CALIBRATION = 200     # 100-500 ảnh là đủ cho MinMax calibration
+    VAL_IMAGES = 500          # Subset val cho accuracy gate (None = toàn bộ tập val)
+    MAX_MAP50_DROP = 0.01     # mAP50 giảm tối đa (tuyệt đối) để được publish
+
+    # ========================================
+
+    for path in (MODEL_PATH, YAML_CONFIG, CALIBRATION_FOLDER):
+        if not Path(path).exists():
+            print(f"\n❌ Not found: '{path}'")
+            exit(1)
+
+    quantizer = INT8Quantizer(MODEL_PATH, YAML_CONFIG, imgsz=IMAGE_SIZE)
+    report = quantizer.run(
+        CALIBRATION_FOLDER,
+        num_calibration=NUM_CALIBRATION,
+        val_images=VAL_IMAGES,
+        max_map50_drop=MAX_MAP50_DROP
+    )
+
+    if not report["published"]:
+        exit(1)
+
+    # Benchmark FP32 vs INT8 trên CPU (latency, throughput, độ khớp boxes)
+    print("\n" + "="*70)
+    print("⚡ BENCHMARK FP32 vs INT8 (CPU)")
+    print("="*70)
+    from benchmark import bench_backends
+    bench_backends(MODEL_PATH, ["onnx", "onnx-int8"], IMAGE_SIZE, CALIBRATION_FOLDER,
+                   count=16, batch_size=8, repeat=10)
+
+    print("\n📌 NEXT:")
+    print("   INFERENCE_BACKEND=onnx-int8 python app.py")
+    print("="*70)
+    print(f"End: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    print("="*70)
@@ -1,10 +1,13 @@
 import React, { useRef, useEffect, useState, useCallback } from 'react';
-import { detectObjects, detectVideoFrame, resetTrackingSession } from '../services/api';
+import { detectObjects, detectVideoFrame, resetTrackingSession, openTrackingSocket } from '../services/api';
 import { audioService } from '../services/audioService';
 import { t } from '../utils/translations';
 import { translateClass, capitalizeFirst } from '../utils/classTranslations';
 import ResultsTable from './ResultsTable';
 
+// Thời gian tối đa chờ kết quả 1 frame gửi qua WebSocket trước khi gửi frame tiếp theo
+const SOCKET_FRAME_TIMEOUT_MS = 5000;
+
 const CameraView = ({ isActive, onClose }) => {
   const videoRef = useRef(null);
   const canvasRef = useRef(null);
@@ -19,6 +22,13 @@ const CameraView = ({ isActive, onClose }) => {
   const isDetectingRef = useRef(false); // Dùng ref để tránh stale closure
   const skippedFramesRef = useRef(0); // Track skipped frames
   
+  // WebSocket tracking: null khi chưa kết nối/mất kết nối -> gửi frame qua HTTP
+  const socketRef = useRef(null);
+  const socketReadyRef = useRef(false);
+  const frameTimeoutRef = useRef(null);
+  const frameStartRef = useRef(0);
+  const handleTrackingResultRef = useRef(() => {});
+  
   // Audio feedback timer (hiện không dùng cooldown phức tạp, nhưng vẫn giữ ref để dễ mở rộng sau)
   const audioCooldownTimerRef = useRef(null);
   
@@ -165,6 +175,129 @@ const CameraView = ({ isActive, onClose }) => {
     }
   }, [isAudioEnabled]);
 
+  // Cập nhật tracks / detections / audio từ kết quả tracking của 1 frame (HTTP hoặc WebSocket)
+  const handleTrackingResult = useCallback((result, startTime) => {
+    const endTime = performance.now();
+    const detectionTime = endTime - startTime;
+    
+    // Update detection rate
+    setDetectionRate(prev => {
+      const newRate = Math.round(1000 / detectionTime);
+      return Math.floor((prev * 0.7) + (newRate * 0.3)); // Moving average
+    });
+    
+    if (result && result.tracks && result.tracks.length > 0) {
+      // Update active tracks map
+      setActiveTracks(prev => {
+        const newTracksMap = new Map(prev);
+        
+        // Update với tracks mới
+        const currentTrackIds = new Set();
+        result.tracks.forEach(track => {
+          const trackId = track.track_id;
+          currentTrackIds.add(trackId);
+          newTracksMap.set(trackId, {
+            ...track,
+            last_seen: Date.now()
+          });
+        });
+        
+        // Remove old tracks (không xuất hiện trong frame này)
+        // Giữ lại tracks không xuất hiện < 2 giây (có thể bị tạm thời che khuất)
+        const now = Date.now();
+        for (const [id, track] of newTracksMap.entries()) {
+          if (!currentTrackIds.has(id)) {
+            if (now - track.last_seen > 2000) {
+              newTracksMap.delete(id);
+            }
+          }
+        }
+        
+        return newTracksMap;
+      });
+      
+      // Convert tracks to detections format cho backward compatibility
+      const detectionsForDisplay = result.tracks.map(t => ({
+        id: t.track_id,
+        class: t.class,
+        class_id: t.class_id,
+        confidence: t.confidence,
+        bbox: t.bbox,
+        width: t.bbox[2] - t.bbox[0],
+        height: t.bbox[3] - t.bbox[1],
+        track_id: t.track_id,
+        is_new: t.is_new
+      }));
+      setLastDetections(detectionsForDisplay);
+      
+      // AUDIO LOGIC MỚI DỰA TRÊN TRACKING:
+      // 1. Lọc ra các track MỚI (chưa từng được đọc)
+      const newTracks = result.tracks.filter(t => !announcedTrackIdsRef.current.has(t.track_id));
+      
+      if (newTracks.length > 0) {
+        // Nếu audio đang bận đọc nhóm trước → KHÔNG đánh dấu đã đọc, đợi lần sau khi audio rảnh
+        if (!audioService.isAnnouncingObjects && audioService.scheduledTimeouts.length === 0) {
+          // 2. Convert tracks mới sang format detections cho audio
+          const newDetections = newTracks.map(t => ({
+            class: t.class,
+            confidence: t.confidence,
+            bbox: t.bbox
+          }));
+
+          // 3. Phát audio CHỈ cho đối tượng mới
+          handleCameraAudioFeedback(newDetections);
+
+          // 4. Đánh dấu các track_id này là đã được đọc
+          newTracks.forEach(t => {
+            announcedTrackIdsRef.current.add(t.track_id);
+          });
+        }
+      }
+
+      // 5. Cleanup: nếu track_id không còn trong frame hiện tại → xóa khỏi danh sách đã đọc
+      const currentTrackIds = new Set(result.tracks.map(t => t.track_id));
+      announcedTrackIdsRef.current.forEach(id => {
+        if (!currentTrackIds.has(id)) {
+          announcedTrackIdsRef.current.delete(id);
+        }
+      });
+    } else {
+      // Không có tracks
+      setLastDetections([]);
+      // Clear old tracks sau 2 giây
+      setActiveTracks(prev => {
+        const newMap = new Map();
+        const now = Date.now();
+        for (const [id, track] of prev.entries()) {
+          if (now - track.last_seen < 2000) {
+            newMap.set(id, track);
+          }
+        }
+        return newMap;
+      });
+      
+      // Clear audio cooldown (nếu có)
+      if (audioCooldownTimerRef.current) {
+        clearTimeout(audioCooldownTimerRef.current);
+        audioCooldownTimerRef.current = null;
+      }
+    }
+  }, [handleCameraAudioFeedback]);
+
+  // Socket callbacks và interval giữ ref tới handler mới nhất (tránh stale closure)
+  handleTrackingResultRef.current = handleTrackingResult;
+
+  // Frame gửi qua WebSocket đã có kết quả (hoặc lỗi/timeout) -> cho phép gửi frame tiếp theo
+  const finishSocketFrame = useCallback(() => {
+    if (frameTimeoutRef.current) {
+      clearTimeout(frameTimeoutRef.current);
+      frameTimeoutRef.current = null;
+    }
+    isDetectingRef.current = false;
+    setIsDetecting(false);
+    abortControllerRef.current = null;
+  }, []);
+
   const stopCamera = useCallback(() => {
     // Cancel pending request
     if (abortControllerRef.current) {
@@ -205,7 +338,18 @@ const CameraView = ({ isActive, onClose }) => {
       videoRef.current.srcObject = null;
     }
 
-    // Reset tracking session ở backend để cleanup
+    // Đóng WebSocket tracking (frame đang chờ kết quả bị bỏ)
+    if (socketRef.current) {
+      socketRef.current.close();
+      socketRef.current = null;
+    }
+    socketReadyRef.current = false;
+    if (frameTimeoutRef.current) {
+      clearTimeout(frameTimeoutRef.current);
+      frameTimeoutRef.current = null;
+    }
+
+    // Reset tracking session ở backend để cleanup (server xếp reset sau frame đang xử lý)
     if (sessionId) {
       resetTrackingSession(sessionId).catch(err => {
         // Ignore errors khi cleanup session (có thể session đã bị cleanup tự động)
@@ -314,6 +458,16 @@ const CameraView = ({ isActive, onClose }) => {
             return;
           }
 
+          // Ưu tiên gửi qua WebSocket; kết quả về qua onTracks, frame tiếp theo chờ tới khi có kết quả hoặc timeout
+          const trackingSocket = socketRef.current;
+          if (trackingSocket && socketReadyRef.current) {
+            frameStartRef.current = startTime;
+            if (await trackingSocket.sendFrame(blob)) {
+              frameTimeoutRef.current = setTimeout(finishSocketFrame, SOCKET_FRAME_TIMEOUT_MS);
+              return;
+            }
+          }
+
           try {
             // Tạo File object từ blob
             const file = new File([blob], `frame_${Date.now()}.jpg`, { type: 'image/jpeg' });
@@ -326,111 +480,12 @@ const CameraView = ({ isActive, onClose }) => {
               return;
             }
             
-            const endTime = performance.now();
-            const detectionTime = endTime - startTime;
-            
-            // Update detection rate
-            setDetectionRate(prev => {
-              const newRate = Math.round(1000 / detectionTime);
-              return Math.floor((prev * 0.7) + (newRate * 0.3)); // Moving average
-            });
-            
-            if (result && result.tracks && result.tracks.length > 0) {
-              // Update active tracks map
-              setActiveTracks(prev => {
-                const newTracksMap = new Map(prev);
-                
-                // Update với tracks mới
-                const currentTrackIds = new Set();
-                result.tracks.forEach(track => {
-                  const trackId = track.track_id;
-                  currentTrackIds.add(trackId);
-                  newTracksMap.set(trackId, {
-                    ...track,
-                    last_seen: Date.now()
-                  });
-                });
-                
-                // Remove old tracks (không xuất hiện trong frame này)
-                // Giữ lại tracks không xuất hiện < 2 giây (có thể bị tạm thời che khuất)
-                const now = Date.now();
-                for (const [id, track] of newTracksMap.entries()) {
-                  if (!currentTrackIds.has(id)) {
-                    if (now - track.last_seen > 2000) {
-                      newTracksMap.delete(id);
-                    }
-                  }
-                }
-                
-                return newTracksMap;
-              });
-              
-              // Convert tracks to detections format cho backward compatibility
-              const detectionsForDisplay = result.tracks.map(t => ({
-                id: t.track_id,
-                class: t.class,
-                class_id: t.class_id,
-                confidence: t.confidence,
-                bbox: t.bbox,
-                width: t.bbox[2] - t.bbox[0],
-                height: t.bbox[3] - t.bbox[1],
-                track_id: t.track_id,
-                is_new: t.is_new
-              }));
-              setLastDetections(detectionsForDisplay);
-              
-              // AUDIO LOGIC MỚI DỰA TRÊN TRACKING:
-              // 1. Lọc ra các track MỚI (chưa từng được đọc)
-              const newTracks = result.tracks.filter(t => !announcedTrackIdsRef.current.has(t.track_id));
-              
-              if (newTracks.length > 0) {
-                // Nếu audio đang bận đọc nhóm trước → KHÔNG đánh dấu đã đọc, đợi lần sau khi audio rảnh
-                if (!audioService.isAnnouncingObjects && audioService.scheduledTimeouts.length === 0) {
-                  // 2. Convert tracks mới sang format detections cho audio
-                  const newDetections = newTracks.map(t => ({
-                    class: t.class,
-                    confidence: t.confidence,
-                    bbox: t.bbox
-                  }));
-
-                  // 3. Phát audio CHỈ cho đối tượng mới
-                  handleCameraAudioFeedback(newDetections);
-
-                  // 4. Đánh dấu các track_id này là đã được đọc
-                  newTracks.forEach(t => {
-                    announcedTrackIdsRef.current.add(t.track_id);
-                  });
-                }
-              }
-
-              // 5. Cleanup: nếu track_id không còn trong frame hiện tại → xóa khỏi danh sách đã đọc
-              const currentTrackIds = new Set(result.tracks.map(t => t.track_id));
-              announcedTrackIdsRef.current.forEach(id => {
-                if (!currentTrackIds.has(id)) {
-                  announcedTrackIdsRef.current.delete(id);
-                }
-              });
-            } else {
-              // Không có tracks
-              setLastDetections([]);
-              // Clear old tracks sau 2 giây
-              setActiveTracks(prev => {
-                const newMap = new Map();
-                const now = Date.now();
-                for (const [id, track] of prev.entries()) {
-                  if (now - track.last_seen < 2000) {
-                    newMap.set(id, track);
-                  }
-                }
-                return newMap;
-              });
-              
-              // Clear audio cooldown (nếu có)
-              if (audioCooldownTimerRef.current) {
-                clearTimeout(audioCooldownTimerRef.current);
-                audioCooldownTimerRef.current = null;
-              }
+            // Frame bị server bỏ qua (đã có frame mới hơn của session) -> giữ nguyên tracks hiện tại
+            if (result?.dropped) {
+              return;
             }
+            
+            handleTrackingResultRef.current(result, startTime);
           } catch (err) {
             // Ignore canceled errors
             if (err.message === 'Request canceled' || abortController.signal.aborted) {
@@ -457,7 +512,7 @@ const CameraView = ({ isActive, onClose }) => {
       setIsDetecting(false);
       abortControllerRef.current = null;
     }
-  }, [isStreaming]);
+  }, [isStreaming, finishSocketFrame]);
 
   // Effect để quản lý camera lifecycle
   useEffect(() => {
@@ -472,6 +527,48 @@ const CameraView = ({ isActive, onClose }) => {
     };
   }, [isActive, startCamera, stopCamera]);
 
+  // WebSocket tracking: 1 kết nối cho cả lúc camera chạy thay vì 1 POST mỗi frame
+  // Chưa kết nối được / mất kết nối -> captureAndDetect quay lại gửi HTTP
+  useEffect(() => {
+    if (!isActive || !isStreaming) {
+      return undefined;
+    }
+
+    const trackingSocket = openTrackingSocket(sessionId, {
+      onReady: () => {
+        socketReadyRef.current = true;
+      },
+      onTracks: (message) => {
+        handleTrackingResultRef.current(message, frameStartRef.current);
+        finishSocketFrame();
+      },
+      onDropped: () => {
+        // Frame bị server bỏ -> giữ nguyên tracks hiện tại, gửi frame tiếp theo ngay
+        finishSocketFrame();
+      },
+      onError: (err) => {
+        console.warn('Tracking socket error:', err.message);
+        finishSocketFrame();
+      },
+      onClose: () => {
+        if (socketRef.current === trackingSocket) {
+          socketRef.current = null;
+          socketReadyRef.current = false;
+          finishSocketFrame();
+        }
+      },
+    }, 0.25, 0.45);
+    socketRef.current = trackingSocket;
+
+    return () => {
+      if (socketRef.current === trackingSocket) {
+        socketRef.current = null;
+        socketReadyRef.current = false;
+      }
+      trackingSocket.close();
+    };
+  }, [isActive, isStreaming, sessionId, finishSocketFrame]);
+
   // Effect để bắt đầu detection loop với frame skipping
   useEffect(() => {
     if (isActive && isStreaming) {
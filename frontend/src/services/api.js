@@ -90,13 +90,15 @@ export const detectVideoFrame = async (
   confThreshold = 0.25, 
   iouThreshold = 0.45,
   sessionId = null,
-  signal = null
+  signal = null,
+  render = 'none' // Camera tự vẽ boxes từ tracks, không cần ảnh base64 từ server
 ) => {
   try {
     const formData = new FormData();
     formData.append('file', file);
     formData.append('conf_threshold', confThreshold);
     formData.append('iou_threshold', iouThreshold);
+    formData.append('render', render);
     if (sessionId) {
       formData.append('session_id', sessionId);
     }
@@ -146,6 +148,82 @@ export const resetTrackingSession = async (sessionId) => {
   }
 };
 
+// WebSocket tracking: 1 kết nối cho cả session camera thay vì 1 POST multipart mỗi frame
+// Mỗi frame gửi đi = 4 byte sequence number (uint32 big-endian) + JPEG bytes
+export const openTrackingSocket = (
+  sessionId,
+  { onTracks, onError, onReady, onReset, onDropped, onClose } = {},
+  confThreshold = 0.25,
+  iouThreshold = 0.45
+) => {
+  const wsBaseUrl = API_BASE_URL.replace(/^http/, 'ws');
+  const params = new URLSearchParams({
+    conf_threshold: confThreshold,
+    iou_threshold: iouThreshold,
+  });
+  if (sessionId) {
+    params.append('session_id', sessionId);
+  }
+
+  const socket = new WebSocket(`${wsBaseUrl}/ws/track?${params.toString()}`);
+  socket.binaryType = 'arraybuffer';
+  let fields = null;
+  let seq = 0;
+
+  socket.onmessage = (event) => {
+    const message = JSON.parse(event.data);
+    if (message.type === 'ready') {
+      fields = message.fields;
+      if (onReady) onReady(message);
+    } else if (message.type === 'tracks') {
+      // Chuyển mảng compact về dạng object giống response của /api/detect-video
+      const tracks = message.tracks.map((row) => {
+        const track = Object.fromEntries(fields.map((field, i) => [field, row[i]]));
+        return {
+          track_id: track.track_id,
+          class_id: track.class_id,
+          class: track.class,
+          confidence: track.confidence,
+          bbox: [track.x1, track.y1, track.x2, track.y2],
+          is_new: Boolean(track.is_new),
+        };
+      });
+      if (onTracks) onTracks({ ...message, tracks });
+    } else if (message.type === 'dropped') {
+      // Server bỏ frame (đã có frame mới hơn của session hoặc session vừa reset)
+      if (onDropped) onDropped(message);
+    } else if (message.type === 'reset') {
+      if (onReset) onReset(message);
+    } else if (message.type === 'error' && onError) {
+      onError(new Error(message.detail), message);
+    }
+  };
+  socket.onerror = () => {
+    if (onError) onError(new Error('WebSocket connection error.'));
+  };
+  socket.onclose = () => {
+    if (onClose) onClose();
+  };
+
+  return {
+    socket,
+    sendFrame: async (blob) => {
+      if (socket.readyState !== WebSocket.OPEN) return false;
+      seq += 1;
+      const header = new Uint8Array(4);
+      new DataView(header.buffer).setUint32(0, seq, false);
+      socket.send(new Blob([header, blob]));
+      return true;
+    },
+    reset: () => {
+      if (socket.readyState === WebSocket.OPEN) {
+        socket.send(JSON.stringify({ type: 'reset' }));
+      }
+    },
+    close: () => socket.close(),
+  };
+};
+
 export const compareThresholds = async (file, thresholds = [0.1, 0.25, 0.5, 0.75]) => {
   try {
     const formData = new FormData();
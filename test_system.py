@@ -221,6 +221,1666 @@ def test_tracking_pipeline():
         return False
 
 
+def test_vectorized_association():
+    """Test IoU/cost matrix vectorized khớp với cách tính từng cặp"""
+    print("=" * 60)
+    print("🧪 TEST 6: Vectorized Association")
+    print("=" * 60)
+    
+    try:
+        from deepsort import DeepSortTracker, Track, iou_batch
+        import numpy as np
+        
+        rng = np.random.default_rng(0)
+        xy = rng.uniform(0, 500, (40, 2))
+        wh = rng.uniform(10, 120, (40, 2))
+        boxes = np.hstack([xy, xy + wh]).astype(np.float32)
+        dets, trks = boxes[:25], boxes[25:]
+        
+        tracker = DeepSortTracker()
+        iou_matrix = iou_batch(dets, trks)
+        expected = np.array([[tracker._compute_iou(d, t) for t in trks] for d in dets])
+        assert iou_matrix.shape == (25, 15), f"Expected shape (25, 15), got {iou_matrix.shape}"
+        assert np.allclose(iou_matrix, expected, atol=1e-6), "IoU matrix mismatch"
+        print("✅ iou_batch matches pairwise IoU")
+        
+        features = rng.random((40, 128)).astype(np.float32)
+        features /= np.linalg.norm(features, axis=1, keepdims=True)
+        detections = [{'bbox': b.tolist(), 'class': 'person', 'class_id': 0, 'confidence': 0.9} for b in boxes]
+        tracker.tracks = [Track(detections[25 + j], features[25 + j], j + 1, kalman=tracker.kalman) for j in range(15)]
+        cost = tracker._compute_cost_matrix(detections[:25], features[:25])
+        expected_cost = np.array([
+            [0.5 * (1 - tracker._compute_iou(detections[i]['bbox'], t.get_state())) + 0.5 * (1 - np.dot(features[i], t.feature))
+             for t in tracker.tracks]
+            for i in range(25)
+        ])
+        assert np.allclose(cost, expected_cost, atol=1e-5), "Cost matrix mismatch"
+        print("✅ cost matrix matches pairwise computation")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Vectorized association test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_batch_kalman_filter():
+    """Test BatchKalmanFilter cho kết quả giống KalmanBoxTracker"""
+    print("=" * 60)
+    print("🧪 TEST 7: Batched Kalman Filter")
+    print("=" * 60)
+    
+    try:
+        from deepsort import BatchKalmanFilter, KalmanBoxTracker
+        import numpy as np
+        
+        rng = np.random.default_rng(1)
+        xy = rng.uniform(0, 500, (20, 2))
+        wh = rng.uniform(10, 120, (20, 2))
+        boxes = np.hstack([xy, xy + wh])
+        
+        singles = [KalmanBoxTracker(b) for b in boxes]
+        batch = BatchKalmanFilter(capacity=4)
+        batch.add(boxes)
+        assert len(batch) == 20, f"Expected 20 rows, got {len(batch)}"
+        
+        for step in range(10):
+            for kf in singles:
+                kf.predict()
+            batch.predict()
+            
+            # Chỉ update một phần tracks mỗi frame
+            idx = rng.choice(20, size=12, replace=False)
+            measured = boxes[idx] + rng.normal(0, 3, (12, 4)) + step * 2
+            for i, b in zip(idx, measured):
+                singles[i].update(b)
+            batch.update(idx, measured)
+        
+        expected = np.stack([kf.get_state() for kf in singles])
+        assert np.allclose(batch.get_states(), expected, atol=1e-3), "State mismatch"
+        assert np.allclose(batch.P, np.stack([kf.kf.P for kf in singles]), rtol=1e-6, atol=1e-6), "Covariance mismatch"
+        print("✅ predict/update khớp với KalmanBoxTracker")
+        
+        batch.keep([3, 1])
+        assert len(batch) == 2 and np.allclose(batch.get_states(), expected[[3, 1]], atol=1e-3)
+        print("✅ keep (compact) giữ đúng thứ tự rows")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Batched Kalman test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_batched_feature_extractor():
+    """Test FeatureExtractor batched: đúng layout và không phụ thuộc thứ tự kênh"""
+    print("=" * 60)
+    print("🧪 TEST 8: Batched Feature Extractor")
+    print("=" * 60)
+    
+    try:
+        from deepsort import FeatureExtractor
+        import numpy as np
+        import cv2
+        
+        rng = np.random.default_rng(2)
+        frame_rgb = rng.integers(0, 256, (240, 320, 3), dtype=np.uint8)
+        frame_bgr = np.ascontiguousarray(frame_rgb[..., ::-1])
+        detections = [
+            {'bbox': [10, 20, 80, 200]},
+            {'bbox': [-15, -5, 40, 60]},       # Vượt ra ngoài frame
+            {'bbox': [300, 200, 400, 300]},
+        ]
+        
+        extractor = FeatureExtractor()
+        features = extractor.extract(detections, frame_rgb)
+        assert features.shape == (3, 128), f"Expected shape (3, 128), got {features.shape}"
+        assert np.allclose(extractor.extract(detections, frame_bgr, channel_order='BGR'), features)
+        print("✅ RGB và BGR cho cùng features")
+        
+        # Layout: [hist B, hist G, hist R] của crop resize (64, 128), phần còn lại là padding
+        crop = cv2.resize(frame_bgr[20:200, 10:80], (64, 128))
+        hist_b = cv2.calcHist([crop], [0], None, [32], [0, 256]).flatten()
+        assert np.allclose(features[0, :32] / features[0, :32].sum(), hist_b / hist_b.sum(), atol=1e-6)
+        assert np.all(features[:, 96:] == 0)
+        assert np.allclose(np.linalg.norm(features, axis=1), 1, atol=1e-4)
+        print("✅ Histogram layout giữ nguyên")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Feature extractor test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_detection_stride():
+    """Test detection stride: frame bỏ qua chỉ Kalman-propagate, không tính là miss"""
+    print("=" * 60)
+    print("🧪 TEST 9: Detection Stride")
+    print("=" * 60)
+    
+    try:
+        from deepsort import DeepSortTracker
+        import numpy as np
+        
+        frame = np.zeros((240, 320, 3), dtype=np.uint8)
+        tracker = DeepSortTracker()
+        for i in range(4):
+            x = 50 + 4 * i
+            tracker.update([{'bbox': [x, 60, x + 40, 140], 'class': 'person', 'class_id': 0, 'confidence': 0.9}], frame)
+        track = tracker.tracks[0]
+        counters = (track.time_since_update, track.hit_streak, track.age)
+        before = track.get_state().copy()
+        
+        tracker.predict_only()
+        after = track.get_state()
+        assert (track.time_since_update, track.hit_streak, track.age) == counters
+        assert after[0] > before[0], "Prediction phải tiếp tục theo velocity"
+        print("✅ predict_only advance Kalman, giữ nguyên counters")
+        
+        # Optical flow shift thay thế vị trí dự đoán
+        center = (track.get_state()[:2] + track.get_state()[2:]) / 2
+        tracker.predict_only(np.array([[10.0, -5.0]]))
+        new_center = (track.get_state()[:2] + track.get_state()[2:]) / 2
+        assert np.allclose(new_center - center, [10.0, -5.0], atol=1e-3)
+        print("✅ Optical flow shift áp dụng lên tâm box")
+    except Exception as e:
+        print(f"❌ Detection stride test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+    
+    try:
+        from tracker import VideoTracker
+    except ImportError as e:
+        print(f"⚠️  Skipping VideoTracker stride test: {e}")
+        print()
+        return True
+    
+    try:
+        class _Coords:
+            def __init__(self, values):
+                self.values = np.array(values, dtype=np.float32)
+            def cpu(self):
+                return self
+            def numpy(self):
+                return self.values
+        
+        class _Boxes:
+            def __init__(self, bbox):
+                self.data = _Coords([bbox + [0.9, 0]])
+            def __len__(self):
+                return len(self.data.values)
+        
+        class _Result:
+            def __init__(self, bbox):
+                self.boxes = _Boxes(bbox)
+        
+        class _Detector:
+            classes = {0: 'person'}
+        
+        video_tracker = VideoTracker(detector=_Detector(), detect_stride=3)
+        pattern = []
+        for i in range(12):
+            if video_tracker.should_detect():
+                x = 50 + 4 * i
+                _, _, tracks = video_tracker.track_result(_Result([x, 60, x + 40, 140]), frame, render=False)
+                pattern.append('D')
+            else:
+                _, _, tracks = video_tracker.propagate_frame(frame, render=False)
+                assert tracks and tracks[0]['predicted']
+                pattern.append('P')
+        assert ''.join(pattern) == 'DPPDPPDPPDPP', f"Unexpected pattern {''.join(pattern)}"
+        assert video_tracker.tracker.tracks[0].is_confirmed
+        print("✅ Fixed stride: YOLO mỗi 3 frame, track vẫn được confirm")
+        
+        adaptive = VideoTracker(detector=_Detector(), adaptive_stride=True, max_detect_stride=6)
+        for _ in range(6):
+            adaptive.track_result(_Result([100, 60, 140, 140]), frame, render=False)
+        assert adaptive.current_stride == 6, f"Đối tượng đứng yên phải dùng stride tối đa, got {adaptive.current_stride}"
+        print("✅ Adaptive stride tăng khi đối tượng đứng yên")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Detection stride test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_batch_engine():
+    """Test BatchEngine: predict theo batch, giữ thứ tự, bỏ qua ảnh lỗi"""
+    print("=" * 60)
+    print("🧪 TEST 10: Batch Engine")
+    print("=" * 60)
+    
+    try:
+        from batch_engine import BatchEngine, RunningSummary
+    except ImportError as e:
+        print(f"⚠️  Skipping Batch Engine test: {e}")
+        print()
+        return True
+    
+    try:
+        import numpy as np
+        import cv2
+        
+        class _Detector:
+            conf_threshold = 0.25
+            iou_threshold = 0.45
+            
+            def __init__(self):
+                self.batch_sizes = []
+            
+            def predict_batch(self, images, conf, iou):
+                self.batch_sizes.append(len(images))
+                return [int(image[0, 0, 0]) for image in images]
+        
+        sources = []
+        for i in range(10):
+            _, encoded = cv2.imencode('.png', np.full((8, 8, 3), i * 10, dtype=np.uint8))
+            sources.append((f"img_{i}.png", encoded.tobytes()))
+        sources.insert(3, ("broken.png", b"not an image"))
+        
+        detector = _Detector()
+        engine = BatchEngine(detector, batch_size=4, workers=2)
+        batches = list(engine.iter_batches(sources, postprocess=lambda item: item.result * 2))
+        
+        assert [len(b) for b in batches] == [4, 4, 3], f"Unexpected batches {[len(b) for b in batches]}"
+        assert detector.batch_sizes == [3, 4, 3], f"Unexpected predict sizes {detector.batch_sizes}"
+        items = [item for batch in batches for item in batch]
+        assert items[3].error is not None and items[3].output is None
+        outputs = [item.output for item in items if item.output is not None]
+        assert outputs == [i * 20 for i in range(10)], f"Unexpected outputs {outputs}"
+        print("✅ Batches đúng kích thước, giữ thứ tự input, ảnh lỗi được đánh dấu")
+        
+        summary = RunningSummary()
+        summary.add([{"class": "cat", "confidence": 0.5}, {"class": "dog", "confidence": 0.9}])
+        summary.add([])
+        summary.add([{"class": "cat", "confidence": 0.7}])
+        assert summary.to_dict() == {
+            "total_images": 3,
+            "images_with_detections": 2,
+            "total_detections": 3,
+            "class_distribution": {"cat": 2, "dog": 1},
+            "avg_confidence": 0.7
+        }, summary.to_dict()
+        print("✅ RunningSummary cộng dồn đúng")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Batch Engine test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_job_manager():
+    """Test JobManager: chạy job folder, ghi kết quả NDJSON và resume sau crash"""
+    print("=" * 60)
+    print("🧪 TEST 11: Job Manager")
+    print("=" * 60)
+    
+    try:
+        from jobs import JobManager
+    except ImportError as e:
+        print(f"⚠️  Skipping Job Manager test: {e}")
+        print()
+        return True
+    
+    try:
+        import json
+        import tempfile
+        import time
+        
+        class _Detector:
+            def iter_detect_folder(self, folder_path, batch_size=16, conf=None, iou=None,
+                                   skip=None, include_errors=False):
+                for img_path in sorted(Path(folder_path).iterdir()):
+                    if img_path.name in (skip or ()):
+                        continue
+                    yield {'image': img_path.name, 'num_detections': 1, 'classes': ['cat'],
+                           'confidences': [0.8], 'boxes': [[0, 0, 1, 1]]}
+        
+        def wait_finished(manager, job_id):
+            for _ in range(100):
+                job = manager.get(job_id)
+                if job['status'] in ('completed', 'failed', 'cancelled'):
+                    return job
+                time.sleep(0.02)
+            return manager.get(job_id)
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            root = Path(tmp) / "data"
+            (root / "cam").mkdir(parents=True)
+            for i in range(5):
+                (root / "cam" / f"frame_{i}.jpg").write_bytes(b"")
+            
+            manager = JobManager(_Detector(), jobs_dir=Path(tmp) / "jobs", folder_root=root)
+            job = wait_finished(manager, manager.create_folder_job("cam", 0.25, 0.45)['job_id'])
+            assert job['status'] == 'completed' and job['processed_images'] == 5, job
+            assert job['summary']['class_distribution'] == {'cat': 5}
+            print("✅ Job folder chạy xong, kết quả ghi ra NDJSON")
+            
+            try:
+                manager.create_folder_job("../", 0.25, 0.45)
+                raise AssertionError("Folder ngoài folder_root phải bị từ chối")
+            except PermissionError:
+                pass
+            print("✅ Folder ngoài folder_root bị từ chối")
+            
+            # Giả lập crash: job đang chạy, dòng cuối ghi dở
+            results_path = manager.results_path(job['job_id'])
+            lines = results_path.read_text().splitlines(keepends=True)
+            results_path.write_text("".join(lines[:2]) + lines[2][:10])
+            manifest_path = results_path.parent / "manifest.json"
+            manifest = json.loads(manifest_path.read_text())
+            manifest['status'] = 'running'
+            manifest_path.write_text(json.dumps(manifest))
+            
+            restarted = JobManager(_Detector(), jobs_dir=Path(tmp) / "jobs", folder_root=root)
+            assert restarted.resume() == 1
+            job = wait_finished(restarted, job['job_id'])
+            images = [json.loads(line)['image'] for line in results_path.read_text().splitlines()]
+            assert job['status'] == 'completed' and sorted(images) == [f"frame_{i}.jpg" for i in range(5)], images
+            print("✅ Resume sau restart không xử lý lại ảnh đã xong")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Job Manager test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_result_cache():
+    """Test ResultCache: LRU theo số entry/dung lượng, invalidate khi đổi model"""
+    print("=" * 60)
+    print("🧪 TEST 12: Result Cache")
+    print("=" * 60)
+    
+    try:
+        from result_cache import ResultCache
+        
+        cache = ResultCache(max_entries=2, max_bytes=1000)
+        key_a = cache.make_key(b"image-a", 0.25, 0.45, "v1", "none")
+        key_b = cache.make_key(b"image-b", 0.25, 0.45, "v1", "none")
+        key_c = cache.make_key(b"image-c", 0.25, 0.45, "v1", "none")
+        
+        assert cache.get(key_a) is None
+        cache.put(key_a, {"detections": []}, 100)
+        cache.put(key_b, {"detections": []}, 100)
+        assert cache.get(key_a) is not None          # a mới dùng -> b là LRU
+        assert cache.make_key(b"image-a", 0.25, 0.45, "v1", "full") != key_a
+        cache.put(key_c, {"detections": []}, 100)
+        assert cache.get(key_b) is None and cache.get(key_a) is not None
+        print("✅ LRU eviction theo số entry")
+        
+        cache.put(key_b, {"detections": []}, 950)
+        assert cache.stats()["bytes"] <= 1000 and cache.get(key_b) is not None
+        assert cache.get(key_a) is None and cache.get(key_c) is None
+        print("✅ LRU eviction theo dung lượng")
+        
+        key_new_model = cache.make_key(b"image-b", 0.25, 0.45, "v2", "none")
+        assert cache.get(key_new_model) is None
+        assert cache.stats()["entries"] == 0 and cache.stats()["invalidations"] == 1
+        print("✅ Cache bị xóa khi model version thay đổi")
+        
+        stats = cache.stats()
+        assert stats["hits"] == 3 and stats["misses"] == 5, stats
+        print(f"✅ Hit/miss counters: {stats['hits']}/{stats['misses']}")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Result cache test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_session_manager():
+    """Test SessionManager: giới hạn số session/memory (LRU) và sweeper"""
+    print("=" * 60)
+    print("🧪 TEST 13: Session Manager")
+    print("=" * 60)
+    
+    try:
+        from sessions import SessionManager
+        from deepsort import DeepSortTracker
+        
+        class _Tracker:
+            def __init__(self, memory_bytes=1000):
+                self.tracker = DeepSortTracker()
+                self.memory_bytes = memory_bytes
+            
+            def estimate_memory_bytes(self):
+                return self.memory_bytes
+            
+            def get_active_tracks_count(self):
+                return len(self.tracker.tracks)
+        
+        manager = SessionManager(lambda conf, iou: _Tracker(), max_sessions=3, max_memory_bytes=10000, timeout=60)
+        for session_id in ["a", "b", "c"]:
+            manager.get_or_create(session_id, 0.25, 0.45)
+        manager.get("a")                              # a mới dùng -> b là LRU
+        manager.get_or_create("d", 0.25, 0.45)
+        assert "b" not in manager and len(manager) == 3
+        print("✅ LRU eviction theo số session")
+        
+        manager.get("c").memory_bytes = 9000
+        manager.record_usage("c")
+        assert list(manager._sessions) == ["d", "c"], list(manager._sessions)
+        assert manager.total_memory_bytes == 10000
+        print("✅ LRU eviction theo memory ước tính")
+        
+        # Session đang được request giữ (acquire) không bị evict hay sweep tới khi release
+        pinned = SessionManager(lambda conf, iou: _Tracker(), max_sessions=2, timeout=60)
+        tracker = pinned.acquire("p", 0.25, 0.45)
+        pinned.get_or_create("q", 0.25, 0.45)
+        pinned.get_or_create("r", 0.25, 0.45)
+        assert "p" in pinned and "q" not in pinned and pinned.stats()["sessions"][1]["in_use"] == 1
+        pinned._sessions["p"].last_activity -= 120
+        assert pinned.sweep() == 0 and "p" in pinned
+        pinned.release("p", tracker)
+        pinned._sessions["p"].last_activity -= 120
+        pinned._sessions.move_to_end("p", last=False)
+        assert pinned.sweep() == 1 and "p" not in pinned
+        print("✅ Session đang dùng (pinned) không bị evict/sweep")
+        
+        manager.get_or_create("e", 0.25, 0.45)
+        manager._sessions["e"].last_activity -= 120
+        manager._sessions.move_to_end("e", last=False)
+        assert manager.sweep() == 1 and "e" not in manager and "c" in manager
+        stats = manager.stats()
+        assert stats["count"] == 1 and stats["sessions"][0]["session_id"] == "c"
+        print("✅ Sweeper xóa session hết hạn")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Session manager test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_session_store():
+    """Test serialize state DeepSORT và session store dùng chung giữa các worker"""
+    print("=" * 60)
+    print("🧪 TEST 14: Session Store")
+    print("=" * 60)
+    
+    try:
+        import tempfile
+        import numpy as np
+        from deepsort import DeepSortTracker
+        from sessions import SessionManager
+        from session_store import SQLiteSessionStore, KVSessionStore, LocalKVClient
+        
+        image = np.zeros((480, 640, 3), dtype=np.uint8)
+        
+        def detections(t):
+            return [
+                {'bbox': [100 + 5 * t, 100, 200 + 5 * t, 200], 'confidence': 0.9, 'class': 'car', 'class_id': 0},
+                {'bbox': [300, 120 + 3 * t, 380, 220 + 3 * t], 'confidence': 0.8, 'class': 'person', 'class_id': 1}
+            ]
+        
+        original = DeepSortTracker(max_age=30, min_hits=3, iou_threshold=0.3)
+        for t in range(5):
+            original.update(detections(t), image)
+        restored = DeepSortTracker.from_bytes(original.to_bytes())
+        for t in range(5, 10):
+            expected = [track.to_dict() for track in original.update(detections(t), image)]
+            actual = [track.to_dict() for track in restored.update(detections(t), image)]
+            assert [tr['track_id'] for tr in expected] == [tr['track_id'] for tr in actual]
+            assert np.allclose([tr['bbox'] for tr in expected], [tr['bbox'] for tr in actual])
+        assert DeepSortTracker.from_bytes(DeepSortTracker().to_bytes()).tracks == []
+        print("✅ DeepSORT state round-trip (tracking tiếp tục giống hệt)")
+        
+        class _Tracker:
+            def __init__(self):
+                self.tracker = DeepSortTracker()
+            
+            def export_state(self):
+                return self.tracker.to_bytes()
+            
+            def load_state(self, data):
+                self.tracker = DeepSortTracker.from_bytes(data)
+                loads.append(data)
+            
+            def reset(self):
+                self.tracker.reset()
+            
+            def estimate_memory_bytes(self):
+                return 1000
+            
+            def get_active_tracks_count(self):
+                return len(self.tracker.tracks)
+        
+        loads = []
+        with tempfile.TemporaryDirectory() as tmp:
+            stores = {
+                "sqlite": SQLiteSessionStore(Path(tmp) / "sessions.db"),
+                "kv": KVSessionStore(LocalKVClient())
+            }
+            for name, store in stores.items():
+                # 2 manager dùng chung store = 2 worker process
+                worker_a = SessionManager(lambda conf, iou: _Tracker(), timeout=60, store=store)
+                worker_b = SessionManager(lambda conf, iou: _Tracker(), timeout=60, store=store)
+                
+                tracker = worker_a.get_or_create("s1", 0.25, 0.45)
+                for t in range(4):
+                    tracker.tracker.update(detections(t), image)
+                worker_a.record_usage("s1")
+                
+                tracker = worker_b.get_or_create("s1", 0.25, 0.45)
+                assert len(tracker.tracker.tracks) == 2 and tracker.tracker.next_id == 3
+                tracker.tracker.update(detections(4), image)
+                age = tracker.tracker.tracks[0].age
+                worker_b.record_usage("s1")
+                
+                # Worker A thấy frame worker B đã xử lý
+                tracker = worker_a.get_or_create("s1", 0.25, 0.45)
+                assert tracker.tracker.tracks[0].age == age
+                
+                # Bản trong process còn là version mới nhất -> không tải lại state
+                worker_a.record_usage("s1")
+                del loads[:]
+                assert worker_a.get_or_create("s1", 0.25, 0.45) is tracker and loads == []
+                
+                # 2 worker cùng ghi từ 1 version: worker ghi sau bị từ chối rồi tải bản của worker kia
+                tracker_b = worker_b.get_or_create("s1", 0.25, 0.45)
+                tracker.tracker.update(detections(5), image)
+                tracker_b.tracker.update(detections(6), image)
+                worker_a.record_usage("s1")
+                worker_b.record_usage("s1")
+                assert worker_b.conflicts == 1 and worker_a.conflicts == 0
+                tracker_b = worker_b.get_or_create("s1", 0.25, 0.45)
+                assert tracker_b.tracker.to_bytes() == tracker.tracker.to_bytes()
+                assert store.save("s2", b"x", 60, 0) == 1 and store.save("s2", b"y", 60, 0) is None
+                assert store.save("s2", b"y", 60, 1) == 2 and store.load("s2") == (2, b"y")
+                assert store.load("s2", known_version=2) == (2, None)
+                store.delete("s2")
+                
+                assert worker_b.remove("s1") and store.load("s1") is None
+                assert worker_a.get("s1") is None
+                print(f"✅ Session dùng chung giữa 2 worker qua {name} store")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Session store test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_admission_control():
+    """Test AdmissionQueue: giới hạn slot + hàng đợi, từ chối khi đầy"""
+    print("=" * 60)
+    print("🧪 TEST 15: Admission Control")
+    print("=" * 60)
+    
+    try:
+        import asyncio
+        from admission import AdmissionQueue, AdmissionRejected
+        
+        async def scenario():
+            queue = AdmissionQueue("detect", max_concurrent=1, max_queue=1)
+            order = []
+            
+            async def request(name):
+                async with queue.slot():
+                    order.append(name)
+                    await asyncio.sleep(0.05)
+            
+            first = asyncio.create_task(request("first"))
+            await asyncio.sleep(0)
+            second = asyncio.create_task(request("second"))
+            await asyncio.sleep(0)
+            assert queue.active == 1 and queue.queue_depth == 1
+            
+            try:
+                await queue.acquire()
+                raise AssertionError("Request thứ 3 phải bị từ chối")
+            except AdmissionRejected as e:
+                assert e.retry_after >= 1
+            print("✅ Hàng đợi đầy -> từ chối ngay với Retry-After")
+            
+            await asyncio.gather(first, second)
+            assert order == ["first", "second"]
+            stats = queue.stats()
+            assert stats["active"] == 0 and stats["admitted"] == 2 and stats["rejected"] == 1
+            assert stats["service_time_ms"] >= 40
+            print("✅ Request chờ được xử lý theo thứ tự, metrics tốc độ xử lý")
+            
+            # Request đang chờ bị hủy (client disconnect) không giữ slot
+            blocker = asyncio.create_task(request("blocker"))
+            await asyncio.sleep(0)
+            waiting = asyncio.create_task(request("cancelled"))
+            await asyncio.sleep(0)
+            waiting.cancel()
+            await blocker
+            assert queue.active == 0 and queue.queue_depth == 0 and "cancelled" not in order
+            print("✅ Request bị hủy khi đang chờ được bỏ khỏi hàng đợi")
+        
+        asyncio.run(scenario())
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Admission control test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_request_deadlines():
+    """Test InferenceScheduler bỏ các request đã quá deadline trước khi predict"""
+    print("=" * 60)
+    print("🧪 TEST 16: Request Deadlines")
+    print("=" * 60)
+    
+    try:
+        import asyncio
+        import time
+        import numpy as np
+        from scheduler import InferenceScheduler, DeadlineExceeded
+        
+        class _Detector:
+            def __init__(self):
+                self.calls = 0
+            
+            def predict_batch(self, images, conf, iou):
+                self.calls += 1
+                time.sleep(0.2)
+                return [object() for _ in images]
+        
+        async def scenario():
+            detector = _Detector()
+            scheduler = InferenceScheduler(detector, window_ms=0, max_batch_size=1)
+            image = np.zeros((32, 32, 3), dtype=np.uint8)
+            
+            try:
+                await scheduler.submit(image, 0.25, 0.45, deadline=time.monotonic() - 1)
+                raise AssertionError("Request quá deadline phải bị từ chối")
+            except DeadlineExceeded:
+                pass
+            
+            # Request thứ 2 hết hạn trong lúc chờ request thứ 1 predict
+            first = asyncio.create_task(scheduler.submit(image, 0.25, 0.45))
+            second = asyncio.create_task(scheduler.submit(image, 0.25, 0.45, deadline=time.monotonic() + 0.05))
+            results = await asyncio.gather(first, second, return_exceptions=True)
+            await scheduler.stop()
+            
+            assert results[0] is not None and isinstance(results[1], DeadlineExceeded)
+            assert isinstance(results[1], asyncio.TimeoutError)
+            assert detector.calls == 1, detector.calls
+            assert scheduler.metrics.expired_requests == 1
+            print("✅ Request quá deadline bị bỏ trước khi predict (không tốn inference)")
+        
+        asyncio.run(scenario())
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Request deadlines test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_frame_sequencer():
+    """Test FrameSequencer: xử lý tuần tự từng session, latest wins"""
+    print("=" * 60)
+    print("🧪 TEST 17: Frame Sequencer")
+    print("=" * 60)
+    
+    try:
+        import asyncio
+        from frame_sequencer import FrameSequencer, FrameDropped
+        
+        async def scenario():
+            sequencer = FrameSequencer()
+            processed = []
+            running = set()
+            
+            def handler(seq, session_id="s"):
+                async def process():
+                    assert session_id not in running, "2 frame của cùng session chạy đồng thời"
+                    running.add(session_id)
+                    await asyncio.sleep(0.05)
+                    running.discard(session_id)
+                    processed.append(seq)
+                    return seq
+                return process
+            
+            async def send(seq, delay):
+                await asyncio.sleep(delay)
+                try:
+                    return (await sequencer.run("s", seq, handler(seq)))[1]
+                except FrameDropped as e:
+                    return e.reason
+            
+            outcomes = await asyncio.gather(
+                send(0, 0), send(1, 0.01), send(2, 0.02), send(3, 0.03), send(1, 0.07)
+            )
+            assert processed == [0, 3], processed
+            assert outcomes == [0, "superseded", "superseded", 3, "stale"], outcomes
+            stats = sequencer.stats("s")
+            assert stats["frames_received"] == 5 and stats["frames_dropped"] == 3
+            assert stats["drop_rate"] == 0.6
+            print("✅ Frame cũ bị drop, chỉ frame mới nhất được xử lý, không chạy đồng thời")
+            
+            # Không có seq -> theo thứ tự đến, session khác chạy song song
+            results = await asyncio.gather(
+                sequencer.run("s", None, handler(10)), sequencer.run("other", None, handler(20, "other"))
+            )
+            assert results[0][0] == 4 and results[1][0] == 0
+            print("✅ frame_seq mặc định theo thứ tự đến, mỗi session độc lập")
+            
+            # Reset chạy sau frame đang xử lý, frame đang chờ (gửi trước reset) bị drop
+            async def reset():
+                await asyncio.sleep(0.01)
+                async def process():
+                    assert "s" not in running, "reset chạy đồng thời với frame"
+                    processed.append("reset")
+                    return True
+                return await sequencer.reset("s", process)
+            
+            del processed[:]
+            outcomes = await asyncio.gather(send(20, 0), send(21, 0.005), reset(), send(22, 0.02))
+            assert processed == [20, "reset"], processed
+            assert outcomes == [20, "reset", True, "stale"], outcomes
+            assert sequencer.stats("s")["frames_received"] == 0
+            # Sau reset client đánh số lại từ 0
+            assert (await sequencer.run("s", 0, handler(0)))[1] == 0
+            assert (await sequencer.run("s", None, handler(1)))[0] == 1
+            assert sequencer.stats("s")["frames_dropped"] == 0
+            print("✅ Reset đi qua hàng đợi, frame gửi trước reset bị drop, seq đánh lại từ 0")
+        
+        asyncio.run(scenario())
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Frame sequencer test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_detections():
+    """Test Detections: struct-of-arrays từ YOLO result, lọc vectorized, dùng trực tiếp cho DeepSORT"""
+    print("=" * 60)
+    print("🧪 TEST 18: Detections")
+    print("=" * 60)
+    
+    try:
+        import numpy as np
+        from detections import Detections
+        from deepsort import DeepSortTracker
+        
+        class _Tensor:
+            def __init__(self, values):
+                self.values = np.asarray(values, dtype=np.float32)
+                self.transfers = 0
+            def cpu(self):
+                self.transfers += 1
+                return self
+            def numpy(self):
+                return self.values
+        
+        class _Boxes:
+            def __init__(self, rows):
+                self.data = _Tensor(rows)
+            def __len__(self):
+                return len(self.data.values)
+        
+        class _Result:
+            def __init__(self, rows):
+                self.boxes = _Boxes(rows)
+        
+        names = {0: 'person', 2: 'car'}
+        result = _Result([
+            [10, 10, 50, 80, 0.9, 0],
+            [60, 20, 60, 90, 0.8, 0],     # width = 0 -> bỏ
+            [100, 30, 160, 70, 0.7, 2],
+            [5, 5, 20, 20, 0.6, 7],       # class không có trong model -> bỏ
+        ])
+        detections = Detections.from_result(result, names)
+        assert result.boxes.data.transfers == 1
+        assert len(detections) == 2 and detections.xyxy.dtype == np.float32 and detections.xyxy.shape == (2, 4)
+        assert detections.class_id.tolist() == [0, 2] and detections.class_names == ['person', 'car']
+        assert len(Detections.from_result(None, names)) == 0
+        print("✅ 1 lần copy tensor, lọc box không hợp lệ vectorized")
+        
+        payload = detections.to_list()
+        # id theo vị trí box trong output của model (box bị lọc để lại khoảng trống)
+        assert payload[1] == {"id": 3, "class": "car", "class_id": 2, "confidence": 0.7,
+                              "bbox": [100.0, 30.0, 160.0, 70.0], "width": 60.0, "height": 40.0}
+        kept = detections[detections.confidence <= 0.8]
+        assert len(kept) == 1 and kept.class_names == ['car'] and kept.rescale((2.0, 2.0)).to_list()[0]["id"] == 3
+        print("✅ Chuyển sang JSON ở bước response, lọc theo mask")
+        
+        # DeepSORT nhận Detections trực tiếp, kết quả giống list dict
+        frame = np.random.default_rng(0).integers(0, 255, (120, 200, 3), dtype=np.uint8)
+        from_arrays, from_dicts = DeepSortTracker(), DeepSortTracker()
+        for t in range(5):
+            shifted = Detections(detections.xyxy + 2 * t, detections.confidence, detections.class_id, names)
+            dicts = [{'bbox': box.tolist(), 'class': names[c], 'class_id': c, 'confidence': float(conf)}
+                     for box, conf, c in zip(shifted.xyxy, shifted.confidence, shifted.class_id.tolist())]
+            a = [track.to_dict() for track in from_arrays.update(shifted, frame)]
+            b = [track.to_dict() for track in from_dicts.update(dicts, frame)]
+            assert [x['track_id'] for x in a] == [x['track_id'] for x in b]
+            assert np.allclose([x['bbox'] for x in a], [x['bbox'] for x in b])
+            assert [x['class'] for x in a] == ['person', 'car']
+        print("✅ DeepSortTracker dùng trực tiếp Detections")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Detections test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_video_pipeline():
+    """Test VideoPipeline: decode/inference/tracking/encode chạy song song, output theo thứ tự frame"""
+    print("=" * 60)
+    print("🧪 TEST 19: Video Pipeline")
+    print("=" * 60)
+    
+    try:
+        from video_pipeline import VideoPipeline
+    except ImportError as e:
+        print(f"⚠️  Skipping video pipeline test: {e}")
+        print()
+        return True
+    
+    try:
+        import json
+        import tempfile
+        import numpy as np
+        import cv2
+        
+        class _Tensor:
+            def __init__(self, values):
+                self.values = np.asarray(values, dtype=np.float32)
+            def cpu(self):
+                return self
+            def numpy(self):
+                return self.values
+        
+        class _Boxes:
+            def __init__(self, rows):
+                self.data = _Tensor(rows)
+            def __len__(self):
+                return len(self.data.values)
+        
+        class _Result:
+            def __init__(self, rows):
+                self.boxes = _Boxes(rows)
+        
+        class _Detector:
+            # Detector giả: 1 object di chuyển theo độ sáng của frame
+            classes = {0: 'person'}
+            def __init__(self):
+                self.batches = []
+            def predict_batch(self, images, conf, iou):
+                self.batches.append(len(images))
+                results = []
+                for img in images:
+                    x = float(img[0, 0, 0])
+                    results.append(_Result([[x, 20, x + 40, 80, 0.9, 0]]))
+                return results
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            video_path = os.path.join(tmp, "input.avi")
+            writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (160, 120))
+            for i in range(24):
+                writer.write(np.full((120, 160, 3), 10 + 2 * i, dtype=np.uint8))
+            writer.release()
+            
+            detector = _Detector()
+            pipeline = VideoPipeline(detector, batch_size=4, queue_size=2)
+            lines = [json.loads(line) for line in pipeline.iter_output(video_path, "ndjson")]
+            assert [line["frame"] for line in lines] == list(range(24))
+            assert max(detector.batches) <= 4 and sum(detector.batches) == 24
+            assert all(line["tracks"] for line in lines)
+            stats = pipeline.stats.to_dict()
+            assert stats["frames_done"] == 24 and stats["progress"] == 1.0
+            assert all(stage["frames"] == 24 for stage in stats["stages"].values())
+            print(f"✅ 24 frames theo thứ tự, batches={detector.batches}, {stats['throughput_fps']} fps")
+            
+            output_path = os.path.join(tmp, "tracks.txt")
+            pipeline.run(video_path, output_path, fmt="mot")
+            with open(output_path) as f:
+                rows = [line.strip().split(",") for line in f if line.strip()]
+            assert rows and all(len(row) == 10 for row in rows)
+            assert int(rows[-1][0]) == 24 and float(rows[-1][4]) == 40.0
+            print(f"✅ Output MOT: {len(rows)} dòng")
+            
+            # Consumer dừng sớm -> các stage thread dừng
+            outputs = pipeline.iter_output(video_path)
+            next(outputs)
+            outputs.close()
+            print("✅ Dừng pipeline giữa chừng")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Video pipeline test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_inference_backends():
+    """Test backend inference: tên file export cache, dùng lại cache, registry tách theo backend"""
+    print("=" * 60)
+    print("🧪 TEST 20: Inference Backends")
+    print("=" * 60)
+    
+    try:
+        from inference import INFERENCE_BACKENDS, exported_model_path, export_model
+        from model_registry import ModelRegistry
+    except ImportError as e:
+        print(f"⚠️  Skipping inference backends test: {e}")
+        print()
+        return True
+    
+    try:
+        import tempfile
+        
+        with tempfile.TemporaryDirectory() as tmp:
+            weights = Path(tmp) / "best.pt"
+            weights.write_bytes(b"weights")
+            
+            assert exported_model_path(weights, "torch") is None
+            assert exported_model_path(weights, "onnx").name == "best_640.onnx"
+            assert exported_model_path(weights, "torchscript", imgsz=320).name == "best_320.torchscript"
+            assert set(INFERENCE_BACKENDS) >= {"torch", "onnx", "torchscript"}
+            try:
+                exported_model_path(weights, "tensorrt")
+                raise AssertionError("backend không hỗ trợ phải bị từ chối")
+            except ValueError:
+                pass
+            print("✅ Tên file export theo backend và imgsz")
+            
+            # File export mới hơn weights -> dùng lại, không export lại
+            cached = exported_model_path(weights, "onnx")
+            cached.write_bytes(b"onnx")
+            os.utime(cached, (weights.stat().st_mtime + 10,) * 2)
+            assert export_model(weights, "onnx") == cached
+            assert export_model(weights, "torch") == weights
+            print("✅ Dùng lại model đã export (cache cạnh weights)")
+            
+            # Model INT8 không export tự động: chỉ load khi đã được quantize_model.py publish
+            int8 = exported_model_path(weights, "onnx-int8")
+            assert int8.name == "best_640_int8.onnx"
+            try:
+                export_model(weights, "onnx-int8")
+                raise AssertionError("thiếu model INT8 phải báo lỗi")
+            except FileNotFoundError:
+                pass
+            int8.write_bytes(b"int8")
+            os.utime(int8, (weights.stat().st_mtime + 10,) * 2)
+            assert export_model(weights, "onnx-int8") == int8
+            print("✅ Backend onnx-int8 dùng model đã quantize")
+            
+            # Publish lại model INT8 (best.pt không đổi) -> model_version đổi, cache kết quả bị invalidate
+            import inference
+            original_yolo = inference.YOLO
+            inference.YOLO = lambda *args, **kwargs: type("_Model", (), {"names": {0: "person"}})()
+            try:
+                version = inference.ObjectDetector(str(weights), backend="onnx-int8").model_version
+                int8.write_bytes(b"int8 v2")
+                os.utime(int8, (weights.stat().st_mtime + 20,) * 2)
+                assert inference.ObjectDetector(str(weights), backend="onnx-int8").model_version != version
+            finally:
+                inference.YOLO = original_yolo
+            print("✅ model_version theo cả file model đã export/quantize")
+        
+        registry = ModelRegistry()
+        assert registry._key("best.pt") == str(Path("best.pt").resolve())
+        assert len({registry._key("best.pt"), registry._key("best.pt", "onnx"),
+                    registry._key("best.pt", "onnx", 320)}) == 3
+        print("✅ Registry giữ detector riêng cho từng backend")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Inference backends test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_adaptive_input_resolution():
+    """Test decode JPEG ở kích thước giảm, đổi boxes về tọa độ gốc và chọn imgsz theo latency budget"""
+    print("=" * 60)
+    print("🧪 TEST 21: Adaptive Input Resolution")
+    print("=" * 60)
+    
+    try:
+        from inference import decode_image_reduced
+    except ImportError as e:
+        print(f"⚠️  Skipping adaptive input resolution test: {e}")
+        print()
+        return True
+    
+    try:
+        import numpy as np
+        import cv2
+        from detections import Detections
+        from scheduler import InferenceScheduler
+        
+        image = np.zeros((3000, 4000, 3), dtype=np.uint8)
+        cv2.rectangle(image, (1000, 800), (2599, 2199), (255, 255, 255), -1)
+        jpeg = cv2.imencode('.jpg', image)[1].tobytes()
+        
+        reduced, scale = decode_image_reduced(jpeg, 640)
+        assert reduced.shape[:2] == (750, 1000) and scale == (4.0, 4.0)
+        reduced, scale = decode_image_reduced(jpeg, 1280)
+        assert reduced.shape[:2] == (1500, 2000) and scale == (2.0, 2.0)
+        full, scale = decode_image_reduced(jpeg, None)
+        assert full.shape[:2] == (3000, 4000) and scale == (1.0, 1.0)
+        small = cv2.imencode('.jpg', image[:400, :600])[1].tobytes()
+        assert decode_image_reduced(small, 640)[0].shape[:2] == (400, 600)
+        png = cv2.imencode('.png', image[:1600, :1600])[1].tobytes()
+        assert decode_image_reduced(png, 320)[1] == (1.0, 1.0)
+        assert decode_image_reduced(b"not an image", 640)[0] is None
+        print("✅ JPEG lớn decode ở 1/2, 1/4, 1/8 kích thước (cạnh dài >= imgsz)")
+        
+        # Box trên ảnh decode 1/4 -> tọa độ ảnh gốc
+        reduced, scale = decode_image_reduced(jpeg, 640)
+        ys, xs = np.nonzero(reduced[..., 0] > 128)
+        box = Detections([[xs.min(), ys.min(), xs.max() + 1, ys.max() + 1]], [0.9], [0], {0: 'person'})
+        assert np.allclose(box.rescale(scale).xyxy, [[1000, 800, 2600, 2200]], atol=4)
+        assert box.rescale(None) is box
+        print("✅ Boxes được đổi về tọa độ ảnh gốc")
+        
+        class _Detector:
+            imgsz = 640
+        
+        scheduler = InferenceScheduler(_Detector())
+        assert scheduler.select_imgsz(50, [320, 640]) is None  # chưa có số liệu
+        scheduler.metrics.record_batch(2, 80.0, 640)  # 40ms / ảnh ở 640
+        assert abs(scheduler.estimate_image_ms(320) - 10.0) < 1e-6
+        assert scheduler.select_imgsz(50, [320, 416, 512, 640]) == 640
+        assert scheduler.select_imgsz(30, [320, 416, 512, 640]) == 512
+        assert scheduler.select_imgsz(5, [320, 416, 512, 640]) == 320
+        print("✅ Chọn imgsz lớn nhất vừa latency budget")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Adaptive input resolution test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def _stub_detector(model):
+    """
+    ObjectDetector thật (lock, detect_image, predict_batch, ...) chạy trên model giả
+    (không cần ultralytics model / file weights thật)
+    """
+    import tempfile
+    import inference
+    
+    with tempfile.TemporaryDirectory() as tmp:
+        weights = Path(tmp) / "best.pt"
+        weights.write_bytes(b"weights")
+        original_yolo = inference.YOLO
+        inference.YOLO = lambda *args, **kwargs: model
+        try:
+            return inference.ObjectDetector(str(weights))
+        finally:
+            inference.YOLO = original_yolo
+
+
+class _StubTensor:
+    def __init__(self, values):
+        self.values = values
+    def cpu(self):
+        return self
+    def numpy(self):
+        return self.values
+
+
+class _StubBoxes:
+    def __init__(self, rows):
+        import numpy as np
+        self.data = _StubTensor(np.asarray(rows, dtype=np.float32).reshape(-1, 6))
+    def __len__(self):
+        return len(self.data.values)
+
+
+class _StubResult:
+    """YOLO result giả: boxes.data (N, 6: x1 y1 x2 y2 conf cls), plot() đếm số lần vẽ"""
+    def __init__(self, rows, orig_img=None):
+        self.boxes = _StubBoxes(rows)
+        self.orig_img = orig_img
+        self.plots = 0
+    def plot(self):
+        import cv2
+        self.plots += 1
+        img = self.orig_img.copy()
+        for x1, y1, x2, y2 in self.boxes.data.values[:, :4].astype(int):
+            cv2.rectangle(img, (x1, y1), (x2, y2), (0, 255, 0), 2)
+        return img
+
+
+def test_shared_predictor_lock():
+    """Test các lần model.predict từ nhiều thread trên detector dùng chung chạy lần lượt"""
+    print("=" * 60)
+    print("🧪 TEST 22: Shared Predictor Lock")
+    print("=" * 60)
+    
+    try:
+        import inference
+    except ImportError as e:
+        print(f"⚠️  Skipping shared predictor lock test: {e}")
+        print()
+        return True
+    
+    try:
+        import tempfile
+        import threading
+        import time
+        import numpy as np
+        
+        class _Model:
+            """Giống predictor của ultralytics: args dùng chung bị ghi đè ở mỗi lần predict"""
+            names = {0: 'person'}
+            
+            def __init__(self):
+                self.args = None
+                self.active = 0
+                self.max_active = 0
+                self.mismatched = 0
+                self.calls = 0
+            
+            def predict(self, source, conf, iou, imgsz, **kwargs):
+                self.active += 1
+                self.max_active = max(self.max_active, self.active)
+                self.args = (conf, iou, imgsz)
+                time.sleep(0.01)
+                if self.args != (conf, iou, imgsz):
+                    self.mismatched += 1
+                self.calls += 1
+                self.active -= 1
+                return [_StubResult([]) for _ in (source if isinstance(source, list) else [source])]
+        
+        detector = _stub_detector(_Model())
+        
+        import cv2
+        from batch_engine import BatchEngine
+        from video_pipeline import VideoPipeline
+        
+        model = detector.model
+        image = np.zeros((32, 32, 3), dtype=np.uint8)
+        engine = BatchEngine(detector, batch_size=2, workers=2)
+        video_dir = tempfile.TemporaryDirectory()
+        video_path = os.path.join(video_dir.name, "input.avi")
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*"MJPG"), 10, (64, 48))
+        for i in range(8):
+            writer.write(np.full((48, 64, 3), 10 * i, dtype=np.uint8))
+        writer.release()
+        calls = [
+            lambda i: detector.detect_image(image, conf=0.1 + i / 100, render=False),
+            lambda i: detector.predict_batch([image, image], 0.3 + i / 100, 0.5, imgsz=320),
+            lambda i: detector.compare_thresholds(image, [0.2 + i / 100, 0.6]),
+            lambda i: list(engine.run([(f"{i}_{j}.jpg", image) for j in range(4)], conf=0.4 + i / 100)),
+            lambda i: list(VideoPipeline(detector, 0.5 + i / 100, batch_size=2).iter_output(video_path)),
+        ]
+        threads = [threading.Thread(target=call, args=(i,)) for i in range(5) for call in calls]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        video_dir.cleanup()
+        
+        assert model.calls >= 25 + 5 * 4, model.calls  # mỗi video 8 frame, batch tối đa 2
+        assert model.max_active == 1 and model.mismatched == 0, (model.max_active, model.mismatched)
+        print("✅ detect_image / predict_batch / compare_thresholds / BatchEngine / VideoPipeline "
+              "không chạy chồng trên predictor")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Shared predictor lock test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_inference_scheduler():
+    """Test InferenceScheduler: gom request đồng thời thành batch, nhóm theo conf/iou, trả lỗi cho từng request"""
+    print("=" * 60)
+    print("🧪 TEST 23: Inference Scheduler")
+    print("=" * 60)
+    
+    try:
+        import asyncio
+        import numpy as np
+        from scheduler import InferenceScheduler
+        
+        class _Detector:
+            imgsz = 640
+            
+            def __init__(self):
+                self.calls = []
+            
+            def predict_batch(self, images, conf, iou):
+                self.calls.append((len(images), conf, iou))
+                if conf == 0.9:
+                    raise RuntimeError("predict failed")
+                # Kết quả mang id ảnh để kiểm tra đúng thứ tự trả về
+                return [(int(img[0, 0, 0]), conf, iou) for img in images]
+        
+        def frame(i):
+            return np.full((8, 8, 3), i, dtype=np.uint8)
+        
+        async def scenario():
+            detector = _Detector()
+            scheduler = InferenceScheduler(detector, window_ms=50, max_batch_size=8)
+            
+            results = await asyncio.gather(*[scheduler.submit(frame(i), 0.25, 0.45) for i in range(5)])
+            assert results == [(i, 0.25, 0.45) for i in range(5)], results
+            assert detector.calls == [(5, 0.25, 0.45)], detector.calls
+            print("✅ 5 request đồng thời -> 1 lần predict, kết quả đúng request")
+            
+            detector.calls.clear()
+            results = await asyncio.gather(
+                scheduler.submit(frame(1), 0.25, 0.45), scheduler.submit(frame(2), 0.5, 0.45),
+                scheduler.submit(frame(3), 0.25, 0.45), scheduler.submit(frame(4), 0.5, 0.6)
+            )
+            assert results == [(1, 0.25, 0.45), (2, 0.5, 0.45), (3, 0.25, 0.45), (4, 0.5, 0.6)], results
+            assert sorted(detector.calls) == [(1, 0.5, 0.45), (1, 0.5, 0.6), (2, 0.25, 0.45)], detector.calls
+            print("✅ Batch được nhóm theo conf/iou")
+            
+            detector.calls.clear()
+            results = await asyncio.gather(
+                scheduler.submit(frame(1), 0.9, 0.45), scheduler.submit(frame(2), 0.9, 0.45),
+                scheduler.submit(frame(3), 0.25, 0.45), return_exceptions=True
+            )
+            assert all(isinstance(r, RuntimeError) for r in results[:2]) and results[2] == (3, 0.25, 0.45)
+            assert scheduler.metrics.failed_requests == 2
+            print("✅ Lỗi predict chỉ trả về cho các request trong nhóm bị lỗi")
+            
+            scheduler.max_batch_size = 2
+            detector.calls.clear()
+            await asyncio.gather(*[scheduler.submit(frame(i), 0.25, 0.45) for i in range(5)])
+            assert [size for size, _, _ in detector.calls] == [2, 2, 1], detector.calls
+            metrics = scheduler.get_metrics()
+            assert metrics["total_requests"] == 17 and metrics["batch_size_histogram"]["2"] >= 2
+            print("✅ Giới hạn max_batch_size, metrics batching")
+            await scheduler.stop()
+        
+        asyncio.run(scenario())
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Inference scheduler test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_model_registry():
+    """Test ModelRegistry: mỗi weights chỉ load 1 lần, các tracking session dùng chung detector"""
+    print("=" * 60)
+    print("🧪 TEST 24: Model Registry")
+    print("=" * 60)
+    
+    try:
+        import model_registry as registry_module
+        from tracker import VideoTracker
+    except ImportError as e:
+        print(f"⚠️  Skipping model registry test: {e}")
+        print()
+        return True
+    
+    try:
+        import threading
+        import time
+        
+        class _Detector:
+            loads = 0
+            
+            def __init__(self, model_path, conf_threshold, iou_threshold, backend, imgsz):
+                _Detector.loads += 1
+                time.sleep(0.05)  # load chậm -> các request đồng thời chờ cùng 1 lần load
+                self.backend = backend
+        
+        original = registry_module.ObjectDetector
+        registry_module.ObjectDetector = _Detector
+        try:
+            registry = registry_module.ModelRegistry()
+            detectors = []
+            threads = [
+                threading.Thread(target=lambda: detectors.append(registry.get("best.pt")))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            assert _Detector.loads == 1 and all(d is detectors[0] for d in detectors)
+            assert registry.is_loaded("best.pt") and registry.get("./best.pt") is detectors[0]
+            print("✅ 8 request đồng thời -> model chỉ load 1 lần")
+            
+            onnx = registry.get("best.pt", backend="onnx")
+            assert onnx is not detectors[0] and _Detector.loads == 2
+            assert registry.unload("best.pt") and not registry.is_loaded("best.pt")
+            print("✅ Detector riêng theo backend, unload khỏi registry")
+        finally:
+            registry_module.ObjectDetector = original
+        
+        # Mỗi session chỉ giữ state DeepSORT + thresholds riêng, không sửa detector dùng chung
+        shared = detectors[0]
+        first = VideoTracker(detector=shared, conf_threshold=0.3)
+        second = VideoTracker(detector=shared, conf_threshold=0.6)
+        assert first.detector is second.detector is shared
+        assert first.tracker is not second.tracker
+        assert (first.conf_threshold, second.conf_threshold) == (0.3, 0.6)
+        print("✅ Các tracking session dùng chung detector, state tracking riêng")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Model registry test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_in_memory_decode():
+    """Test decode ảnh upload trực tiếp từ bytes (không qua file tạm)"""
+    print("=" * 60)
+    print("🧪 TEST 25: In-memory Decode")
+    print("=" * 60)
+    
+    try:
+        from inference import decode_image_bytes, load_image
+    except ImportError as e:
+        print(f"⚠️  Skipping in-memory decode test: {e}")
+        print()
+        return True
+    
+    try:
+        import tempfile
+        import numpy as np
+        import cv2
+        
+        image = np.zeros((48, 64, 3), dtype=np.uint8)
+        image[:, :32] = (255, 0, 0)  # nửa trái màu xanh dương (BGR)
+        png = cv2.imencode('.png', image)[1].tobytes()
+        
+        decoded = decode_image_bytes(png)
+        assert decoded.shape == (48, 64, 3) and np.array_equal(decoded, image)
+        assert np.array_equal(load_image(bytearray(png)), image)
+        assert np.array_equal(load_image(memoryview(png)), image)
+        print("✅ Bytes PNG decode giữ nguyên pixel và thứ tự kênh BGR")
+        
+        assert decode_image_bytes(b"") is None and decode_image_bytes(b"not an image") is None
+        assert load_image(b"not an image") is None
+        print("✅ File rỗng / không phải ảnh -> None")
+        
+        assert load_image(image) is image
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "image.png")
+            cv2.imwrite(path, image)
+            assert np.array_equal(load_image(path), image)
+            assert load_image(os.path.join(tmp, "missing.png")) is None
+        print("✅ Array dùng trực tiếp, vẫn đọc được từ đường dẫn")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ In-memory decode test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_render_modes():
+    """Test render=False bỏ qua vẽ boxes / convert màu, chỉ trả boxes hoặc tracks"""
+    print("=" * 60)
+    print("🧪 TEST 26: Render Modes")
+    print("=" * 60)
+    
+    try:
+        from tracker import VideoTracker
+    except ImportError as e:
+        print(f"⚠️  Skipping render modes test: {e}")
+        print()
+        return True
+    
+    try:
+        import numpy as np
+        
+        class _Model:
+            names = {0: 'person'}
+            
+            def __init__(self):
+                self.results = []
+            
+            def predict(self, source, **kwargs):
+                images = source if isinstance(source, list) else [source]
+                self.results = [_StubResult([[10, 10, 50, 60, 0.9, 0]], img) for img in images]
+                return self.results
+        
+        model = _Model()
+        detector = _stub_detector(model)
+        image = np.zeros((80, 100, 3), dtype=np.uint8)
+        image[..., 0] = 255  # BGR: xanh dương
+        
+        result, img_rgb = detector.detect_image(image, render=False)
+        assert result is model.results[0] and img_rgb is None and result.plots == 0
+        print("✅ render=False: không vẽ, không convert màu, vẫn có boxes")
+        
+        result, img_rgb = detector.detect_image(image)
+        assert result.plots == 1 and img_rgb.shape == image.shape
+        assert tuple(img_rgb[0, 0]) == (0, 0, 255)  # đã chuyển sang RGB cho web
+        print("✅ render=True: ảnh đã vẽ boxes ở dạng RGB")
+        
+        tracker = VideoTracker(detector=detector)
+        _, img_rgb, tracks = tracker.process_frame(image, render=False)
+        assert img_rgb is None and len(tracks) == 1 and tracks[0]["bbox"] == [10.0, 10.0, 50.0, 60.0]
+        _, img_rgb, tracks = tracker.process_frame(image, render=True)
+        assert img_rgb.shape == image.shape and len(tracks) == 1
+        print("✅ Tracking render=False chỉ trả tracks (client tự vẽ)")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Render modes test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_compare_thresholds():
+    """Test compare_thresholds: 1 lần predict ở threshold thấp nhất, lọc boxes cho các threshold cao hơn"""
+    print("=" * 60)
+    print("🧪 TEST 27: Compare Thresholds")
+    print("=" * 60)
+    
+    try:
+        import inference  # noqa: F401
+    except ImportError as e:
+        print(f"⚠️  Skipping compare thresholds test: {e}")
+        print()
+        return True
+    
+    try:
+        import numpy as np
+        
+        rows = [
+            [0, 0, 10, 10, 0.15, 0],
+            [5, 5, 20, 20, 0.30, 1],
+            [8, 8, 30, 30, 0.55, 0],
+            [1, 1, 40, 40, 0.80, 2],
+        ]
+        
+        class _Model:
+            names = {0: 'person', 1: 'car', 2: 'dog'}
+            
+            def __init__(self):
+                self.calls = []
+            
+            def predict(self, source, conf, **kwargs):
+                self.calls.append(conf)
+                return [_StubResult([row for row in rows if row[4] >= conf], source)]
+        
+        model = _Model()
+        detector = _stub_detector(model)
+        image = np.zeros((48, 48, 3), dtype=np.uint8)
+        
+        comparisons = detector.compare_thresholds(image, [0.5, 0.1, 0.25, 0.75])
+        assert model.calls == [0.1], model.calls
+        assert {t: c['count'] for t, c in comparisons.items()} == {0.5: 2, 0.1: 4, 0.25: 3, 0.75: 1}
+        assert sorted(comparisons[0.25]['classes']) == ['car', 'dog', 'person']
+        assert comparisons[0.75]['classes'] == ['dog']
+        print("✅ 1 lần predict cho 4 thresholds, count/classes đúng từng threshold")
+        
+        assert detector.compare_thresholds(image, []) == {} and model.calls == [0.1]
+        print("✅ Không có threshold -> không predict")
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ Compare thresholds test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
+def test_websocket_tracking():
+    """Test /ws/track: frame qua frame sequencer, payload có class, reset và frame lỗi"""
+    print("=" * 60)
+    print("🧪 TEST 28: WebSocket Tracking")
+    print("=" * 60)
+    
+    try:
+        import inference
+        from fastapi.testclient import TestClient  # noqa: F401
+    except ImportError as e:
+        print(f"⚠️  Skipping websocket tracking test: {e}")
+        print()
+        return True
+    
+    try:
+        import json
+        import struct
+        import tempfile
+        import cv2
+        import numpy as np
+        
+        class _Model:
+            names = {0: 'person', 1: 'car'}
+            
+            def predict(self, source, **kwargs):
+                images = source if isinstance(source, list) else [source]
+                return [_StubResult([[10, 10, 60, 60, 0.9, 0], [80, 20, 150, 90, 0.8, 1]], image) for image in images]
+        
+        # app tìm best.pt theo thư mục hiện tại -> chạy trong thư mục tạm với model giả
+        cwd = os.getcwd()
+        original_yolo = inference.YOLO
+        with tempfile.TemporaryDirectory() as tmp:
+            Path(tmp, "best.pt").write_bytes(b"weights")
+            os.chdir(tmp)
+            inference.YOLO = lambda *args, **kwargs: _Model()
+            try:
+                import app
+                client = TestClient(app.app)
+                frame = cv2.imencode('.jpg', np.full((240, 320, 3), 120, dtype=np.uint8))[1].tobytes()
+                
+                with client.websocket_connect('/ws/track?session_id=ws_test') as ws:
+                    ready = ws.receive_json()
+                    assert ready['type'] == 'ready' and 'class' in ready['fields']
+                    
+                    for seq in range(1, 6):
+                        ws.send_bytes(struct.pack('>I', seq) + frame)
+                    seqs, dropped = [], []
+                    while not seqs or seqs[-1] != 5:
+                        message = ws.receive_json()
+                        if message['type'] == 'dropped':
+                            # Frame bị sequencer bỏ vẫn được báo để client gửi frame tiếp
+                            assert message['reason'] == 'superseded', message
+                            dropped.append(message['seq'])
+                            continue
+                        assert message['type'] == 'tracks', message
+                        seqs.append(message['seq'])
+                    assert seqs[0] == 1 and sorted(seqs + dropped) == [1, 2, 3, 4, 5], (seqs, dropped)
+                    assert message['dropped'] == len(dropped)
+                    tracks = [dict(zip(ready['fields'], row)) for row in message['tracks']]
+                    assert sorted(t['class'] for t in tracks) == ['car', 'person'], tracks
+                    print(f"✅ Frame đi qua frame sequencer (xử lý {seqs}, drop {message['dropped']}), payload có class")
+                    
+                    ws.send_text(json.dumps({"type": "reset"}))
+                    assert ws.receive_json() == {"type": "reset", "session_id": "ws_test"}
+                    ws.send_bytes(struct.pack('>I', 6) + b'not a jpeg')
+                    message = ws.receive_json()
+                    assert message['type'] == 'error' and message['seq'] == 6
+                    ws.send_bytes(struct.pack('>I', 7) + frame)
+                    message = ws.receive_json()
+                    assert message['type'] == 'tracks' and message['seq'] == 7
+                    print("✅ Reset qua hàng đợi, frame lỗi trả error, tracking tiếp tục")
+                
+                session = [s for s in app.session_manager.stats()['sessions'] if s['session_id'] == 'ws_test']
+                assert session and session[0]['in_use'] == 0
+                print("✅ Session không còn bị pin sau khi đóng kết nối")
+            finally:
+                inference.YOLO = original_yolo
+                os.chdir(cwd)
+        
+        print()
+        return True
+    except Exception as e:
+        print(f"❌ WebSocket tracking test failed: {e}")
+        import traceback
+        traceback.print_exc()
+        print()
+        return False
+
+
 def main():
     """Run all tests"""
     print("\n" + "=" * 60)
@@ -235,6 +1895,29 @@ def main():
     results.append(("DeepSORT Tracker", test_deepsort_tracker()))
     results.append(("VideoTracker", test_video_tracker()))
     results.append(("Tracking Pipeline", test_tracking_pipeline()))
+    results.append(("Vectorized Association", test_vectorized_association()))
+    results.append(("Batched Kalman Filter", test_batch_kalman_filter()))
+    results.append(("Batched Feature Extractor", test_batched_feature_extractor()))
+    results.append(("Detection Stride", test_detection_stride()))
+    results.append(("Batch Engine", test_batch_engine()))
+    results.append(("Job Manager", test_job_manager()))
+    results.append(("Result Cache", test_result_cache()))
+    results.append(("Session Manager", test_session_manager()))
+    results.append(("Session Store", test_session_store()))
+    results.append(("Admission Control", test_admission_control()))
+    results.append(("Request Deadlines", test_request_deadlines()))
+    results.append(("Frame Sequencer", test_frame_sequencer()))
+    results.append(("Detections", test_detections()))
+    results.append(("Video Pipeline", test_video_pipeline()))
+    results.append(("Inference Backends", test_inference_backends()))
+    results.append(("Adaptive Input Resolution", test_adaptive_input_resolution()))
+    results.append(("Shared Predictor Lock", test_shared_predictor_lock()))
+    results.append(("Inference Scheduler", test_inference_scheduler()))
+    results.append(("Model Registry", test_model_registry()))
+    results.append(("In-memory Decode", test_in_memory_decode()))
+    results.append(("Render Modes", test_render_modes()))
+    results.append(("Compare Thresholds", test_compare_thresholds()))
+    results.append(("WebSocket Tracking", test_websocket_tracking()))
     
     # Summary
     print("=" * 60)